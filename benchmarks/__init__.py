@@ -0,0 +1 @@
+"""Benchmark harness and local stand-in servers for the model backends."""
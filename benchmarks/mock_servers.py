@@ -0,0 +1,258 @@
+"""Local stand-ins for LM Studio / OpenAI and the LightRAG server.
+
+Run standalone to point the Streamlit app at them::
+
+    python -m benchmarks.mock_servers --llm-port 1234 --lightrag-port 9621
+"""
+import argparse
+import hashlib
+import json
+import socket
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+_WORDS = (
+    "The image shows no acute cardiopulmonary abnormality . Lungs are clear bilaterally with normal "
+    "heart size and mediastinal contours . Recommend clinical correlation and follow up as needed ."
+).split()
+
+
+def fake_completion(n_tokens):
+    return [_WORDS[i % len(_WORDS)] + " " for i in range(n_tokens)]
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server_version = "MockBackend/1.0"
+
+    def setup(self):
+        super().setup()
+        # Headers and body go out in separate writes; avoid Nagle/delayed-ACK stalls
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def log_message(self, *args):
+        pass
+
+    def _read_json(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length) if length else b""
+        with self.server.lock:
+            self.server.stats["requests"] += 1
+            self.server.stats["request_bytes"] += len(body)
+        return json.loads(body or b"{}")
+
+    def _send_json(self, obj, status=200, started=None):
+        out = json.dumps(obj).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(out)))
+        if started is not None:
+            self.send_header("X-Server-Time-Ms", f"{(time.perf_counter() - started) * 1000:.3f}")
+        self.end_headers()
+        self.wfile.write(out)
+
+    def _start_chunked(self, content_type):
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+    def _chunk(self, data):
+        self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+        self.wfile.flush()
+
+
+class LLMHandler(_Handler):
+    """OpenAI-compatible ``/v1/chat/completions`` and ``/v1/embeddings``."""
+
+    def do_GET(self):
+        if self.path.rstrip("/") in ("/v1/models", "/health"):
+            self._send_json({"data": [{"id": self.server.model}]})
+        else:
+            self._send_json({"error": "not found"}, status=404)
+
+    def do_POST(self):
+        started = time.perf_counter()
+        body = self._read_json()
+        if self.path.endswith("/embeddings"):
+            return self._embeddings(body, started)
+        if not self.path.endswith("/chat/completions"):
+            return self._send_json({"error": "not found"}, status=404)
+        cfg = self.server.config
+        n_tokens = min(int(body.get("max_tokens") or cfg["completion_tokens"]), cfg["completion_tokens"])
+        tokens = fake_completion(n_tokens)
+        prompt_tokens = len(json.dumps(body.get("messages", []))) // 4
+        time.sleep(cfg["ttft_s"])
+        if body.get("stream"):
+            self._start_chunked("text/event-stream")
+            for token in tokens:
+                event = {"object": "chat.completion.chunk", "model": body.get("model"), "choices": [{"index": 0, "delta": {"content": token}}]}
+                self._chunk(b"data: " + json.dumps(event).encode("utf-8") + b"\n\n")
+                time.sleep(1.0 / cfg["tokens_per_s"])
+            usage = {"prompt_tokens": prompt_tokens, "completion_tokens": n_tokens, "total_tokens": prompt_tokens + n_tokens}
+            final = {"object": "chat.completion.chunk", "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}], "usage": usage}
+            self._chunk(b"data: " + json.dumps(final).encode("utf-8") + b"\n\n")
+            self._chunk(b"data: [DONE]\n\n")
+            self._chunk(b"")
+            return
+        time.sleep(n_tokens / cfg["tokens_per_s"])
+        self._send_json({
+            "object": "chat.completion",
+            "model": body.get("model"),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": "".join(tokens)}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": n_tokens, "total_tokens": prompt_tokens + n_tokens},
+        }, started=started)
+
+    def _embeddings(self, body, started):
+        inputs = body.get("input")
+        inputs = [inputs] if isinstance(inputs, str) else list(inputs or [])
+        dim = self.server.config["embedding_dim"]
+        data = [{"object": "embedding", "index": i, "embedding": hash_embedding(text, dim)} for i, text in enumerate(inputs)]
+        time.sleep(self.server.config["embedding_latency_s"])
+        self._send_json({"object": "list", "data": data, "model": body.get("model")}, started=started)
+
+
+def hash_embedding(text, dim=768):
+    """Deterministic bag-of-words embedding: similar texts get similar vectors."""
+    vec = [0.0] * dim
+    for word in text.lower().split():
+        h = int(hashlib.md5(word.strip(".,?!").encode("utf-8")).hexdigest(), 16)
+        vec[h % dim] += 1.0 if (h >> 64) & 1 else -1.0
+    norm = sum(v * v for v in vec) ** 0.5 or 1.0
+    return [v / norm for v in vec]
+
+
+class LightRAGHandler(_Handler):
+    """``/query``, ``/query/stream``, ``/documents/text`` and ``/documents/track_status``."""
+
+    def do_GET(self):
+        if self.path.startswith("/documents/track_status/"):
+            track_id = self.path.rsplit("/", 1)[1]
+            doc = self.server.documents.get(track_id)
+            if doc is None:
+                return self._send_json({"track_id": track_id, "documents": [], "total_count": 0})
+            elapsed = time.time() - doc["created"]
+            done = elapsed >= self.server.config["processing_s"]
+            metadata = {"processing_start_time": int(doc["created"])}
+            if done:
+                metadata["processing_end_time"] = int(doc["created"] + self.server.config["processing_s"])
+            return self._send_json({
+                "track_id": track_id,
+                "documents": [{"id": doc["id"], "status": "processed" if done else "processing", "metadata": metadata}],
+                "total_count": 1,
+            })
+        if self.path == "/health":
+            return self._send_json({"status": "healthy"})
+        self._send_json({"error": "not found"}, status=404)
+
+    def do_POST(self):
+        started = time.perf_counter()
+        body = self._read_json()
+        cfg = self.server.config
+        if self.path == "/documents/text":
+            doc_id = "doc-" + hashlib.md5(body.get("text", "").strip().encode("utf-8")).hexdigest()
+            with self.server.lock:
+                track_id = f"insert_{len(self.server.documents):06d}"
+                self.server.documents[track_id] = {"id": doc_id, "created": time.time()}
+            return self._send_json({"status": "success", "message": "queued", "track_id": track_id}, started=started)
+        tokens = fake_completion(cfg["completion_tokens"])
+        context = "-----Entities-----\n" + "\n".join(f"entity {i}: {body.get('query', '')}" for i in range(int(body.get("kg_top_k") or 5)))
+        time.sleep(cfg["ttft_s"])
+        if self.path == "/query/stream":
+            self._start_chunked("application/x-ndjson")
+            self._chunk(json.dumps({"references": [{"reference_id": "1", "file_path": "conditions.csv"}]}).encode("utf-8") + b"\n")
+            if body.get("only_need_context"):
+                self._chunk(json.dumps({"response": context}).encode("utf-8") + b"\n")
+            else:
+                for token in tokens:
+                    self._chunk(json.dumps({"response": token}).encode("utf-8") + b"\n")
+                    time.sleep(1.0 / cfg["tokens_per_s"])
+            self._chunk(b"")
+            return
+        if self.path == "/query":
+            if body.get("only_need_context"):
+                answer = context
+            else:
+                time.sleep(len(tokens) / cfg["tokens_per_s"])
+                answer = "".join(tokens)
+            return self._send_json({"response": answer, "references": [{"reference_id": "1", "file_path": "conditions.csv"}]}, started=started)
+        self._send_json({"error": "not found"}, status=404)
+
+
+DEFAULT_LLM_CONFIG = {
+    "ttft_s": 0.2,
+    "tokens_per_s": 60.0,
+    "completion_tokens": 120,
+    "embedding_dim": 768,
+    "embedding_latency_s": 0.005,
+}
+DEFAULT_LIGHTRAG_CONFIG = {
+    "ttft_s": 0.3,
+    "tokens_per_s": 80.0,
+    "completion_tokens": 120,
+    "processing_s": 0.5,
+}
+
+
+class MockServer:
+    """A stand-in server running on a daemon thread; use as a context manager."""
+
+    def __init__(self, handler, port=0, **config):
+        defaults = DEFAULT_LLM_CONFIG if handler is LLMHandler else DEFAULT_LIGHTRAG_CONFIG
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", port), handler)
+        self.httpd.daemon_threads = True
+        self.httpd.config = dict(defaults, **config)
+        self.httpd.model = "medgemma-4b-it"
+        self.httpd.stats = {"requests": 0, "request_bytes": 0}
+        self.httpd.documents = {}
+        self.httpd.lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.httpd.server_address[1]}"
+
+    @property
+    def stats(self):
+        """A consistent snapshot of the request counters."""
+        with self.httpd.lock:
+            return dict(self.httpd.stats)
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--llm-port", type=int, default=1234)
+    parser.add_argument("--lightrag-port", type=int, default=9621)
+    parser.add_argument("--ttft", type=float, default=DEFAULT_LLM_CONFIG["ttft_s"])
+    parser.add_argument("--tokens-per-s", type=float, default=DEFAULT_LLM_CONFIG["tokens_per_s"])
+    parser.add_argument("--completion-tokens", type=int, default=DEFAULT_LLM_CONFIG["completion_tokens"])
+    args = parser.parse_args()
+    llm = MockServer(LLMHandler, args.llm_port, ttft_s=args.ttft, tokens_per_s=args.tokens_per_s, completion_tokens=args.completion_tokens).start()
+    rag = MockServer(LightRAGHandler, args.lightrag_port).start()
+    print(f"LLM stand-in on {llm.url}/v1, LightRAG stand-in on {rag.url} (Ctrl+C to stop)")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        llm.stop()
+        rag.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,389 @@
+"""Scripted end-to-end benchmarks against local stand-in backends.
+
+Drives the real page code (the Streamlit scripts through AppTest, and
+`analyze_image_with_model` / `stream_image_analysis` directly) with the
+bundled images/ and inputs/ data, and reports latency percentiles,
+request payload sizes, client-side overhead and throughput under N
+concurrent sessions::
+
+    python -m benchmarks.run_benchmarks --sessions 4 --iterations 2
+    python -m benchmarks.run_benchmarks --compare benchmarks/results/<older>.json
+"""
+import argparse
+import importlib.util
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+from benchmarks.mock_servers import LightRAGHandler, LLMHandler, MockServer
+
+REPO_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+RESULTS_DIR = os.path.join(REPO_ROOT, "benchmarks", "results")
+IMAGES_DIR = os.path.join(REPO_ROOT, "images")
+
+DASHBOARD_QUESTIONS = [
+    "What are the common symptoms of seasonal allergic rhinitis?",
+    "Summarize the active conditions and allergies of patient 1739419d-98e4-5f73-8b83-aa414dcf46a3.",
+    "Which care plans are recorded for patient 1603f9c6?",
+]
+PAGES = {"dashboard": "general_dashboard.py", "retrieval": "lightrag_retrieval.py", "vlm": "vlm_image_Analysis.py"}
+# Budgets for a widget-interaction rerun (no model call) and for a fresh process's first render
+RERUN_TARGET_S = float(os.getenv("BENCH_RERUN_TARGET_MS", "150")) / 1000
+COLD_START_TARGET_S = float(os.getenv("BENCH_COLD_START_TARGET_S", "3"))
+RERUNS_PER_ITERATION = 10
+RETRIEVAL_QUERIES = [
+    "Which patients have a documented aspirin allergy?",
+    "List care plans linked to minor surgery.",
+]
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of `values` (0 for an empty list)."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, int(round(pct / 100.0 * len(ordered) + 0.5)) - 1))
+    return ordered[rank]
+
+
+def _load_page_module(name):
+    spec = importlib.util.spec_from_file_location(name, os.path.join(REPO_ROOT, "pages", f"{name}.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def _image_files():
+    return [os.path.join(IMAGES_DIR, n) for n in sorted(os.listdir(IMAGES_DIR)) if n.lower().endswith((".png", ".jpg", ".jpeg"))]
+
+
+class Scenario:
+    """One scripted workload; `run_session` performs one session's requests."""
+
+    name = ""
+    backend = "llm"
+
+    def __init__(self, llm, rag, iterations):
+        self.llm = llm
+        self.rag = rag
+        self.iterations = iterations
+
+    def model_time(self, n_requests=1):
+        """Simulated server time for one request, used to derive client overhead."""
+        cfg = (self.llm if self.backend == "llm" else self.rag).httpd.config
+        return n_requests * (cfg["ttft_s"] + cfg["completion_tokens"] / cfg["tokens_per_s"])
+
+    def run_session(self, record):
+        raise NotImplementedError
+
+
+class VLMScenario(Scenario):
+    name = "vlm_analyze"
+
+    def __init__(self, *args, stream=False):
+        super().__init__(*args)
+        self.stream = stream
+        self.name = "vlm_stream" if stream else "vlm_analyze"
+        self.page = _load_page_module("vlm_image_Analysis")
+
+    def run_session(self, record):
+        pipe = self.page.load_model()
+        for _ in range(self.iterations):
+            for path in _image_files():
+                with open(path, "rb") as f:
+                    data = f.read()
+                start = time.perf_counter()
+                if self.stream:
+                    stats = {}
+                    "".join(self.page.stream_image_analysis(pipe, data, "Generate a compact clinical report", None, stats))
+                    record(time.perf_counter() - start, self.model_time(), ttft=stats.get("ttft_s"))
+                else:
+                    self.page.analyze_image_with_model(pipe, data, "Generate a compact clinical report", use_cache=False)
+                    record(time.perf_counter() - start, self.model_time())
+
+
+class AppScenario(Scenario):
+    """Runs a page script through Streamlit's AppTest, one chat turn per measurement."""
+
+    page = ""
+    inputs = ()
+
+    def configure(self, at):
+        pass
+
+    def run_session(self, record):
+        from streamlit.testing.v1 import AppTest
+
+        at = AppTest.from_file(os.path.join(REPO_ROOT, "pages", self.page), default_timeout=120)
+        at.run()
+        self.configure(at)
+        for _ in range(self.iterations):
+            for text in self.inputs:
+                start = time.perf_counter()
+                at.chat_input[0].set_value(text).run()
+                elapsed = time.perf_counter() - start
+                if at.exception:
+                    raise RuntimeError(at.exception[0].value)
+                record(elapsed, self.model_time())
+
+
+class DashboardScenario(AppScenario):
+    page = "general_dashboard.py"
+    inputs = DASHBOARD_QUESTIONS
+
+    def __init__(self, *args, source="Local Offline Model"):
+        super().__init__(*args)
+        self.source = source
+        self.name = {"Local Offline Model": "dashboard_local", "LightRAG Server": "dashboard_lightrag"}.get(source, "dashboard_openai")
+
+    def configure(self, at):
+        at.sidebar.radio[0].set_value(self.source).run()
+
+
+class RetrievalScenario(AppScenario):
+    page = "lightrag_retrieval.py"
+    inputs = RETRIEVAL_QUERIES
+    backend = "lightrag"
+
+    def __init__(self, *args, stream=True, local=False):
+        super().__init__(*args)
+        self.stream = stream
+        self.local = local
+        if local:
+            # Local mode embeds and generates against the LM Studio stand-in
+            self.backend = "llm"
+            self.name = "retrieval_local"
+            # The page only searches; build the index up front, as the sidebar action would
+            from utils.vector_index import get_local_index
+
+            get_local_index().sync()
+        else:
+            self.name = "retrieval_stream" if stream else "retrieval_query"
+
+    def configure(self, at):
+        if self.local:
+            at.radio[0].set_value("Local Index")
+        for box in at.checkbox:
+            if box.label == "Stream Response":
+                box.set_value(self.stream)
+        at.run()
+
+
+class RerunScenario(AppScenario):
+    """Times plain reruns of a page, as after any widget interaction that makes no model call."""
+
+    target_s = RERUN_TARGET_S
+
+    def __init__(self, *args, page="dashboard"):
+        super().__init__(*args)
+        self.page = PAGES[page]
+        self.name = f"rerun_{page}"
+
+    def model_time(self, n_requests=1):
+        return 0.0
+
+    def configure(self, at):
+        # Show the sample image so the VLM rerun includes image display
+        for button in at.button:
+            if button.label.endswith("Load Sample Image"):
+                button.click().run()
+
+    def run_session(self, record):
+        from streamlit.testing.v1 import AppTest
+
+        at = AppTest.from_file(os.path.join(REPO_ROOT, "pages", self.page), default_timeout=120)
+        at.run()
+        self.configure(at)
+        for _ in range(self.iterations * RERUNS_PER_ITERATION):
+            start = time.perf_counter()
+            at.run()
+            elapsed = time.perf_counter() - start
+            if at.exception:
+                raise RuntimeError(at.exception[0].value)
+            record(elapsed, 0.0)
+
+
+_COLD_START_SCRIPT = """
+import sys, time
+start = time.perf_counter()
+from streamlit.testing.v1 import AppTest
+at = AppTest.from_file(sys.argv[1], default_timeout=120)
+at.run()
+if at.exception:
+    raise SystemExit(at.exception[0].value)
+print(time.perf_counter() - start)
+"""
+
+
+class ColdStartScenario(Scenario):
+    """First render of every page in a fresh interpreter (imports, config, first script run)."""
+
+    name = "cold_start"
+    target_s = COLD_START_TARGET_S
+
+    def model_time(self, n_requests=1):
+        return 0.0
+
+    def run_session(self, record):
+        for _ in range(self.iterations):
+            for page in PAGES.values():
+                start = time.perf_counter()
+                subprocess.run(
+                    [sys.executable, "-c", _COLD_START_SCRIPT, os.path.join(REPO_ROOT, "pages", page)],
+                    cwd=REPO_ROOT, check=True, capture_output=True,
+                )
+                record(time.perf_counter() - start, 0.0)
+
+
+SCENARIOS = {
+    "vlm_analyze": lambda llm, rag, it: VLMScenario(llm, rag, it, stream=False),
+    "vlm_stream": lambda llm, rag, it: VLMScenario(llm, rag, it, stream=True),
+    "dashboard_local": lambda llm, rag, it: DashboardScenario(llm, rag, it, source="Local Offline Model"),
+    "dashboard_openai": lambda llm, rag, it: DashboardScenario(llm, rag, it, source="OpenAI Model"),
+    "dashboard_lightrag": lambda llm, rag, it: DashboardScenario(llm, rag, it, source="LightRAG Server"),
+    "retrieval_stream": lambda llm, rag, it: RetrievalScenario(llm, rag, it, stream=True),
+    "retrieval_query": lambda llm, rag, it: RetrievalScenario(llm, rag, it, stream=False),
+    "retrieval_local": lambda llm, rag, it: RetrievalScenario(llm, rag, it, local=True),
+    "rerun_dashboard": lambda llm, rag, it: RerunScenario(llm, rag, it, page="dashboard"),
+    "rerun_retrieval": lambda llm, rag, it: RerunScenario(llm, rag, it, page="retrieval"),
+    "rerun_vlm": lambda llm, rag, it: RerunScenario(llm, rag, it, page="vlm"),
+    "cold_start": lambda llm, rag, it: ColdStartScenario(llm, rag, it),
+}
+
+
+def run_scenario(scenario, sessions):
+    """Run `sessions` concurrent sessions of `scenario` and summarise the measurements."""
+    server = scenario.llm if scenario.backend == "llm" else scenario.rag
+    samples = []
+    errors = []
+    lock = threading.Lock()
+
+    def record(latency, model_time, ttft=None):
+        with lock:
+            samples.append({"latency_s": latency, "overhead_s": max(0.0, latency - model_time), "ttft_s": ttft})
+
+    def session():
+        try:
+            scenario.run_session(record)
+        except Exception as e:
+            with lock:
+                errors.append(repr(e))
+
+    before = server.stats
+    threads = [threading.Thread(target=session, name=f"{scenario.name}-{i}") for i in range(sessions)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    wall = time.perf_counter() - start
+    after = server.stats
+    n_requests = after["requests"] - before["requests"]
+    latencies = [s["latency_s"] for s in samples]
+    overheads = [s["overhead_s"] for s in samples]
+    ttfts = [s["ttft_s"] for s in samples if s["ttft_s"] is not None]
+    summary = {
+        "sessions": sessions,
+        "measurements": len(samples),
+        "errors": errors,
+        "wall_s": round(wall, 3),
+        "throughput_per_s": round(len(samples) / wall, 3) if wall else 0.0,
+        "latency_p50_s": round(percentile(latencies, 50), 4),
+        "latency_p95_s": round(percentile(latencies, 95), 4),
+        "latency_p99_s": round(percentile(latencies, 99), 4),
+        "overhead_p50_s": round(percentile(overheads, 50), 4),
+        "overhead_p95_s": round(percentile(overheads, 95), 4),
+        "backend_requests": n_requests,
+        "request_bytes_avg": round((after["request_bytes"] - before["request_bytes"]) / n_requests) if n_requests else 0,
+    }
+    target = getattr(scenario, "target_s", None)
+    if target is not None:
+        summary["target_p95_s"] = target
+        summary["meets_target"] = summary["latency_p95_s"] <= target
+    if ttfts:
+        summary["ttft_p50_s"] = round(percentile(ttfts, 50), 4)
+        summary["ttft_p95_s"] = round(percentile(ttfts, 95), 4)
+    return summary
+
+
+def compare(current, previous_path):
+    with open(previous_path, "r", encoding="utf-8") as f:
+        previous = json.load(f)
+    print(f"\nComparison with {previous_path}")
+    for name, result in current["scenarios"].items():
+        old = previous.get("scenarios", {}).get(name)
+        if not old:
+            continue
+        for key in ("latency_p50_s", "latency_p95_s", "overhead_p50_s", "throughput_per_s", "request_bytes_avg"):
+            if old.get(key):
+                change = (result[key] - old[key]) / old[key] * 100
+                print(f"  {name:18s} {key:18s} {old[key]:>10} -> {result[key]:>10} ({change:+.1f}%)")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the app's model paths against local stand-in servers.")
+    parser.add_argument("--scenarios", nargs="+", default=list(SCENARIOS), choices=list(SCENARIOS))
+    parser.add_argument("--sessions", type=int, default=1, help="concurrent sessions per scenario")
+    parser.add_argument("--iterations", type=int, default=1, help="passes over the scripted inputs per session")
+    parser.add_argument("--ttft", type=float, default=0.2, help="stand-in time to first token (s)")
+    parser.add_argument("--tokens-per-s", type=float, default=60.0)
+    parser.add_argument("--completion-tokens", type=int, default=120)
+    parser.add_argument("--output", default=None, help="results file (default: benchmarks/results/bench_<timestamp>.json)")
+    parser.add_argument("--compare", default=None, help="earlier results file to diff against")
+    args = parser.parse_args(argv)
+
+    llm_cfg = {"ttft_s": args.ttft, "tokens_per_s": args.tokens_per_s, "completion_tokens": args.completion_tokens}
+    with MockServer(LLMHandler, **llm_cfg) as llm, MockServer(LightRAGHandler, **llm_cfg) as rag, tempfile.TemporaryDirectory() as tmp:
+        # Point every client at the stand-ins before the app modules read their config
+        os.environ.update({
+            "LMSTUDIO_URL": f"{llm.url}/v1/chat/completions",
+            "OPENAI_BASE_URL": f"{llm.url}/v1",
+            "OPENAI_API_KEY": "benchmark",
+            "LIGHTRAG_SERVER_URL": rag.url,
+            "VLM_RESULT_CACHE_PATH": os.path.join(tmp, "vlm_results.sqlite"),
+            "TELEMETRY_LOG_PATH": os.path.join(tmp, "telemetry.jsonl"),
+            "SEMANTIC_CACHE_DIR": os.path.join(tmp, "semantic_cache"),
+            "INPUTS_FOLDER": os.path.join(REPO_ROOT, "inputs"),
+            "VECTOR_INDEX_DIR": os.path.join(tmp, "vector_index"),
+        })
+        os.chdir(REPO_ROOT)
+        if REPO_ROOT not in sys.path:
+            sys.path.insert(0, REPO_ROOT)
+
+        results = {
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "config": vars(args),
+            "scenarios": {},
+        }
+        for name in args.scenarios:
+            scenario = SCENARIOS[name](llm, rag, args.iterations)
+            summary = run_scenario(scenario, args.sessions)
+            results["scenarios"][name] = summary
+            print(
+                f"{name:18s} n={summary['measurements']:<4d} p50={summary['latency_p50_s']:.3f}s "
+                f"p95={summary['latency_p95_s']:.3f}s overhead_p50={summary['overhead_p50_s'] * 1000:.1f}ms "
+                f"{summary['throughput_per_s']:.2f}/s req={summary['request_bytes_avg']}B"
+                + (f" errors={len(summary['errors'])}" if summary["errors"] else "")
+                + (f" target_p95={summary['target_p95_s']}s {'OK' if summary['meets_target'] else 'MISSED'}" if "target_p95_s" in summary else "")
+            )
+
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    output = args.output or os.path.join(RESULTS_DIR, f"bench_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+    print(f"\nResults written to {output}")
+    if args.compare:
+        compare(results, args.compare)
+    return results
+
+
+if __name__ == "__main__":
+    main()
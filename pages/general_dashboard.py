@@ -1,194 +1,369 @@
-from openai import OpenAI
 import streamlit as st
 import os
-from dotenv import load_dotenv
-import requests
 import json
+import time
+
+from utils.clients import get_openai_client, last_timings, lightrag_url, post_json
+from utils.config import backend_config, load_env
+from utils.context_fanout import fetch_contexts, format_fanout, merge_contexts, relevant_paragraphs, split_lines
+from utils.context_manager import build_messages, count_tokens, prompt_budget
+from utils.ingest import IngestJob, iter_text_parts
+from utils.chunk_store import get_chunk_store, chunk_text
+from utils.graph_store import get_graph_store
+from utils.patient_store import get_patient_store
+from utils.scheduler import INTERACTIVE, SchedulerOverloaded, get_scheduler
+from utils.semantic_cache import DEFAULT_THRESHOLD, get_semantic_cache, is_follow_up, scope_key
+from utils.telemetry import Turn, timed_stream
+from utils.ui import render_folder, render_metrics_panel, start_profiler
 
 # Load environment variables from .env file
-load_dotenv(dotenv_path="../medical/.env")
-
-LIGHTRAG_SERVER_URL = os.getenv('LIGHTRAG_SERVER_URL', 'http://localhost:9621')
-
-st.title('MedConsult')
-
-# Sidebar: Model selection and parameters
-st.sidebar.title('Model Parameters')
-model_source = st.sidebar.radio('Choose Model Source:', ['OpenAI Model', 'Local Offline Model', 'LightRAG Server'])
-temperature = st.sidebar.slider("Temperature", min_value=0.0, max_value=2.0, value=0.1, step=0.1)
-max_tokens = st.sidebar.slider('Max Tokens', min_value=1, max_value=4096, value=1028)
-
-
-
-# 👇 Set your specific folder path here
-FOLDER_PATH = "../Healthcare-Assisstant-Dashboard/inputs"
-
-def render_folder(path):
-    """Render PDFs as clickable buttons (links) in sidebar"""
-    items = sorted(os.listdir(path))
-    for item in items:
-        item_path = os.path.join(path, item)
-        if os.path.isdir(item_path):
-            with st.sidebar.expander("📂 " + item, expanded=False):
-                render_folder(item_path)
-        elif item.lower().endswith(".csv"):
-            pdf_path = os.path.abspath(item_path)
-            # Fake button using HTML <a> tag styled as Streamlit button
-            st.sidebar.markdown(
-                f"""
-                <a href="file://{pdf_path}" target="_blank">
-                    <button style="width: 100%; padding: 6px; border-radius: 6px; border: none; background-color: #f63366; color: white; cursor: pointer;">
-                        📄 {item}
-                    </button>
-                </a>
-                """,
-                unsafe_allow_html=True,
+load_env("../medical/.env")
+profiler = start_profiler()
+try:
+    st.title('MedConsult')
+
+    # Sidebar: Model selection and parameters
+    st.sidebar.title('Model Parameters')
+    model_source = st.sidebar.radio('Choose Model Source:', ['OpenAI Model', 'Local Offline Model', 'LightRAG Server'])
+    temperature = st.sidebar.slider("Temperature", min_value=0.0, max_value=2.0, value=0.1, step=0.1)
+    max_tokens = st.sidebar.slider('Max Tokens', min_value=1, max_value=4096, value=1028)
+    with st.sidebar.expander('Semantic Cache', expanded=False):
+        use_semantic_cache = st.checkbox('Reuse answers to similar questions', value=True)
+        similarity_threshold = st.slider('Similarity threshold', min_value=0.80, max_value=1.0, value=DEFAULT_THRESHOLD, step=0.01)
+    if model_source == 'LightRAG Server':
+        with st.sidebar.expander('Retrieval', expanded=False):
+            lightrag_deadline = st.number_input(
+                'LightRAG deadline (s)', min_value=0.1, max_value=60.0,
+                value=backend_config()['lightrag']['context_deadline'], step=0.5,
+                help="Context that has not arrived by then is left out and generation starts without it.",
             )
 
-if os.path.exists(FOLDER_PATH):
-    st.sidebar.header("📂 Uploaded files")
-    render_folder(FOLDER_PATH)
-else:
-    st.sidebar.error(f"Path does not exist: {FOLDER_PATH}")
-
-# Initialize session variables
-SYSTEM_PROMPT = "You are a healthcare information assistant. Provide factual, educational information based on publicly available health guidance (CDC, WHO, NHS). Always include a disclaimer that this is not medical advice."
-LIGHTRAG_CHUNKS_PATH = os.path.join(os.path.dirname(__file__), '..', 'rag_storage', 'kv_store_text_chunks.json')
-
-if 'messages' not in st.session_state:
-    # Insert system prompt as the first message
-    st.session_state['messages'] = [{"role": "system", "content": SYSTEM_PROMPT}]
-if 'model_source' not in st.session_state:
-    st.session_state['model_source'] = model_source
-if 'uploaded_file_content' not in st.session_state:
-    st.session_state['uploaded_file_content'] = None
-if 'lightrag_doc_id' not in st.session_state:
-    st.session_state['lightrag_doc_id'] = None
-
-# Reset chat history and file if model source changes
-if st.session_state['model_source'] != model_source:
-    st.session_state['model_source'] = model_source
-    st.session_state['messages'] = [{"role": "system", "content": SYSTEM_PROMPT}]
-    st.session_state['uploaded_file_content'] = None
-    st.session_state['lightrag_doc_id'] = None
-
-# File upload next to chat input
-col1, col2 = st.columns([2, 0.5])
-with col2:
-    uploaded_file = st.file_uploader("Upload file", type=["txt", "pdf", "docx", "csv"], label_visibility="collapsed")  # Removed 'width' argument
-    if uploaded_file is not None:
-        file_content = uploaded_file.read()
-        try:
-            file_content = file_content.decode("utf-8")
-        except Exception:
-            file_content = str(file_content)
-        st.session_state['uploaded_file_content'] = file_content
-        # Send file to LightRAG server for indexing if selected
-        if model_source == 'LightRAG Server':
+
+
+    # 👇 Set your specific folder path here
+    FOLDER_PATH = os.getenv("INPUTS_FOLDER", "../Healthcare-Assisstant-Dashboard/inputs")
+
+    if os.path.exists(FOLDER_PATH):
+        st.sidebar.header("📂 Uploaded files")
+        render_folder(FOLDER_PATH)
+    else:
+        st.sidebar.error(f"Path does not exist: {FOLDER_PATH}")
+
+    @st.cache_data(max_entries=16, show_spinner=False)
+    def extract_file_text(name, file_bytes):
+        """Text of an uploaded file, extracted once per file content rather than on every rerun."""
+        return "".join(iter_text_parts(name, file_bytes))
+
+    # Initialize session variables
+    SYSTEM_PROMPT = "You are a healthcare information assistant. Provide factual, educational information based on publicly available health guidance (CDC, WHO, NHS). Always include a disclaimer that this is not medical advice."
+    LIGHTRAG_CHUNKS_PATH = os.path.join(os.path.dirname(__file__), '..', 'rag_storage', 'kv_store_text_chunks.json')
+
+    if 'messages' not in st.session_state:
+        # Insert system prompt as the first message
+        st.session_state['messages'] = [{"role": "system", "content": SYSTEM_PROMPT}]
+    if 'model_source' not in st.session_state:
+        st.session_state['model_source'] = model_source
+    if 'uploaded_file_content' not in st.session_state:
+        st.session_state['uploaded_file_content'] = None
+    if 'lightrag_doc_id' not in st.session_state:
+        st.session_state['lightrag_doc_id'] = None
+    if 'context_state' not in st.session_state:
+        st.session_state['context_state'] = {}
+
+    # Reset chat history and file if model source changes
+    if st.session_state['model_source'] != model_source:
+        st.session_state['model_source'] = model_source
+        st.session_state['messages'] = [{"role": "system", "content": SYSTEM_PROMPT}]
+        st.session_state['uploaded_file_content'] = None
+        st.session_state['lightrag_doc_id'] = None
+        st.session_state['context_state'] = {}
+
+    # File upload next to chat input
+    col1, col2 = st.columns([2, 0.5])
+    with col2:
+        uploaded_file = st.file_uploader("Upload file", type=["txt", "pdf", "docx", "csv"], label_visibility="collapsed")  # Removed 'width' argument
+        if uploaded_file is not None:
+            file_bytes = uploaded_file.getvalue()
             try:
-                response = requests.post(f"{LIGHTRAG_SERVER_URL}/documents/text", json={"text": file_content})
-                response.raise_for_status()
-                doc_id = response.json().get('doc_id')
-                st.session_state['lightrag_doc_id'] = doc_id
-                st.success(f"File uploaded and indexed on LightRAG server. Document ID: {doc_id}")
+                file_content = extract_file_text(uploaded_file.name, file_bytes)
             except Exception as e:
-                st.error(f"Failed to upload file to LightRAG server: {e}")
-        else:
-            st.success("File uploaded and ready for context.")
-
-with col1:
-    prompt = st.chat_input("Enter your query to GPT")
-
-# Display previous messages
-for message in st.session_state['messages']:
-    with st.chat_message(message['role']):
-        st.markdown(message['content'])
-
-def get_recent_lightrag_chunks(n=3):
-    try:
-        with open(LIGHTRAG_CHUNKS_PATH, 'r') as f:
-            chunks = json.load(f)
-        if isinstance(chunks, dict):
-            chunk_list = list(chunks.values())
-        else:
-            chunk_list = chunks
-        return chunk_list[-n:] if len(chunk_list) >= n else chunk_list
-    except Exception as e:
-        return [f"Error loading LightRAG chunks: {e}"]
-
-# Chat input and response logic
-if prompt:
-    # Set memory chunk size based on model type
-    if model_source == 'OpenAI Model':
-        memory_chunk_count = 10 # More memory for online model
-    elif model_source == 'Local Offline Model':
-        memory_chunk_count = 1  # Less memory for local model
-    else:
-        memory_chunk_count = 2  # Default for other models
+                file_content = None
+                st.error(f"Could not extract text from {uploaded_file.name}: {e}")
+            st.session_state['uploaded_file_content'] = file_content
+            # Send file to LightRAG server for indexing if selected (once per file, in the background)
+            if file_content and model_source == 'LightRAG Server':
+                upload_key = (uploaded_file.name, len(file_bytes), hash(file_bytes))
+                if st.session_state.get('ingested_upload') != upload_key:
+                    st.session_state['ingested_upload'] = upload_key
+                    st.session_state['dashboard_ingest_job'] = IngestJob([(uploaded_file.name, file_bytes)], 1).start()
+                job = st.session_state.get('dashboard_ingest_job')
+                documents = job.snapshot()['documents'] if job is not None else []
+                if job is not None and not documents:
+                    st.info("Preparing file for the LightRAG server…")
+                elif documents:
+                    doc = documents[0]
+                    st.session_state['lightrag_doc_id'] = doc.get('doc_id')
+                    if doc['state'] == 'failed':
+                        st.error(f"Failed to upload file to LightRAG server: {doc.get('error')}")
+                    elif doc['state'] == 'skipped':
+                        st.success(f"File already indexed on LightRAG server. Document ID: {doc.get('doc_id')}")
+                    else:
+                        st.success(f"File sent to LightRAG server for indexing ({doc['state']}). Document ID: {doc.get('doc_id')}")
+            elif file_content:
+                st.success("File uploaded and ready for context.")
 
-    recent_chunks = get_recent_lightrag_chunks(n=memory_chunk_count)
-    memory_context = "\n".join([str(chunk)[:500] for chunk in recent_chunks])  # Limit each chunk to 500 chars
+    with col1:
+        prompt = st.chat_input("Enter your query to GPT")
 
-    if st.session_state['uploaded_file_content']:
-        file_context = st.session_state['uploaded_file_content'][:500]  # Limit file context
-        user_message = f"[Short Memory]\n{memory_context}\n[File Context]\n{file_context}\n[User Question]\n{prompt}"
-    else:
-        user_message = f"[Short Memory]\n{memory_context}\n[User Question]\n{prompt}"
-
-    st.session_state['messages'].append({"role": "user", "content": user_message})
-    with st.chat_message('user'):
-        st.markdown(prompt)
-
-    with st.chat_message('assistant'):
-        if model_source == 'OpenAI Model':
-            client = OpenAI(api_key=os.getenv('OPENAI_API_KEY'))
-            stream = client.chat.completions.create(
-                model='gpt-4o',
-                messages=[
-                    {"role": message["role"], "content": message["content"]} for message in st.session_state['messages']
-                ],
-                temperature=temperature,
-                max_tokens=max_tokens,
-                stream=True
-            )
-            response = st.write_stream(stream)
-        elif model_source == 'Local Offline Model':
-            # LMStudio local API (example: http://localhost:1234/v1/chat/completions)
+    # Display previous messages
+    for message in st.session_state['messages']:
+        with st.chat_message(message['role']):
+            st.markdown(message['content'])
+
+    def get_relevant_lightrag_chunks(query, n=3):
+        """Return the top-n LightRAG chunks for `query` from the BM25-indexed chunk store."""
+        try:
+            return get_chunk_store(LIGHTRAG_CHUNKS_PATH).search(query, k=n)
+        except Exception as e:
+            return [f"Error loading LightRAG chunks: {e}"]
+
+    def get_graph_context(query, max_relations=15):
+        """Answer entity lookups (e.g. a patient ID in the question) from the local knowledge graph."""
+        try:
+            graph = get_graph_store()
+        except Exception:
+            return ""
+        return "\n".join(graph.context_for(entity_id, limit=max_relations) for entity_id in graph.find_entities(query, limit=3))
+
+    def get_patient_context(query):
+        """Compact records for any Synthea patient IDs mentioned in the question."""
+        try:
+            store = get_patient_store()
+            return "\n".join(store.format_record(patient_id) for patient_id in store.find_patients(query))
+        except Exception:
+            return ""
+
+    def fetch_lightrag_context(query, deadline):
+        """Entities, relations and chunks the LightRAG server retrieves for `query`, without generating."""
+        cfg = backend_config()['lightrag']
+        payload = {"query": query, "mode": cfg['query_mode'], "only_need_context": True}
+        r = post_json("lightrag", lightrag_url("/query"), payload, timeout=(min(cfg['connect_timeout'], deadline), deadline))
+        r.raise_for_status()
+        return split_lines(r.json().get('response', ''))
+
+    # Section header per context source; sources are merged round-robin in this order
+    CONTEXT_HEADERS = {
+        "patients": "[Patient Record]",
+        "file": "[File Context]",
+        "LightRAG": "[LightRAG Context]",
+        "graph": "[Graph Context]",
+        "memory": "[Short Memory]",
+    }
+
+    def gather_context(query, file_content, memory_chunk_count, lightrag_deadline, budget):
+        """Fetch every context source at once and merge what arrives in time; returns ``(context, results, info)``."""
+        local_deadline = backend_config()['lightrag']['local_context_deadline']
+        fetchers = {
+            "patients": (lambda: [get_patient_context(query)], local_deadline),
+            "file": (lambda: relevant_paragraphs(file_content, query) if file_content else [], local_deadline),
+            "LightRAG": (lambda: fetch_lightrag_context(query, lightrag_deadline), lightrag_deadline),
+            "graph": (lambda: get_graph_context(query).splitlines(), local_deadline),
+            "memory": (lambda: [chunk_text(c) for c in get_chunk_store(LIGHTRAG_CHUNKS_PATH).search(query, k=memory_chunk_count)], local_deadline),
+        }
+        results = fetch_contexts([(name, fn, deadline) for name, (fn, deadline) in fetchers.items()])
+        context, info = merge_contexts(results, budget, CONTEXT_HEADERS)
+        return context, results, info
+
+    def question_entities(query):
+        """Patient and knowledge-graph IDs named in the question, used to scope cached answers."""
+        ids = []
+        for find in (lambda: get_patient_store().find_patients(query), lambda: get_graph_store().find_entities(query)):
             try:
-                lmstudio_url = os.getenv('LMSTUDIO_URL', 'http://localhost:1234/v1/chat/completions')
-                payload = {
-                    "model": "medgemma-4b-it",  # Replace with your LMStudio model name
-                    "messages": [
-                        {"role": message["role"], "content": message["content"]} for message in st.session_state['messages']
-                    ],
-                    "temperature": temperature,
-                    "max_tokens": max_tokens
-                }
-                headers = {"Content-Type": "application/json"}
-                r = requests.post(lmstudio_url, json=payload, headers=headers)
-                r.raise_for_status()
-                response_json = r.json()
-                response = response_json['choices'][0]['message']['content']
+                ids += find()
+            except Exception:
+                pass
+        return ids
+
+    # Chat input and response logic
+    BACKENDS = {'OpenAI Model': 'openai', 'Local Offline Model': 'lmstudio', 'LightRAG Server': 'openai'}
+
+    if prompt:
+        backend = BACKENDS.get(model_source, 'unknown')
+        turn = Turn(
+            "general_dashboard",
+            backend,
+            backend_config()[backend]['model'] if backend in ('openai', 'lmstudio') else None,
+            mode=model_source,
+        )
+        # Semantic cache, checked before any retrieval so a hit answers straight away. Answers are
+        # scoped per backend, uploaded file and the patient/entity IDs the question names;
+        # follow-ups that lean on earlier turns are neither served nor stored.
+        use_cache_this_turn = use_semantic_cache and not (len(st.session_state['messages']) > 1 and is_follow_up(prompt))
+        cached, question_embedding = None, None
+        if use_cache_this_turn:
+            with turn.stage("semantic_cache"):
+                cache_scope = scope_key(model_source, st.session_state['uploaded_file_content'], question_entities(prompt))
+                try:
+                    cached, similarity, question_embedding = get_semantic_cache().lookup(prompt, cache_scope, similarity_threshold)
+                except Exception:
+                    cached = None
+        turn.set(cache_hit=cached is not None, cache_skipped=use_semantic_cache and not use_cache_this_turn)
+
+        fanout_caption = None
+        if cached is None:
+            # Set memory chunk size based on model type
+            if model_source == 'OpenAI Model':
+                memory_chunk_count = 10 # More memory for online model
+            elif model_source == 'Local Offline Model':
+                memory_chunk_count = 1  # Less memory for local model
+            else:
+                memory_chunk_count = 2  # Default for other models
+
+            if model_source == 'LightRAG Server':
+                # All sources at once, each with its own deadline: waits for the slowest one in time, not the sum
+                with turn.stage("context_fanout"):
+                    retrieved_context, fanout, merge_info = gather_context(
+                        prompt,
+                        st.session_state['uploaded_file_content'],
+                        memory_chunk_count,
+                        lightrag_deadline,
+                        min(backend_config()['lightrag']['context_tokens'], prompt_budget(model_source, max_tokens) // 2),
+                    )
+                fanout_caption = format_fanout(fanout, merge_info)
+                turn.set(
+                    context_sources={r['name']: {"status": r['status'], "ms": round(r['elapsed_s'] * 1000, 3)} for r in fanout},
+                    context_tokens=merge_info['tokens'],
+                    context_duplicates=merge_info['duplicates'],
+                )
+            else:
+                with turn.stage("chunk_search"):
+                    relevant_chunks = get_relevant_lightrag_chunks(prompt, n=memory_chunk_count)
+                memory_context = "\n".join([chunk_text(chunk)[:500] for chunk in relevant_chunks])  # Limit each chunk to 500 chars
+
+                with turn.stage("graph_context"):
+                    graph_context = get_graph_context(prompt, max_relations=5 if model_source == 'Local Offline Model' else 15)
+                if graph_context:
+                    memory_context = f"{memory_context}\n[Graph Context]\n{graph_context}"
+                with turn.stage("patient_context"):
+                    patient_context = get_patient_context(prompt)
+                if patient_context:
+                    memory_context = f"{memory_context}\n[Patient Record]\n{patient_context}"
+
+            with turn.stage("prompt_assembly"):
+                if model_source == 'LightRAG Server':
+                    user_message = f"{retrieved_context}\n[User Question]\n{prompt}"
+                elif st.session_state['uploaded_file_content']:
+                    file_context = st.session_state['uploaded_file_content'][:500]  # Limit file context
+                    user_message = f"[Short Memory]\n{memory_context}\n[File Context]\n{file_context}\n[User Question]\n{prompt}"
+                else:
+                    user_message = f"[Short Memory]\n{memory_context}\n[User Question]\n{prompt}"
+
+                # Retrieval blocks go into this request only; stored history keeps the bare question
+                request_messages, context_info = build_messages(
+                    SYSTEM_PROMPT,
+                    st.session_state['messages'][1:],
+                    user_message,
+                    prompt_budget(model_source, max_tokens),
+                    st.session_state['context_state'],
+                )
+            turn.set(prompt_tokens=context_info['prompt_tokens'], payload_bytes=len(json.dumps(request_messages)))
+        st.session_state['messages'].append({"role": "user", "content": prompt})
+        with st.chat_message('user'):
+            st.markdown(prompt)
+            if cached is None:
+                st.caption(
+                    f"Prompt tokens: {context_info['prompt_tokens']} / {context_info['budget']} "
+                    f"({context_info['history_turns']} turns in full, {context_info['summarized_turns']} summarized)"
+                )
+                if context_info['truncated']:
+                    st.warning("This message is longer than the model's context window; its middle was cut to fit.")
+            if fanout_caption:
+                st.caption(fanout_caption)
+
+        with st.chat_message('assistant'):
+            if cached is not None:
+                response = cached['answer']
                 st.markdown(response)
-            except Exception as e:
-                response = f"Error: {e}"
+                st.caption(f"Answered from semantic cache (similarity {similarity:.3f}, saved ~{cached['latency_s']:.1f} s)")
+            elif model_source in ('OpenAI Model', 'LightRAG Server'):
+                # OpenAI completion; in LightRAG mode with the context from the fan-out above
+                try:
+                    client = get_openai_client()
+                    with turn.stage("request"):
+                        stream = client.chat.completions.create(
+                            model=backend_config()['openai']['model'],
+                            messages=request_messages,
+                            temperature=temperature,
+                            max_tokens=max_tokens,
+                            stream=True
+                        )
+                    timings = last_timings()
+                    if timings and timings['backend'] == 'openai':
+                        turn.add_stage("connect", timings['connect_s'])
+                        turn.set(ttfb_ms=round(timings['ttfb_s'] * 1000, 3))
+                    response = st.write_stream(timed_stream(stream, turn))
+                    if timings and timings['backend'] == 'openai':
+                        st.caption(f"Connect: {timings['connect_s'] * 1000:.0f} ms, TTFB: {timings['ttfb_s']:.2f} s, total: {timings.get('total_s', 0.0):.2f} s")
+                except Exception as e:
+                    response = f"Error: {e}"
+                    st.markdown(response)
+                    turn.finish(error=e)
+            elif model_source == 'Local Offline Model':
+                # LMStudio local API (example: http://localhost:1234/v1/chat/completions)
+                try:
+                    lmstudio = backend_config()['lmstudio']
+                    payload = {
+                        "model": lmstudio['model'],
+                        "messages": request_messages,
+                        "temperature": temperature,
+                        "max_tokens": max_tokens
+                    }
+                    slot_stats = {}
+                    with get_scheduler().slot(INTERACTIVE, stats=slot_stats) as url:
+                        r = post_json("lmstudio", url, payload)
+                        r.raise_for_status()
+                    response_json = r.json()
+                    response = response_json['choices'][0]['message']['content']
+                    st.markdown(response)
+                    timings = r.timings
+                    st.caption(
+                        f"Queue: {slot_stats['queue_s'] * 1000:.0f} ms, Connect: {timings['connect_s'] * 1000:.0f} ms, "
+                        f"TTFB: {timings['ttfb_s']:.2f} s, total: {timings['total_s']:.2f} s"
+                    )
+                    turn.add_stage("queue", slot_stats['queue_s'])
+                    turn.add_stage("connect", timings['connect_s'])
+                    turn.add_stage("ttft", timings['ttfb_s'])
+                    turn.add_stage("generation", timings['total_s'] - timings['ttfb_s'])
+                    turn.set(
+                        payload_bytes=len(r.request.body or b""),
+                        completion_tokens=response_json.get('usage', {}).get('completion_tokens'),
+                        backend_url=slot_stats['backend_url'],
+                    )
+                except SchedulerOverloaded as e:
+                    # Busy or unreachable backends: degrade to a notice instead of a long timeout
+                    response = f"Error: {e}"
+                    st.warning(str(e))
+                    turn.set(error=str(e), rejected=True)
+                except Exception as e:
+                    response = f"Error: {e}"
+                    st.markdown(response)
+                    turn.set(error=str(e))
+            else:
+                response = "No model selected."
                 st.markdown(response)
-        elif model_source == 'LightRAG Server':
-            # Use OpenAI for completion, context from LightRAG
-            client = OpenAI(api_key=os.getenv('OPENAI_API_KEY'))
-            stream = client.chat.completions.create(
-                model='gpt-4o',
-                messages=[
-                    {"role": message["role"], "content": message["content"]} for message in st.session_state['messages']
-                ],
-                temperature=temperature,
-                max_tokens=max_tokens,
-                stream=True
-            )
-            response = st.write_stream(stream)
-        else:
-            response = "No model selected."
-            st.markdown(response)
-    st.session_state['messages'].append({"role": "assistant", "content": response})
+        if use_cache_this_turn and cached is None and question_embedding is not None and isinstance(response, str) and not response.startswith("Error:"):
+            # Retrieval plus generation: what a later hit saves
+            get_semantic_cache().put(prompt, response, cache_scope, time.perf_counter() - turn.start, question_embedding)
+        if not turn.event.get('completion_tokens'):
+            turn.set(completion_tokens=count_tokens(response) if isinstance(response, str) else None)
+        turn.finish()
+        st.session_state['messages'].append({"role": "assistant", "content": response})
 
-# Optionally, handle message overflow or trimming here
\ No newline at end of file
+    if use_semantic_cache:
+        cache_stats = get_semantic_cache().stats()
+        st.sidebar.caption(
+            f"Semantic cache: {cache_stats['entries']} entries, {cache_stats['hit_rate']:.0%} hit rate "
+            f"({cache_stats['hits']}/{cache_stats['hits'] + cache_stats['misses']}), ~{cache_stats['saved_s']:.1f} s saved"
+        )
+finally:
+    render_metrics_panel(profiler)
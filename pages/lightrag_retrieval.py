@@ -1,103 +1,262 @@
 import streamlit as st
 import os
-import requests
-from dotenv import load_dotenv
+import json
+
+from utils.clients import lightrag_url, post_json
+from utils.context_manager import count_tokens
+from utils.ingest import IngestJob, collect_directory_files, SUPPORTED_EXTENSIONS, DEFAULT_CONCURRENCY
+from utils.config import backend_config, load_env
+from utils.llm_stream import stream_chat_completion, stream_lightrag_query
+from utils.scheduler import INTERACTIVE, get_scheduler
+from utils.telemetry import Turn
+from utils.ui import render_folder, render_metrics_panel, render_stream, start_profiler
+from utils.vector_index import format_context, get_local_index
 
 # Load environment variables from .env file
-load_dotenv(dotenv_path="../medical/.env")
-LIGHTRAG_SERVER_URL = os.getenv('LIGHTRAG_SERVER_URL', 'http://localhost:9621')
-
-st.set_page_config(page_title="LightRAG Retrieval", page_icon="🔎")
-st.title('🔎 LightRAG Retrieval')
-st.info('Ask questions about your uploaded data. Results are retrieved from LightRAG and summarized below.')
-
-with st.expander('Retrieval Parameters', expanded=False):
-    kg_top_k = st.number_input('KG Top K', min_value=1, max_value=100, value=40)
-    chunk_top_k = st.number_input('Chunk Top K', min_value=1, max_value=100, value=10)
-    max_entity_tokens = st.number_input('Max Entity Tokens', min_value=100, max_value=50000, value=10000)
-    max_relation_tokens = st.number_input('Max Relation Tokens', min_value=100, max_value=50000, value=10000)
-    max_total_tokens = st.number_input('Max Total Tokens', min_value=1000, max_value=64000, value=32000)
-    enable_rerank = st.checkbox('Enable Rerank', value=True)
-    only_need_context = st.checkbox('Only Need Context', value=False)
-    only_need_prompt = st.checkbox('Only Need Prompt', value=False)
-    stream_response = st.checkbox('Stream Response', value=True)
-
-# 👇 Set your specific folder path here
-FOLDER_PATH = "../Healthcare-Assisstant-Dashboard/inputs"
-
-def render_folder(path):
-    """Render PDFs as clickable buttons (links) in sidebar"""
-    items = sorted(os.listdir(path))
-    for item in items:
-        item_path = os.path.join(path, item)
-        if os.path.isdir(item_path):
-            with st.sidebar.expander("📂 " + item, expanded=False):
-                render_folder(item_path)
-        elif item.lower().endswith(".csv"):
-            pdf_path = os.path.abspath(item_path)
-            # Fake button using HTML <a> tag styled as Streamlit button
-            st.sidebar.markdown(
-                f"""
-                <a href="file://{pdf_path}" target="_blank">
-                    <button style="width: 100%; padding: 6px; border-radius: 6px; border: none; background-color: #f63366; color: white; cursor: pointer;">
-                        📄 {item}
-                    </button>
-                </a>
-                """,
-                unsafe_allow_html=True,
-            )
-
-if os.path.exists(FOLDER_PATH):
-    st.sidebar.header("📂 Uploaded files")
-    render_folder(FOLDER_PATH)
-else:
-    st.sidebar.error(f"Path does not exist: {FOLDER_PATH}")
-
-# Chat history
-if 'lightrag_chat_history' not in st.session_state:
-    st.session_state['lightrag_chat_history'] = []
-
-# Display previous messages
-for message in st.session_state['lightrag_chat_history']:
-    with st.chat_message(message['role']):
-        st.markdown(message['content'])
-
-# Chat input at bottom
-query = st.chat_input('Enter your retrieval query:')
-if query:
-    st.session_state['lightrag_chat_history'].append({"role": "user", "content": query})
-    with st.chat_message('user'):
-        st.markdown(query)
-    query_payload = {
-        "query": query,
-        "kg_top_k": kg_top_k,
-        "chunk_top_k": chunk_top_k,
-        "max_entity_tokens": max_entity_tokens,
-        "max_relation_tokens": max_relation_tokens,
-        "max_total_tokens": max_total_tokens,
-        "enable_rerank": enable_rerank,
-        "only_need_context": only_need_context,
-        "only_need_prompt": only_need_prompt,
-        "stream_response": stream_response
-    }
-    try:
-        response = requests.post(f"{LIGHTRAG_SERVER_URL}/query", json=query_payload, timeout=10)
-        result = response.json()
-        if 'error' in result:
-            answer = f"Server error: {result['error']}"
-        elif 'response' in result:
-            answer = result['response']
+load_env("../medical/.env")
+profiler = start_profiler()
+try:
+    st.set_page_config(page_title="LightRAG Retrieval", page_icon="🔎")
+    st.title('🔎 LightRAG Retrieval')
+    st.info('Ask questions about your uploaded data. Results are retrieved from LightRAG and summarized below.')
+
+    retrieval_source = st.radio(
+        'Retrieval Source', ['LightRAG Server', 'Local Index'], horizontal=True,
+        help='Local Index searches an embedded vector index of rag_storage and answers with the local LM Studio model.',
+    )
+
+    with st.expander('Retrieval Parameters', expanded=False):
+        kg_top_k = st.number_input('KG Top K', min_value=1, max_value=100, value=40)
+        chunk_top_k = st.number_input('Chunk Top K', min_value=1, max_value=100, value=10)
+        max_entity_tokens = st.number_input('Max Entity Tokens', min_value=100, max_value=50000, value=10000)
+        max_relation_tokens = st.number_input('Max Relation Tokens', min_value=100, max_value=50000, value=10000)
+        max_total_tokens = st.number_input('Max Total Tokens', min_value=1000, max_value=64000, value=32000)
+        enable_rerank = st.checkbox('Enable Rerank', value=True)
+        only_need_context = st.checkbox('Only Need Context', value=False)
+        only_need_prompt = st.checkbox('Only Need Prompt', value=False)
+        stream_response = st.checkbox('Stream Response', value=True)
+        lightrag_cfg = backend_config()['lightrag']
+        connect_timeout = st.number_input('Connect Timeout (s)', min_value=1.0, max_value=60.0, value=float(lightrag_cfg['connect_timeout']))
+        read_timeout = st.number_input('Read Timeout (s)', min_value=5.0, max_value=600.0, value=float(lightrag_cfg['read_timeout']))
+
+    # 👇 Set your specific folder path here
+    FOLDER_PATH = os.getenv("INPUTS_FOLDER", "../Healthcare-Assisstant-Dashboard/inputs")
+
+    if os.path.exists(FOLDER_PATH):
+        st.sidebar.header("📂 Uploaded files")
+        render_folder(FOLDER_PATH)
+    else:
+        st.sidebar.error(f"Path does not exist: {FOLDER_PATH}")
+
+    # Bulk ingestion: extract, dedupe against the doc status store and submit concurrently, all in the background
+    with st.sidebar.expander("📥 Bulk Ingestion", expanded=False):
+        ingest_files = st.file_uploader("Documents", type=[ext.lstrip(".") for ext in SUPPORTED_EXTENSIONS], accept_multiple_files=True)
+        ingest_dir = st.text_input("...or a folder", value="", placeholder="inputs/")
+        ingest_concurrency = st.number_input("Concurrent uploads", min_value=1, max_value=16, value=DEFAULT_CONCURRENCY)
+        if st.button("Ingest"):
+            sources = [(f.name, f.getvalue()) for f in ingest_files or []]
+            if ingest_dir.strip():
+                if os.path.isdir(ingest_dir.strip()):
+                    sources += [(os.path.basename(p), p) for p in collect_directory_files(ingest_dir.strip())]
+                else:
+                    st.error(f"Path does not exist: {ingest_dir}")
+            if sources:
+                st.session_state['bulk_ingest_job'] = IngestJob(sources, ingest_concurrency).start()
+            else:
+                st.warning("Select files or a folder to ingest.")
+
+    @st.fragment(run_every=2)
+    def render_ingest_status():
+        job = st.session_state.get('bulk_ingest_job')
+        if job is None:
+            return
+        snap = job.snapshot()
+        counts = ", ".join(f"{n} {state}" for state, n in sorted(snap['counts'].items()))
+        state = 'finished' if snap['done'] else 'extracting and submitting' if snap['extracting'] else 'running'
+        st.markdown(f"**Ingestion {state}** – {counts or 'starting'}")
+        st.caption(f"{snap['docs_per_minute']:.1f} docs/min over {snap['elapsed_s']:.0f} s")
+        for doc in snap['documents']:
+            timing = ""
+            if doc.get('processing_start_time') and doc.get('processing_end_time'):
+                timing = f" ({doc['processing_end_time'] - doc['processing_start_time']} s: {doc['processing_start_time']} → {doc['processing_end_time']})"
+            st.caption(f"{doc['name']}: {doc['state']}{timing}" + (f" – {doc['error']}" if doc.get('error') else ""))
+
+    with st.sidebar:
+        render_ingest_status()
+
+    @st.fragment(run_every=2)
+    def render_index_status():
+        # New documents from LightRAG are picked up here, in the background, when the doc status store changes
+        get_local_index().sync_if_changed()
+        status = get_local_index().sync_status()
+        sizes = status['stats']
+        st.caption(f"{sizes['documents']} documents: {sizes['entities']} entities, {sizes['relations']} relations, {sizes['chunks']} chunks")
+        if status['building']:
+            total = status['items_total']
+            progress = status['items_done'] / total if total else 0.0
+            st.progress(progress, text=f"Embedding {status['items_done']} / {total or '?'} items from {status['documents']} documents")
+        elif status['state'] == 'finished':
+            st.caption(f"Last build added {status['added']} items from {status['documents']} documents in {status['elapsed_s']:.1f} s")
+        elif status['state'] == 'failed':
+            st.error(f"Index build failed: {status['error']}")
+
+    # Local index: updated in the background when LightRAG's doc status changes (or on request), never inside a chat turn
+    if retrieval_source == 'Local Index':
+        with st.sidebar.expander("🧭 Local Index", expanded=get_local_index().is_empty()):
+            if st.button("Build / update index", help="Embed documents LightRAG has processed since the last build. Runs by itself when new documents are processed; use it to retry a failed build."):
+                if not get_local_index().start_sync():
+                    st.info("A build is already running.")
+            render_index_status()
+
+    # Chat history
+    if 'lightrag_chat_history' not in st.session_state:
+        st.session_state['lightrag_chat_history'] = []
+
+    def format_metrics(metrics):
+        params = metrics['params']
+        return (
+            f"TTFT: {metrics['ttft_s']:.2f} s, total: {metrics['total_s']:.2f} s "
+            f"({'streamed' if metrics['streamed'] else 'single response'}) · "
+            f"kg_top_k={params['kg_top_k']}, chunk_top_k={params['chunk_top_k']}, "
+            f"max_entity_tokens={params['max_entity_tokens']}, max_relation_tokens={params['max_relation_tokens']}, "
+            f"max_total_tokens={params['max_total_tokens']}"
+        )
+
+    LOCAL_ANSWER_PROMPT = (
+        "You are a clinical data assistant. Answer the question using only the context below, "
+        "which lists knowledge-graph entities, their relationships and document chunks. "
+        "If the context does not contain the answer, say so.\n\n{context}\n\nQuestion: {query}"
+    )
+
+    def local_index_notice():
+        """Why the local index cannot answer yet, or None when it has something to search."""
+        index = get_local_index()
+        if not index.is_empty():
+            return None
+        if index.sync_status()['building']:
+            return "The local index is still being built; ask again once the first documents are indexed (progress in the sidebar)."
+        return "The local index is empty. Build it from **🧭 Local Index** in the sidebar first."
+
+    def local_retrieval(query, stats):
+        """Search the local vector index and render the context within the token budgets."""
+        index = get_local_index()
+        stats["index_building"] = index.sync_status()['building']
+        hits = index.query(query, kg_top_k, chunk_top_k)
+        stats.update(hits["timings"])
+        stats["references"] = sorted({item["doc_id"] for item, _ in hits["chunks"]})
+        return format_context(hits, max_entity_tokens, max_relation_tokens, max_total_tokens)
+
+    def format_local_metrics(stats):
+        return (
+            f"Local index: embed {stats['embed_s'] * 1000:.0f} ms, search {stats['search_s'] * 1000:.1f} ms"
+            + (" (index update in progress; newer documents may be missing)" if stats.get('index_building') else "")
+        )
+
+    # Display previous messages
+    for message in st.session_state['lightrag_chat_history']:
+        with st.chat_message(message['role']):
+            st.markdown(message['content'])
+            if message.get('metrics'):
+                st.caption(format_metrics(message['metrics']))
+
+    # Chat input at bottom
+    query = st.chat_input('Enter your retrieval query:')
+    notice = None
+    if query:
+        st.session_state['lightrag_chat_history'].append({"role": "user", "content": query})
+        with st.chat_message('user'):
+            st.markdown(query)
+        notice = local_index_notice() if retrieval_source == 'Local Index' else None
+        if notice:
+            st.session_state['lightrag_chat_history'].append({"role": "assistant", "content": notice})
+            with st.chat_message('assistant'):
+                st.warning(notice)
+    if query and not notice:
+        query_payload = {
+            "query": query,
+            "kg_top_k": kg_top_k,
+            "chunk_top_k": chunk_top_k,
+            "max_entity_tokens": max_entity_tokens,
+            "max_relation_tokens": max_relation_tokens,
+            "max_total_tokens": max_total_tokens,
+            "enable_rerank": enable_rerank,
+            "only_need_context": only_need_context,
+            "only_need_prompt": only_need_prompt,
+            "stream_response": stream_response
+        }
+        timeout = (float(connect_timeout), float(read_timeout))
+        params = {k: query_payload[k] for k in ("kg_top_k", "chunk_top_k", "max_entity_tokens", "max_relation_tokens", "max_total_tokens")}
+        if retrieval_source == 'Local Index':
+            turn = Turn("lightrag_retrieval", "local_index", backend_config()['lmstudio']['model'], mode="local", **params)
         else:
-            answer = result.get('summary', 'No summary available.')
-        st.session_state['lightrag_chat_history'].append({"role": "assistant", "content": answer})
-        with st.chat_message('assistant'):
-            st.markdown(answer)
-        if 'references' in result:
-            st.markdown('**References:**')
-            for ref in result['references']:
-                st.write(ref)
-    except Exception as e:
-        error_msg = f"Server error, please try again later: {e}"
-        st.session_state['lightrag_chat_history'].append({"role": "assistant", "content": error_msg})
-        with st.chat_message('assistant'):
-            st.markdown(error_msg)
+            turn = Turn("lightrag_retrieval", "lightrag", mode="stream" if stream_response else "query", payload_bytes=len(json.dumps(query_payload)), **params)
+        try:
+            if retrieval_source == 'Local Index':
+                stats = {}
+                with turn.stage("local_search"):
+                    context = local_retrieval(query, stats)
+                prompt_text = LOCAL_ANSWER_PROMPT.format(context=context, query=query)
+                turn.set(prompt_tokens=count_tokens(prompt_text))
+                with st.chat_message('assistant'):
+                    if only_need_context or only_need_prompt:
+                        answer = context if only_need_context else prompt_text
+                        st.markdown(answer)
+                        metrics = {"ttft_s": stats["embed_s"] + stats["search_s"], "total_s": stats["embed_s"] + stats["search_s"], "streamed": False, "params": params}
+                    else:
+                        lmstudio = backend_config()['lmstudio']
+                        payload = {"model": lmstudio['model'], "messages": [{"role": "user", "content": prompt_text}], "temperature": 0.1}
+                        answer_area = st.empty()
+                        with get_scheduler().slot(INTERACTIVE, stats=stats) as url:
+                            answer = render_stream(stream_chat_completion(url, payload, stats=stats, timeout=timeout), answer_area)
+                        if not answer:
+                            answer = 'No summary available.'
+                            answer_area.markdown(answer)
+                        turn.add_stage("queue", stats["queue_s"])
+                        turn.add_stage("connect", stats["connect_s"])
+                        metrics = {"ttft_s": stats["ttft_s"], "total_s": stats["total_s"], "streamed": True, "params": params}
+                    st.caption(format_metrics(metrics))
+                    st.caption(format_local_metrics(stats))
+                result = {"references": stats["references"]} if stats["references"] else {}
+            elif stream_response:
+                stats = {}
+                with st.chat_message('assistant'):
+                    answer_area = st.empty()
+                    answer = render_stream(stream_lightrag_query(lightrag_url("/query/stream"), query_payload, stats, timeout=timeout), answer_area)
+                    if not answer:
+                        answer = 'No summary available.'
+                        answer_area.markdown(answer)
+                    metrics = {"ttft_s": stats["ttft_s"], "total_s": stats["total_s"], "streamed": True, "params": params}
+                    st.caption(format_metrics(metrics))
+                    turn.add_stage("connect", stats["connect_s"])
+                    turn.set(stream_chunks=stats["chunks"])
+                result = {"references": stats["references"]} if stats.get("references") else {}
+            else:
+                response = post_json("lightrag", lightrag_url("/query"), query_payload, timeout=timeout)
+                result = response.json()
+                if 'error' in result:
+                    answer = f"Server error: {result['error']}"
+                elif 'response' in result:
+                    answer = result['response']
+                else:
+                    answer = result.get('summary', 'No summary available.')
+                # Without streaming the first token arrives with the whole body
+                metrics = {"ttft_s": response.timings["total_s"], "total_s": response.timings["total_s"], "streamed": False, "params": params}
+                with st.chat_message('assistant'):
+                    st.markdown(answer)
+                    st.caption(format_metrics(metrics))
+            turn.add_stage("ttft", metrics["ttft_s"])
+            turn.add_stage("generation", metrics["total_s"] - metrics["ttft_s"])
+            turn.finish()
+            st.session_state['lightrag_chat_history'].append({"role": "assistant", "content": answer, "metrics": metrics})
+            if 'references' in result:
+                st.markdown('**References:**')
+                for ref in result['references']:
+                    st.write(ref)
+        except Exception as e:
+            turn.finish(error=e)
+            error_msg = f"Server error, please try again later: {e}"
+            st.session_state['lightrag_chat_history'].append({"role": "assistant", "content": error_msg})
+            with st.chat_message('assistant'):
+                st.markdown(error_msg)
+finally:
+    render_metrics_panel(profiler)
@@ -1,38 +1,86 @@
 import streamlit as st
 from PIL import Image
-import base64
 import io
 import os
 import time
-import requests
 
+from utils.image_utils import encode_image, content_hash, resize_to_fit, DEFAULT_MAX_SIDE, DEFAULT_FORMAT, DEFAULT_QUALITY
+from utils.clients import post_json
+from utils.config import backend_config
+from utils.llm_stream import stream_chat_completion
+from utils.result_cache import get_result_cache, make_key
+from utils.scheduler import BATCH, INTERACTIVE, SchedulerOverloaded, get_scheduler
+from utils.telemetry import Turn
+from utils.ui import render_metrics_panel, render_stream, start_profiler
+from utils.batch import collect_directory_images, run_batch, images_per_minute, write_results, DEFAULT_CONCURRENCY
+from utils.tiling import (
+    DEFAULT_MAX_TILES, DEFAULT_MIN_TISSUE, DEFAULT_TILE_SIZE, OVERVIEW_LABEL, TILE_CACHE_DIR, WSI_EXTENSIONS, ImageTooLarge,
+    describe_tile, draw_tile_grid, merge_tile_findings, open_regions, plan_tiles,
+)
 
-def load_sample_image():
+DEFAULT_PROMPT = "Describe this image in detail, including any abnormalities or notable findings."
+SAMPLING_PARAMS = {"temperature": 0.0, "max_tokens": 1024}
+# Longest side of the on-page preview; the model still gets the preprocessed original
+PREVIEW_MAX_SIDE = 1024
+
+
+def sample_image_path():
     sample_path = os.path.join(os.path.dirname(__file__), "../images/Infection.jpg")
     sample_path = os.path.normpath(sample_path)
     if os.path.exists(sample_path):
-        return Image.open(sample_path)
+        return sample_path
     alt = os.path.join(os.getcwd(), "images/Infection.jpg")
     if os.path.exists(alt):
-        return Image.open(alt)
+        return alt
     return None
 
-def analyze_image_with_model(pipe, image, custom_prompt: str):
-    if image is None:
-        return "Please upload an image first."
+@st.cache_resource(show_spinner=False)
+def read_image_file(path, mtime):
+    """Raw bytes of an image on disk, re-read only when its mtime changes."""
+    with open(path, "rb") as f:
+        return f.read()
+
+def load_sample_image():
+    """Bytes of the bundled sample image, or None if it is missing."""
+    path = sample_image_path()
+    return read_image_file(path, os.path.getmtime(path)) if path else None
+
+@st.cache_resource(max_entries=16, show_spinner=False)
+def decode_image(key, _data):
+    """Decode image bytes once per content hash `key`.
+
+    Returns the RGB image and a downscaled JPEG preview, so reruns neither
+    re-decode the file nor re-encode a full-size PNG for `st.image`. The
+    image is shared between sessions and must not be modified in place.
+    """
+    image = Image.open(io.BytesIO(_data)).convert("RGB")
+    buf = io.BytesIO()
+    resize_to_fit(image, PREVIEW_MAX_SIDE).save(buf, format="JPEG", quality=90)
+    return image, buf.getvalue()
+
+def build_image_payload(pipe, image, custom_prompt: str, encode_stats: dict = None):
+    """Build the OpenAI-compatible multimodal request body for one image.
+
+    `image` may be raw file bytes or a PIL image; raw bytes let repeat
+    analyses of the same file reuse the cached encoding. If `encode_stats`
+    is given it is filled with the payload size and encode time.
+    """
     system_prompt_text = (
         "You are a expert medical AI assistant with years of experience in interpreting medical images. "
         "Your purpose is to assist qualified clinicians by providing a detailed analysis of the provided medical image."
     )
-    prompt_text = custom_prompt.strip() if custom_prompt and custom_prompt.strip() else "Describe this image in detail, including any abnormalities or notable findings."
-    # Encode image to JPEG and base64
-    buffered = io.BytesIO()
-    image.save(buffered, format="JPEG")
-    img_bytes = buffered.getvalue()
-    b64 = base64.b64encode(img_bytes).decode("utf-8")
-    data_url = f"data:image/jpeg;base64,{b64}"
+    prompt_text = resolve_prompt(custom_prompt)
+    # Resize to the model's input size and encode to base64 (cached by content hash)
+    data_url, stats = encode_image(
+        image,
+        max_side=pipe.get("image_size", DEFAULT_MAX_SIDE),
+        fmt=pipe.get("image_format", DEFAULT_FORMAT),
+        quality=pipe.get("image_quality", DEFAULT_QUALITY),
+    )
+    if encode_stats is not None:
+        encode_stats.update(stats)
     # OpenAI-compatible multimodal format: text and image as separate items
-    payload = {
+    return {
         "model": pipe["model"],
         "messages": [
             {"role": "system", "content": [{"type": "text", "text": system_prompt_text}]},
@@ -41,35 +89,353 @@ def analyze_image_with_model(pipe, image, custom_prompt: str):
                 {"type": "image_url", "image_url": {"url": data_url}}
             ]},
         ],
-        "temperature": 0.0,
-        "max_tokens": 1024,
+        **SAMPLING_PARAMS,
     }
-    headers = {"Content-Type": "application/json"}
-    r = requests.post(pipe["url"], json=payload, headers=headers, timeout=120)
-    r.raise_for_status()
-    result = r.json()
+
+def resolve_prompt(custom_prompt):
+    return custom_prompt.strip() if custom_prompt and custom_prompt.strip() else DEFAULT_PROMPT
+
+def result_cache_key(pipe, image, custom_prompt):
+    """Cache key over image content, prompt, model, sampling and preprocessing settings."""
+    params = dict(
+        SAMPLING_PARAMS,
+        image_size=pipe.get("image_size", DEFAULT_MAX_SIDE),
+        image_format=pipe.get("image_format", DEFAULT_FORMAT),
+        image_quality=pipe.get("image_quality", DEFAULT_QUALITY),
+    )
+    return make_key(content_hash(image), resolve_prompt(custom_prompt), pipe["model"], params)
+
+def analyze_image_with_model(pipe, image, custom_prompt: str, encode_stats: dict = None, use_cache: bool = True):
+    """Send one image to the VLM endpoint and return the full report text.
+
+    Results are served from and stored in the persistent result cache unless
+    `use_cache` is False; a refresh still stores the new result.
+    """
+    if image is None:
+        return "Please upload an image first."
+    turn = Turn("vlm_image_analysis", "lmstudio", pipe["model"], mode="blocking")
+    cache = get_result_cache()
+    with turn.stage("cache_lookup"):
+        key = result_cache_key(pipe, image, custom_prompt)
+        cached = cache.get(key) if use_cache else None
+    if cached is not None:
+        turn.set(cache_hit=True)
+        turn.finish()
+        return cached
+    encode_stats = encode_stats if encode_stats is not None else {}
+    try:
+        payload = build_image_payload(pipe, image, custom_prompt, encode_stats)
+        turn.add_stage("encode", encode_stats["encode_ms"] / 1000)
+        slot_stats = {}
+        with get_scheduler().slot(pipe.get("priority", INTERACTIVE), stats=slot_stats) as url:
+            r = post_json("lmstudio", url, payload)
+            r.raise_for_status()
+            result = r.json()
+    except Exception as e:
+        turn.finish(error=e)
+        raise
+    turn.add_stage("queue", slot_stats["queue_s"])
+    turn.add_stage("connect", r.timings["connect_s"])
+    turn.add_stage("ttft", r.timings["ttfb_s"])
+    turn.add_stage("generation", r.timings["total_s"] - r.timings["ttfb_s"])
+    turn.set(
+        cache_hit=False,
+        encode_cache_hit=encode_stats.get("cache_hit"),
+        payload_bytes=len(r.request.body or b""),
+        completion_tokens=(result.get("usage") or {}).get("completion_tokens"),
+        backend_url=slot_stats["backend_url"],
+    )
+    turn.finish()
     try:
-        return result["choices"][0]["message"]["content"]
+        content = result["choices"][0]["message"]["content"]
     except Exception:
         return result.get("text") or str(result)
+    cache.put(key, content)
+    return content
+
+def stream_image_analysis(pipe, image, custom_prompt: str, encode_stats: dict = None, stream_stats: dict = None):
+    """Like `analyze_image_with_model` but yields report tokens as the server sends them."""
+    payload = build_image_payload(pipe, image, custom_prompt, encode_stats)
+    with get_scheduler().slot(pipe.get("priority", INTERACTIVE), stats=stream_stats) as url:
+        yield from stream_chat_completion(url, payload, stats=stream_stats, backend="lmstudio")
+
+def render_cache_stats():
+    stats = get_result_cache().stats()
+    st.caption(
+        f"Result cache: {stats['entries']} entries, {stats['hits']} hits / {stats['misses']} misses "
+        f"({stats['hit_rate']:.0%} hit rate)"
+    )
 
 def load_model():
-    """Return LM Studio API config with hardcoded endpoint and model."""
-    lmstudio_url = "http://localhost:1234/v1/chat/completions"
-    lmstudio_model = "medgemma-4b-it"
-    return {"type": "lmstudio", "url": lmstudio_url, "model": lmstudio_model}
+    """Return LM Studio API config (model from LMSTUDIO_MODEL; the scheduler picks the endpoint)."""
+    lmstudio = backend_config()["lmstudio"]
+    return {
+        "type": "lmstudio",
+        "model": lmstudio["model"],
+        "priority": INTERACTIVE,
+        "image_size": DEFAULT_MAX_SIDE,
+        "image_format": DEFAULT_FORMAT,
+        "image_quality": DEFAULT_QUALITY,
+    }
+
+
+def preprocessing_settings():
+    """Render the image preprocessing controls and return them as a pipe update."""
+    with st.expander("Image Preprocessing", expanded=False):
+        image_size = st.number_input("Max image side (px)", min_value=128, max_value=4096, value=DEFAULT_MAX_SIDE, step=64)
+        image_format = st.selectbox("Encoding format", ["JPEG", "WEBP", "PNG"], index=["JPEG", "WEBP", "PNG"].index(DEFAULT_FORMAT) if DEFAULT_FORMAT in ("JPEG", "WEBP", "PNG") else 0)
+        image_quality = st.slider("Quality", min_value=30, max_value=100, value=DEFAULT_QUALITY)
+    return {"image_size": int(image_size), "image_format": image_format, "image_quality": int(image_quality)}
+
+
+def batch_mode():
+    """Analyze many images concurrently and write the reports to a results file."""
+    st.markdown("### \U0001F4C1 Batch Analysis")
+    uploaded_files = st.file_uploader("Input Images", type=["png", "jpg", "jpeg", "bmp", "tiff"], accept_multiple_files=True)
+    directory = st.text_input("...or a directory of images", value="", placeholder="images/")
+    custom_prompt = st.text_area(
+        "\U0001F4AC Custom Analysis Prompt (Optional)",
+        value="Describe this Image and Generate a compact Clinical report",
+        height=100,
+    )
+    concurrency = st.number_input("Concurrent requests", min_value=1, max_value=32, value=DEFAULT_CONCURRENCY)
+    settings = preprocessing_settings()
+    refresh = st.checkbox("Bypass cache (re-run inference)", value=False)
+
+    if not st.button("\U0001F50D Analyze Batch"):
+        return
+
+    items = [(f.name, f.getvalue()) for f in uploaded_files or []]
+    if directory.strip():
+        if os.path.isdir(directory.strip()):
+            items.extend(collect_directory_images(directory.strip()))
+        else:
+            st.error(f"Path does not exist: {directory}")
+    if not items:
+        st.warning("Please upload images or enter a directory before analysis.")
+        return
+
+    pipe = load_model()
+    pipe.update(settings, priority=BATCH)
+    progress = st.progress(0.0, text=f"0 / {len(items)} images")
+    status_area = st.container()
+    results = []
+    start = time.perf_counter()
+    analyze_fn = (lambda p, image, prompt: analyze_image_with_model(p, image, prompt, use_cache=not refresh))
+    for result in run_batch(analyze_fn, pipe, items, custom_prompt, concurrency):
+        results.append(result)
+        progress.progress(len(results) / len(items), text=f"{len(results)} / {len(items)} images")
+        with status_area.expander(f"{'❌' if result['error'] else '✅'} {result['image']} ({result['latency_s']:.1f} s)"):
+            st.markdown(result["report"] or f"Error: {result['error']}")
+    elapsed = time.perf_counter() - start
+
+    failed = sum(1 for r in results if r["error"])
+    summary = {
+        "images": len(results),
+        "failed": failed,
+        "concurrency": int(concurrency),
+        "elapsed_s": round(elapsed, 3),
+        "images_per_minute": round(images_per_minute(len(results), elapsed), 2),
+        "model": pipe["model"],
+        "prompt": custom_prompt,
+    }
+    path = write_results(results, summary)
+    st.success(
+        f"Analyzed {len(results)} images ({failed} failed) in {elapsed:.1f} s "
+        f"- {summary['images_per_minute']:.1f} images/min at concurrency {int(concurrency)}"
+    )
+    st.caption(f"Reports written to {os.path.abspath(path)}")
+    render_cache_stats()
+
+
+def tile_prompt(tile, size, custom_prompt):
+    if tile["label"] == OVERVIEW_LABEL:
+        return f"This is a downscaled view of the whole {size[0]}x{size[1]} image. {resolve_prompt(custom_prompt)}"
+    return (
+        f"This is region {describe_tile(tile)} of a larger {size[0]}x{size[1]} image. "
+        f"{resolve_prompt(custom_prompt)} Report only what is visible in this region; "
+        "say 'no notable findings' if there are none."
+    )
+
+def summarize_regions(pipe, merged_report, custom_prompt):
+    """Condense per-region findings into one report that cites region labels."""
+    turn = Turn("vlm_tile_summary", "lmstudio", pipe["model"], mode="blocking")
+    payload = {
+        "model": pipe["model"],
+        "messages": [{
+            "role": "user",
+            "content": (
+                f"Below are findings from separate regions of one medical image. Task: {resolve_prompt(custom_prompt)}\n"
+                "Write one compact report. Cite the region label (e.g. B3) for every finding and "
+                "merge findings that span neighbouring regions.\n\n" + merged_report
+            ),
+        }],
+        **SAMPLING_PARAMS,
+    }
+    try:
+        slot_stats = {}
+        with get_scheduler().slot(pipe.get("priority", INTERACTIVE), stats=slot_stats) as url:
+            r = post_json("lmstudio", url, payload)
+            r.raise_for_status()
+        content = r.json()["choices"][0]["message"]["content"]
+    except Exception as e:
+        turn.finish(error=e)
+        raise
+    turn.add_stage("queue", slot_stats["queue_s"])
+    turn.add_stage("request", r.timings["total_s"])
+    turn.finish()
+    return content
+
+def _spool_upload(uploaded_file):
+    """Write an upload to the tile cache so it can be read region by region; returns (path, key)."""
+    data = uploaded_file.getbuffer()
+    key = content_hash(data)
+    upload_dir = os.path.join(TILE_CACHE_DIR, "uploads")
+    os.makedirs(upload_dir, exist_ok=True)
+    path = os.path.join(upload_dir, key + os.path.splitext(uploaded_file.name)[1].lower())
+    if not os.path.exists(path):
+        with open(path, "wb") as f:
+            f.write(data)
+    return path, key
+
+
+def tiled_mode():
+    """Analyze a very large image tile by tile and merge the findings into one region-referenced report."""
+    st.markdown("### 🔬 Tiled Analysis (whole-slide / high-resolution images)")
+    uploaded_file = st.file_uploader(
+        "Input Image",
+        type=["png", "jpg", "jpeg", "bmp", "tiff", "tif"] + [ext.lstrip(".") for ext in WSI_EXTENSIONS],
+        accept_multiple_files=False,
+    )
+    image_path = st.text_input("...or a file path on the server (avoids uploading very large slides)", value="")
+    custom_prompt = st.text_area(
+        "💬 Custom Analysis Prompt (Optional)",
+        value="Describe this Image and Generate a compact Clinical report",
+        height=100,
+    )
+    col_a, col_b = st.columns(2)
+    with col_a:
+        tile_size = st.number_input("Tile size (px)", min_value=256, max_value=8192, value=DEFAULT_TILE_SIZE, step=256)
+        max_tiles = st.number_input("Max tiles", min_value=1, max_value=256, value=DEFAULT_MAX_TILES)
+        concurrency = st.number_input("Concurrent requests", min_value=1, max_value=32, value=DEFAULT_CONCURRENCY)
+    with col_b:
+        min_tissue = st.slider("Min tissue fraction per tile", min_value=0.0, max_value=1.0, value=DEFAULT_MIN_TISSUE, step=0.05)
+        include_overview = st.checkbox("Also analyze a downscaled whole-image view", value=True)
+        summarize = st.checkbox("Summarize across regions", value=True)
+    settings = preprocessing_settings()
+    refresh = st.checkbox("Bypass cache (re-run inference)", value=False)
+
+    if not st.button("🔍 Analyze Tiles"):
+        return
+    if uploaded_file is not None:
+        path, key = _spool_upload(uploaded_file)
+    elif image_path.strip():
+        path, key = image_path.strip(), None
+        if not os.path.isfile(path):
+            st.error(f"Path does not exist: {path}")
+            return
+    else:
+        st.warning("Please upload an image or enter a file path before analysis.")
+        return
+
+    try:
+        regions = open_regions(path, key)
+    except ImageTooLarge as e:
+        st.error(str(e))
+        return
+    except OSError as e:
+        st.error(f"Could not read the image: {e}")
+        return
+    try:
+        with st.spinner("Reading image and finding tissue..."):
+            tiles, overview, info = plan_tiles(regions, int(tile_size), min_tissue, int(max_tiles))
+        scale = regions.size[0] / overview.shape[1]
+        st.image(draw_tile_grid(overview, tiles, scale), caption=(
+            f"{info['size'][0]}x{info['size'][1]} px, {info['grid'][0]}x{info['grid'][1]} grid: "
+            f"{info['tiles_with_tissue']} tiles with tissue, {info['tiles_selected']} analysed"
+        ))
+        if not tiles:
+            st.warning("No tile passed the tissue threshold; lower it or use a smaller tile size.")
+            return
+
+        pipe = load_model()
+        pipe.update(settings, priority=BATCH)
+        overview_tile = {"label": OVERVIEW_LABEL}
+        items = [(OVERVIEW_LABEL, overview_tile)] if include_overview else []
+        items += [(tile["label"], tile) for tile in tiles]
+
+        def analyze_tile(p, tile, prompt):
+            # Tiles are read inside the worker, so only `concurrency` of them are in memory at once
+            pixels = overview if tile is overview_tile else regions.read(tile["box"])
+            return analyze_image_with_model(p, Image.fromarray(pixels), tile_prompt(tile, info["size"], prompt), use_cache=not refresh)
+
+        progress = st.progress(0.0, text=f"0 / {len(items)} regions")
+        results = {}
+        start = time.perf_counter()
+        for result in run_batch(analyze_tile, pipe, items, custom_prompt, concurrency):
+            results[result["image"]] = result
+            progress.progress(len(results) / len(items), text=f"{len(results)} / {len(items)} regions")
+        elapsed = time.perf_counter() - start
+    finally:
+        regions.close()
+
+    merged = merge_tile_findings(tiles, results, info)
+    report_summary = None
+    if summarize:
+        try:
+            with st.spinner("Merging regional findings..."):
+                report_summary = summarize_regions(pipe, merged, custom_prompt)
+        except Exception as e:
+            st.warning(f"Could not summarize across regions: {e}")
+    if report_summary:
+        st.markdown("### 📊 Report")
+        st.markdown(report_summary)
+        with st.expander("Findings per region", expanded=False):
+            st.markdown(merged)
+    else:
+        st.markdown(merged)
+
+    failed = sum(1 for r in results.values() if r["error"])
+    summary = {
+        "image": uploaded_file.name if uploaded_file is not None else path,
+        "size": list(info["size"]),
+        "tile_size": int(tile_size),
+        "tiles_total": info["tiles_total"],
+        "tiles_analyzed": info["tiles_selected"],
+        "failed": failed,
+        "elapsed_s": round(elapsed, 3),
+        "model": pipe["model"],
+        "prompt": custom_prompt,
+        "report": report_summary,
+    }
+    path = write_results(list(results.values()), summary)
+    st.success(f"Analyzed {len(results)} regions ({failed} failed) in {elapsed:.1f} s at concurrency {int(concurrency)}")
+    st.caption(f"Region reports written to {os.path.abspath(path)}")
 
 
 def main():
-    st.markdown("# Medgemma VLM Medical Image Analysis 🧠")
+    profiler = start_profiler()
+    try:
+        render_page()
+    finally:
+        render_metrics_panel(profiler)
 
-    lmstudio_url = "http://localhost:1234/v1/chat/completions"
-    lmstudio_model = "medgemma-4b-it"
+
+def render_page():
+    st.markdown("# Medgemma VLM Medical Image Analysis 🧠")
 
     st.info(
         "This model is for educational and research purposes only. It is not a substitute for professional medical diagnosis or treatment."
     )
 
+    mode = st.radio("Mode", ["Single Image", "Batch", "Tiled (large image)"], horizontal=True)
+    if mode == "Batch":
+        batch_mode()
+        return
+    if mode == "Tiled (large image)":
+        tiled_mode()
+        return
+
     col1, col2 = st.columns([1, 2])
 
     with col1:
@@ -77,9 +443,8 @@ def main():
         uploaded_file = st.file_uploader("Input Image", type=["png", "jpg", "jpeg", "bmp", "tiff"], accept_multiple_files=False)
 
         if st.button("\U0001F4CB Load Sample Image"):
-            sample = load_sample_image()
-            if sample:
-                st.session_state["_sample_image"] = sample
+            if sample_image_path():
+                st.session_state["_show_sample_image"] = True
             else:
                 st.warning("Sample image not found in repo (images/Infection.jpg)")
 
@@ -89,6 +454,9 @@ def main():
             height=100,
         )
 
+        settings = preprocessing_settings()
+        refresh = st.checkbox("Bypass cache (re-run inference)", value=False)
+
         analyze = st.button("\U0001F50D Analyze Image")
 
     with col2:
@@ -97,42 +465,96 @@ def main():
         report_area = st.empty()
 
     image_to_use = None
+    image_bytes = None
     if uploaded_file is not None:
         try:
-            image_to_use = Image.open(uploaded_file).convert("RGB")
-            st.image(image_to_use, caption="Uploaded image", use_column_width=True)
+            image_bytes = uploaded_file.getvalue()
+            image_to_use, preview = decode_image(content_hash(image_bytes), image_bytes)
+            st.image(preview, caption="Uploaded image", use_column_width=True)
         except Exception as e:
+            image_bytes = None
             st.error(f"Could not open image: {e}")
-    elif st.session_state.get("_sample_image") is not None:
-        image_to_use = st.session_state.get("_sample_image")
-        st.image(image_to_use, caption="Sample image", use_column_width=True)
+    elif st.session_state.get("_show_sample_image"):
+        image_bytes = load_sample_image()
+        if image_bytes is not None:
+            image_to_use, preview = decode_image(content_hash(image_bytes), image_bytes)
+            st.image(preview, caption="Sample image", use_column_width=True)
 
     if analyze:
         if image_to_use is None:
             st.warning("Please upload or load a sample image before analysis.")
         else:
+            turn = None
             try:
                 with st.spinner("Loading model (this may take a while the first time)..."):
                     pipe = load_model()
+                    pipe.update(settings)
 
                 # Run analysis
                 with st.container():
                     placeholder = output_placeholder
                     placeholder.markdown("**Analysis running...**\n")
 
-                    full_response = analyze_image_with_model(pipe, image_to_use, custom_prompt)
-
-                    # Stream the response character-by-character to mimic typing
-                    typed = ""
-                    for ch in full_response:
-                        typed += ch
-                        report_area.text(typed)
-                        time.sleep(0.005)
+                    image_source = image_bytes if image_bytes is not None else image_to_use
+                    turn = Turn("vlm_image_analysis", "lmstudio", pipe["model"], mode="stream")
+                    cache = get_result_cache()
+                    lookup_start = time.perf_counter()
+                    with turn.stage("cache_lookup"):
+                        key = result_cache_key(pipe, image_source, custom_prompt)
+                        cached = None if refresh else cache.get(key)
+                    if cached is not None:
+                        report_area.markdown(cached)
+                        placeholder.markdown("**Analysis complete (cached)**")
+                        st.caption(f"Served from result cache in {(time.perf_counter() - lookup_start) * 1000:.1f} ms")
+                        turn.set(cache_hit=True)
+                        turn.finish()
+                    else:
+                        encode_stats = {}
+                        stream_stats = {}
+                        full_response = render_stream(
+                            stream_image_analysis(pipe, image_source, custom_prompt, encode_stats, stream_stats), report_area
+                        )
+                        if full_response:
+                            cache.put(key, full_response)
+                        turn.add_stage("encode", encode_stats["encode_ms"] / 1000)
+                        turn.add_stage("queue", stream_stats["queue_s"])
+                        turn.add_stage("connect", stream_stats["connect_s"])
+                        turn.add_stage("ttft", stream_stats["ttft_s"])
+                        turn.add_stage("generation", stream_stats["total_s"] - stream_stats["ttft_s"])
+                        turn.set(
+                            cache_hit=False,
+                            encode_cache_hit=encode_stats.get("cache_hit"),
+                            payload_bytes=encode_stats["bytes"],
+                            completion_tokens=stream_stats["completion_tokens"],
+                            backend_url=stream_stats["backend_url"],
+                        )
+                        turn.finish()
 
-                    placeholder.markdown("**Analysis complete**")
+                        placeholder.markdown("**Analysis complete**")
+                        st.caption(
+                            f"Queue: {stream_stats['queue_s'] * 1000:.0f} ms, "
+                            f"Connect: {stream_stats['connect_s'] * 1000:.0f} ms, "
+                            f"TTFB: {stream_stats['ttfb_s']:.2f} s, "
+                            f"TTFT: {stream_stats['ttft_s']:.2f} s, "
+                            f"{stream_stats['completion_tokens']} tokens at {stream_stats['tokens_per_s']:.1f} tokens/s, "
+                            f"total: {stream_stats['total_s']:.2f} s"
+                        )
+                        st.caption(
+                            f"Image payload: {encode_stats['bytes'] / 1024:.1f} KB, "
+                            f"encode: {encode_stats['encode_ms']:.1f} ms"
+                            + (" (cached)" if encode_stats.get("cache_hit") else "")
+                        )
+                    render_cache_stats()
 
+            except SchedulerOverloaded as e:
+                st.warning(str(e))
+                if turn is not None:
+                    turn.set(rejected=True)
+                    turn.finish(error=e)
             except Exception as e:
                 st.error(f"Error during analysis: {e}")
+                if turn is not None:
+                    turn.finish(error=e)
 
 
 
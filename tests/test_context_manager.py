@@ -0,0 +1,23 @@
+from utils.context_manager import _digest_counts, build_messages, count_tokens
+
+
+def test_long_message_is_cut_to_the_budget():
+    question = "What is the recommended dose?"
+    user_message = "[Short Memory]\n" + "lab value 42 mg/dL. " * 5000 + "\n[User Question]\n" + question
+    messages, info = build_messages("You are a clinician.", [], user_message, 1000, {})
+    assert info["truncated"]
+    assert info["prompt_tokens"] <= 1000
+    assert messages[-1]["content"].startswith("[Short Memory]")
+    assert messages[-1]["content"].endswith(question)
+
+
+def test_message_within_budget_is_unchanged():
+    messages, info = build_messages("You are a clinician.", [], "Is it safe?", 1000, {})
+    assert not info["truncated"]
+    assert messages[-1]["content"] == "Is it safe?"
+
+
+def test_long_texts_are_cached_by_digest():
+    text = "token " * 2000
+    assert count_tokens(text) == count_tokens(text)
+    assert all(isinstance(key, bytes) for key in _digest_counts)
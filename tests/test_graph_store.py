@@ -0,0 +1,40 @@
+from utils.graph_store import GraphStore
+
+_GRAPHML = """<?xml version="1.0" encoding="UTF-8"?>
+<graphml xmlns="http://graphml.graphdrawing.org/xmlns">
+  <key id="d0" for="node" attr.name="entity_type" attr.type="string"/>
+  <key id="d1" for="edge" attr.name="keywords" attr.type="string"/>
+  <key id="d2" for="edge" attr.name="weight" attr.type="double"/>
+  <graph edgedefault="undirected">
+    <node id="a"><data key="d0">PATIENT</data></node>
+    <node id="b"><data key="d0">CONDITION</data></node>
+    <node id="c"><data key="d0">ALLERGY</data></node>
+    {edges}
+  </graph>
+</graphml>
+"""
+
+
+def _store(tmp_path, edges):
+    path = tmp_path / "graph.graphml"
+    path.write_text(_GRAPHML.format(edges="\n".join(edges)), encoding="utf-8")
+    return GraphStore.load(str(path), cache_dir=None)
+
+
+def test_keyword_filter_with_trailing_keywordless_edge(tmp_path):
+    store = _store(tmp_path, [
+        '<edge source="a" target="b"><data key="d1">has condition</data><data key="d2">1.0</data></edge>',
+        '<edge source="a" target="c"><data key="d2">2.0</data></edge>',
+    ])
+    assert [r["target"] for r in store.relations("a", keywords="condition")] == ["b"]
+    assert store.neighborhood("a", keywords="condition") == {"b": 1}
+    assert len(store.relations("a")) == 2
+
+
+def test_keyword_filter_when_no_edge_has_keywords(tmp_path):
+    store = _store(tmp_path, [
+        '<edge source="a" target="b"><data key="d2">1.0</data></edge>',
+        '<edge source="a" target="c"><data key="d2">2.0</data></edge>',
+    ])
+    assert store.relations("a", keywords="condition") == []
+    assert store.neighborhood("a", keywords="condition") == {}
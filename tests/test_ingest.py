@@ -0,0 +1,33 @@
+import utils.ingest as ingest
+from utils.ingest import IngestJob
+
+
+class _Response:
+    def __init__(self, body):
+        self.body = body
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return self.body
+
+
+def _run(monkeypatch, tmp_path, body):
+    monkeypatch.setattr(ingest, "post_json", lambda *args, **kwargs: _Response(body))
+    job = IngestJob([("note.txt", b"Patient reports a penicillin allergy.")], 1, poll_interval=0.01,
+                    status_path=str(tmp_path / "kv_store_doc_status.json")).start()
+    job._thread.join(timeout=5)
+    return job
+
+
+def test_document_without_track_id_finishes(monkeypatch, tmp_path):
+    job = _run(monkeypatch, tmp_path, {"status": "success"})
+    assert job.done
+    assert [d["state"] for d in job.snapshot()["documents"]] == ["accepted"]
+
+
+def test_duplicate_document_is_skipped(monkeypatch, tmp_path):
+    job = _run(monkeypatch, tmp_path, {"status": "duplicated"})
+    assert job.done
+    assert [d["state"] for d in job.snapshot()["documents"]] == ["skipped"]
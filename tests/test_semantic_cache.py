@@ -0,0 +1,26 @@
+import pytest
+
+from utils.semantic_cache import is_follow_up
+
+
+@pytest.mark.parametrize("question", [
+    "and her allergies?",
+    "What about the dosage?",
+    "Also, any contraindications?",
+    "Is it safe?",
+    "What are his medications?",
+    "Can you expand on the previous answer?",
+])
+def test_follow_up_questions(question):
+    assert is_follow_up(question)
+
+
+@pytest.mark.parametrize("question", [
+    "Is it safe to take ibuprofen with warfarin?",
+    "What does this mean for a patient with stage 3 kidney disease?",
+    "What are the common side effects of metformin?",
+    "How is that condition usually treated in elderly patients?",
+    "What is hypertension?",
+])
+def test_standalone_questions(question):
+    assert not is_follow_up(question)
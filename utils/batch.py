@@ -0,0 +1,79 @@
+"""Concurrent batch analysis of many images against the VLM endpoint."""
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".bmp", ".tiff", ".tif")
+DEFAULT_CONCURRENCY = int(os.getenv("VLM_BATCH_CONCURRENCY", "2"))
+RESULTS_DIR = os.getenv("VLM_BATCH_RESULTS_DIR", "results")
+
+
+def collect_directory_images(path):
+    """Yield (name, file path) pairs for every image file directly under `path`.
+
+    Files are read by the batch worker that analyses them, not up front.
+    """
+    for name in sorted(os.listdir(path)):
+        item_path = os.path.join(path, name)
+        if os.path.isfile(item_path) and name.lower().endswith(IMAGE_EXTENSIONS):
+            yield name, item_path
+
+
+def load_item(data):
+    """Image bytes for a batch item given as a file path; anything else is returned unchanged."""
+    if isinstance(data, str):
+        with open(data, "rb") as f:
+            return f.read()
+    return data
+
+
+def run_batch(analyze_fn, pipe, items, prompt, concurrency=DEFAULT_CONCURRENCY):
+    """Fan `analyze_fn(pipe, image, prompt)` out over a bounded thread pool.
+
+    Yields one result dict per image as soon as it finishes, so the caller can
+    update progress from its own thread (Streamlit elements must not be
+    touched from worker threads). Items given as file paths are read by the
+    worker. If the caller stops iterating (e.g. a Streamlit rerun), queued
+    images are cancelled instead of analysed.
+    """
+    def _work(name, data):
+        start = time.perf_counter()
+        try:
+            report = analyze_fn(pipe, load_item(data), prompt)
+            error = None
+        except Exception as e:
+            report = None
+            error = str(e)
+        return {
+            "image": name,
+            "report": report,
+            "error": error,
+            "latency_s": round(time.perf_counter() - start, 3),
+        }
+
+    pool = ThreadPoolExecutor(max_workers=max(1, int(concurrency)))
+    try:
+        futures = [pool.submit(_work, name, data) for name, data in items]
+        for future in as_completed(futures):
+            yield future.result()
+    finally:
+        # Only the images already being analysed are waited for
+        pool.shutdown(wait=True, cancel_futures=True)
+
+
+def images_per_minute(count, elapsed_s):
+    return count * 60.0 / elapsed_s if elapsed_s > 0 else 0.0
+
+
+def write_results(results, summary, results_dir=RESULTS_DIR):
+    """Write one JSON line per image plus a trailing summary line; return the path."""
+    os.makedirs(results_dir, exist_ok=True)
+    stamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    path = os.path.join(results_dir, f"vlm_batch_{stamp}.jsonl")
+    with open(path, "w", encoding="utf-8") as f:
+        for result in results:
+            f.write(json.dumps(result, ensure_ascii=False) + "\n")
+        f.write(json.dumps({"summary": summary}) + "\n")
+    return path
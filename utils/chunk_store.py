@@ -0,0 +1,116 @@
+"""In-memory BM25 index over LightRAG's kv_store_text_chunks.json."""
+import json
+import math
+import os
+import re
+import threading
+from collections import Counter, defaultdict, namedtuple
+from heapq import nlargest
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+_STOPWORDS = frozenset(
+    "a an and are as at be by for from has have how i in is it of on or that the this to was what when where which who why with".split()
+)
+
+
+def tokenize(text):
+    return [t for t in _TOKEN_RE.findall(text.lower()) if t not in _STOPWORDS]
+
+
+def chunk_text(chunk):
+    """Return the searchable text of a LightRAG chunk record."""
+    if isinstance(chunk, dict):
+        return chunk.get("content") or json.dumps(chunk)
+    return str(chunk)
+
+
+# One immutable snapshot of the index; a reload swaps in a new one with a single assignment
+_Index = namedtuple("_Index", "chunks postings doc_len avg_len")
+_EMPTY_INDEX = _Index([], {}, [], 0.0)
+
+
+class ChunkStore:
+    """Chunk store loaded once and re-indexed only when the file's mtime changes.
+
+    Lookups walk the posting lists of the query terms only, so their cost
+    depends on the query, not on the number of stored chunks.
+    """
+
+    def __init__(self, path, k1=1.5, b=0.75):
+        self.path = path
+        self.k1 = k1
+        self.b = b
+        self._lock = threading.Lock()
+        self._mtime = None
+        self._index = _EMPTY_INDEX
+
+    @property
+    def chunks(self):
+        return self._index.chunks
+
+    def _load(self):
+        with open(self.path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        chunks = list(data.values()) if isinstance(data, dict) else list(data)
+        postings = defaultdict(list)
+        doc_len = []
+        for idx, chunk in enumerate(chunks):
+            counts = Counter(tokenize(chunk_text(chunk)))
+            doc_len.append(sum(counts.values()))
+            for term, tf in counts.items():
+                postings[term].append((idx, tf))
+        return _Index(chunks, dict(postings), doc_len, (sum(doc_len) / len(doc_len)) if doc_len else 0.0)
+
+    def refresh(self):
+        """Reload and re-index if the file changed since the last load; returns the current index."""
+        with self._lock:
+            try:
+                mtime = os.stat(self.path).st_mtime_ns
+            except FileNotFoundError:
+                self._mtime = None
+                self._index = _EMPTY_INDEX
+                return self._index
+            if mtime != self._mtime:
+                try:
+                    self._index = self._load()
+                    self._mtime = mtime
+                except ValueError:
+                    # Caught mid-write by LightRAG: keep serving the last index and retry next time
+                    if self._mtime is None:
+                        raise
+            return self._index
+
+    def search(self, query, k=3):
+        """Return up to `k` chunks ranked by BM25 relevance to `query`."""
+        # Work on one snapshot so a concurrent reload cannot mix old and new arrays
+        index = self.refresh()
+        n_docs = len(index.chunks)
+        if not n_docs or k <= 0:
+            return []
+        scores = defaultdict(float)
+        for term in set(tokenize(query)):
+            postings = index.postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (n_docs - len(postings) + 0.5) / (len(postings) + 0.5))
+            for idx, tf in postings:
+                norm = self.k1 * (1 - self.b + self.b * index.doc_len[idx] / index.avg_len)
+                scores[idx] += idf * tf * (self.k1 + 1) / (tf + norm)
+        best = nlargest(k, scores.items(), key=lambda item: item[1])
+        return [index.chunks[idx] for idx, _ in best]
+
+    def __len__(self):
+        return len(self.refresh().chunks)
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_chunk_store(path):
+    """Return the process-wide store for `path` so the index survives Streamlit reruns."""
+    path = os.path.abspath(path)
+    with _stores_lock:
+        if path not in _stores:
+            _stores[path] = ChunkStore(path)
+        return _stores[path]
@@ -0,0 +1,211 @@
+"""Process-wide pooled HTTP/LLM clients for LM Studio, LightRAG and OpenAI.
+
+Every page goes through here so keep-alive connections are reused across
+turns and Streamlit sessions instead of paying TCP/TLS setup per request.
+"""
+import threading
+import time
+from collections import deque
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.util.retry import Retry
+
+from utils.config import backend_config
+
+_local = threading.local()
+
+
+def _record_connect(start):
+    _local.connect_s = getattr(_local, "connect_s", 0.0) + time.perf_counter() - start
+
+
+class _TimedHTTPConnection(HTTPConnection):
+    def connect(self):
+        start = time.perf_counter()
+        try:
+            super().connect()
+        finally:
+            _record_connect(start)
+
+
+class _TimedHTTPSConnection(HTTPSConnection):
+    def connect(self):
+        start = time.perf_counter()
+        try:
+            super().connect()
+        finally:
+            _record_connect(start)
+
+
+class _TimedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = _TimedHTTPConnection
+
+
+class _TimedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = _TimedHTTPSConnection
+
+
+class TimedAdapter(HTTPAdapter):
+    """HTTPAdapter whose pools measure how long new connections take to open."""
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": _TimedHTTPConnectionPool,
+            "https": _TimedHTTPSConnectionPool,
+        }
+
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+_timings = {}
+
+
+def get_session(backend):
+    """Return the shared keep-alive `requests.Session` for `backend`."""
+    with _sessions_lock:
+        session = _sessions.get(backend)
+        if session is None:
+            http = backend_config()["http"]
+            retry = Retry(
+                total=http["max_retries"],
+                connect=http["max_retries"],
+                read=0,
+                status=http["max_retries"],
+                backoff_factor=http["backoff_factor"],
+                status_forcelist=(429, 502, 503, 504),
+                allowed_methods=frozenset({"GET", "POST", "DELETE"}),
+                raise_on_status=False,
+            )
+            adapter = TimedAdapter(pool_connections=4, pool_maxsize=http["pool_size"], max_retries=retry)
+            session = requests.Session()
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            _sessions[backend] = session
+            _timings[backend] = deque(maxlen=200)
+        return session
+
+
+def default_timeout(backend):
+    cfg = backend_config()[backend]
+    return (cfg["connect_timeout"], cfg["read_timeout"])
+
+
+def request(backend, method, url, timeout=None, stream=False, **kwargs):
+    """Send a request through the backend's pool and attach `response.timings`.
+
+    ``timings`` holds ``connect_s`` (0 when a pooled connection was reused),
+    ``ttfb_s`` (until response headers) and, for non-streamed requests,
+    ``total_s`` (until the body is read). Streamed callers should call
+    `finish_timing` once they have consumed the body.
+    """
+    session = get_session(backend)
+    _local.connect_s = 0.0
+    start = time.perf_counter()
+    response = session.request(method, url, timeout=timeout or default_timeout(backend), stream=True, **kwargs)
+    response.timings = {
+        "backend": backend,
+        "connect_s": _local.connect_s,
+        "ttfb_s": time.perf_counter() - start,
+        "_start": start,
+    }
+    _local.last_timings = response.timings
+    if not stream:
+        response.content  # read the body so the connection returns to the pool
+        finish_timing(response)
+    return response
+
+
+def finish_timing(response):
+    timings = response.timings
+    if "total_s" not in timings:
+        timings["total_s"] = time.perf_counter() - timings.pop("_start")
+        _timings[timings["backend"]].append(dict(timings))
+    return timings
+
+
+def post_json(backend, url, payload, timeout=None, stream=False, **kwargs):
+    kwargs.setdefault("headers", {"Content-Type": "application/json"})
+    return request(backend, "POST", url, json=payload, timeout=timeout, stream=stream, **kwargs)
+
+
+def lightrag_url(path):
+    return backend_config()["lightrag"]["url"].rstrip("/") + path
+
+
+def recent_timings(backend):
+    """Timings of the most recent requests to `backend`, oldest first."""
+    return list(_timings.get(backend, ()))
+
+
+def last_timings():
+    """Timings of the latest request sent from this thread (through `request` or the OpenAI client)."""
+    return getattr(_local, "last_timings", None)
+
+
+def _openai_trace(event, info):
+    # httpcore trace hook: time TCP connect and TLS handshake of new connections
+    if event in ("connection.connect_tcp.started", "connection.start_tls.started"):
+        _local.trace_start = time.perf_counter()
+    elif event in ("connection.connect_tcp.complete", "connection.start_tls.complete"):
+        _record_connect(_local.trace_start)
+
+
+def _openai_request_hook(request):
+    _local.connect_s = 0.0
+    _local.openai_start = time.perf_counter()
+    request.extensions["trace"] = _openai_trace
+
+
+def _openai_response_hook(response):
+    start = _local.openai_start
+    response.timings = {
+        "backend": "openai",
+        "connect_s": _local.connect_s,
+        "ttfb_s": time.perf_counter() - start,
+        "_start": start,
+    }
+    _local.last_timings = response.timings
+    close = response.close
+
+    def _close():
+        # The SDK closes the response once a stream is consumed or a body read
+        try:
+            close()
+        finally:
+            finish_timing(response)
+
+    response.close = _close
+
+
+_openai_client = None
+_openai_lock = threading.Lock()
+
+
+def get_openai_client():
+    """Return the shared OpenAI SDK client (it pools connections internally).
+
+    Its requests record the same ``connect_s``/``ttfb_s``/``total_s`` timings
+    as `request`, available through `last_timings` and `recent_timings("openai")`.
+    """
+    global _openai_client
+    with _openai_lock:
+        if _openai_client is None:
+            from openai import DefaultHttpxClient, OpenAI, Timeout
+
+            cfg = backend_config()
+            openai_cfg = cfg["openai"]
+            _timings.setdefault("openai", deque(maxlen=200))
+            _openai_client = OpenAI(
+                api_key=openai_cfg["api_key"],
+                base_url=openai_cfg["url"],
+                timeout=Timeout(openai_cfg["read_timeout"], connect=openai_cfg["connect_timeout"]),
+                max_retries=cfg["http"]["max_retries"],
+                http_client=DefaultHttpxClient(
+                    event_hooks={"request": [_openai_request_hook], "response": [_openai_response_hook]},
+                ),
+            )
+        return _openai_client
@@ -0,0 +1,82 @@
+"""Backend endpoints, models and HTTP settings, read from the environment."""
+import os
+
+
+_loaded_env = {}
+
+
+def load_env(dotenv_path):
+    """Load a `.env` file once per process, and again only after it changes.
+
+    Pages call this at the top of every script run, so reruns skip re-reading
+    and re-parsing the file. A reload after an edit overrides earlier values.
+    """
+    try:
+        mtime = os.path.getmtime(dotenv_path)
+    except OSError:
+        mtime = None
+    if dotenv_path in _loaded_env and _loaded_env[dotenv_path] == mtime:
+        return
+    from dotenv import load_dotenv
+
+    load_dotenv(dotenv_path=dotenv_path, override=dotenv_path in _loaded_env)
+    _loaded_env[dotenv_path] = mtime
+
+
+def _float(name, default):
+    return float(os.getenv(name, default))
+
+
+def _list(name, default):
+    return [item.strip() for item in os.getenv(name, default).split(",") if item.strip()]
+
+
+def backend_config():
+    """Return the current endpoint/model/timeout settings for every backend.
+
+    Values are read at call time so a `.env` loaded by the page is honoured.
+    """
+    return {
+        "lmstudio": {
+            "url": os.getenv("LMSTUDIO_URL", "http://localhost:1234/v1/chat/completions"),
+            # Pool of interchangeable LM Studio boxes; defaults to the single LMSTUDIO_URL
+            "urls": _list("LMSTUDIO_URLS", os.getenv("LMSTUDIO_URL", "http://localhost:1234/v1/chat/completions")),
+            "model": os.getenv("LMSTUDIO_MODEL", "medgemma-4b-it"),
+            "connect_timeout": _float("LMSTUDIO_CONNECT_TIMEOUT", "5"),
+            "read_timeout": _float("LMSTUDIO_READ_TIMEOUT", "120"),
+        },
+        "embedding": {
+            "url": os.getenv("LMSTUDIO_EMBEDDING_URL")
+            or os.getenv("LMSTUDIO_URL", "http://localhost:1234/v1/chat/completions").replace("/chat/completions", "/embeddings"),
+            "model": os.getenv("EMBEDDING_MODEL", "text-embedding-nomic-embed-text-v1.5"),
+        },
+        "lightrag": {
+            "url": os.getenv("LIGHTRAG_SERVER_URL", "http://localhost:9621"),
+            "connect_timeout": _float("LIGHTRAG_CONNECT_TIMEOUT", "5"),
+            "read_timeout": _float("LIGHTRAG_READ_TIMEOUT", "60"),
+            # Dashboard "LightRAG Server" mode: retrieval mode, per-source deadlines and context size
+            "query_mode": os.getenv("LIGHTRAG_QUERY_MODE", "mix"),
+            "context_deadline": _float("LIGHTRAG_CONTEXT_DEADLINE", "4"),
+            "local_context_deadline": _float("LOCAL_CONTEXT_DEADLINE", "1"),
+            "context_tokens": int(os.getenv("LIGHTRAG_CONTEXT_TOKENS", "8000")),
+        },
+        "openai": {
+            "url": os.getenv("OPENAI_BASE_URL") or None,
+            "model": os.getenv("OPENAI_MODEL", "gpt-4o"),
+            "api_key": os.getenv("OPENAI_API_KEY"),
+            "connect_timeout": _float("OPENAI_CONNECT_TIMEOUT", "10"),
+            "read_timeout": _float("OPENAI_READ_TIMEOUT", "120"),
+        },
+        "scheduler": {
+            "max_inflight": int(os.getenv("LMSTUDIO_MAX_INFLIGHT", "2")),
+            "queue_size": int(os.getenv("LMSTUDIO_QUEUE_SIZE", "32")),
+            "queue_timeout": _float("LMSTUDIO_QUEUE_TIMEOUT", "20"),
+            "batch_queue_timeout": _float("LMSTUDIO_BATCH_QUEUE_TIMEOUT", "600"),
+            "health_interval": _float("LMSTUDIO_HEALTH_INTERVAL", "10"),
+        },
+        "http": {
+            "max_retries": int(os.getenv("HTTP_MAX_RETRIES", "2")),
+            "backoff_factor": _float("HTTP_BACKOFF_FACTOR", "0.5"),
+            "pool_size": int(os.getenv("HTTP_POOL_SIZE", "16")),
+        },
+    }
@@ -0,0 +1,177 @@
+"""Concurrent retrieval of prompt context from several sources, each with its own deadline.
+
+The dashboard's LightRAG mode asks the LightRAG server, the local chunk
+memory, the knowledge graph, the patient records and the uploaded file at
+the same time, so the wait is the slowest source that makes its deadline
+rather than the sum of all of them. Whatever arrives in time is merged,
+de-duplicated and cut to a token budget before generation starts; a late
+source is reported and its result discarded.
+"""
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+
+from utils.chunk_store import tokenize
+from utils.context_manager import count_tokens
+
+OK = "ok"
+EMPTY = "empty"
+LATE = "late"
+ERROR = "error"
+
+# Word n-grams compared between blocks; a block whose shingles were mostly seen is a duplicate
+_SHINGLE = 5
+DUPLICATE_OVERLAP = 0.8
+_PARAGRAPH_RE = re.compile(r"\n\s*\n")
+
+
+def fetch_contexts(sources, executor=None):
+    """Run every source concurrently and collect what finishes before its deadline.
+
+    `sources` is a list of ``(name, fn, deadline_s)``; ``fn()`` returns the
+    source's context blocks (a list of strings, or one string). Returns one
+    dict per source, in the given order, with ``name``, ``status`` (`OK`,
+    `EMPTY`, `LATE` or `ERROR`), ``elapsed_s``, ``blocks`` and ``error``.
+    Deadlines are measured from the start of the fan-out; a late source
+    keeps running on its worker but is not waited for.
+    """
+    executor = executor or get_executor()
+    start = time.perf_counter()
+    finished = {}
+
+    def timed(name, fn):
+        try:
+            result = fn()
+        finally:
+            finished[name] = time.perf_counter() - start
+        return result
+
+    futures = [(name, executor.submit(timed, name, fn), deadline_s) for name, fn, deadline_s in sources]
+    results = []
+    for name, future, deadline_s in futures:
+        result = {"name": name, "deadline_s": deadline_s, "blocks": [], "error": None}
+        try:
+            value = future.result(timeout=max(0.0, start + deadline_s - time.perf_counter()))
+        except FutureTimeout:
+            result.update(status=LATE, elapsed_s=time.perf_counter() - start)
+        except Exception as e:
+            result.update(status=ERROR, elapsed_s=finished.get(name, time.perf_counter() - start), error=str(e))
+        else:
+            blocks = [value] if isinstance(value, str) else list(value or ())
+            result["blocks"] = [b.strip() for b in blocks if b and b.strip()]
+            result.update(status=OK if result["blocks"] else EMPTY, elapsed_s=finished[name])
+        results.append(result)
+    return results
+
+
+def _shingles(text):
+    words = tokenize(text)
+    if len(words) <= _SHINGLE:
+        return {tuple(words)} if words else set()
+    return {tuple(words[i:i + _SHINGLE]) for i in range(len(words) - _SHINGLE + 1)}
+
+
+def _truncate(text, max_tokens):
+    if count_tokens(text) <= max_tokens:
+        return text
+    # Characters per token varies; shrink until it fits
+    cut = text[:max_tokens * 4]
+    while cut and count_tokens(cut) > max_tokens:
+        cut = cut[:int(len(cut) * 0.9)]
+    return cut.rsplit(" ", 1)[0] + "…"
+
+
+def merge_contexts(results, budget, headers, max_block_tokens=None):
+    """Merge the blocks of `results` into one prompt section per source, within `budget` tokens.
+
+    Sources take turns adding their next block, in the order of `results`,
+    so a verbose source cannot crowd out the others. Blocks that repeat
+    content already taken (by word shingles, so formatting differences
+    between sources do not matter) are dropped. `headers` maps a source
+    name to its section header, e.g. ``[Patient Record]``. Returns
+    ``(text, info)`` with the tokens used and duplicates dropped.
+    """
+    max_block_tokens = max_block_tokens or max(64, budget // 4)
+    queues = {r["name"]: list(r["blocks"]) for r in results if r["status"] == OK}
+    taken = {name: [] for name in queues}
+    seen = set()
+    used = duplicates = skipped = 0
+    while any(queues.values()):
+        for name, queue in queues.items():
+            if not queue:
+                continue
+            block = _truncate(queue.pop(0), max_block_tokens)
+            shingles = _shingles(block)
+            if shingles and len(shingles & seen) >= DUPLICATE_OVERLAP * len(shingles):
+                duplicates += 1
+                continue
+            cost = count_tokens(block) + 1
+            if used + cost > budget:
+                skipped += 1
+                continue
+            seen |= shingles
+            taken[name].append(block)
+            used += cost
+    sections = [f"{headers.get(name, f'[{name}]')}\n" + "\n".join(blocks) for name, blocks in taken.items() if blocks]
+    info = {
+        "tokens": used,
+        "budget": budget,
+        "duplicates": duplicates,
+        "over_budget": skipped,
+        "blocks": {name: len(blocks) for name, blocks in taken.items()},
+    }
+    return "\n".join(sections), info
+
+
+def relevant_paragraphs(text, query, k=4):
+    """The `k` paragraphs of `text` sharing the most terms with `query`, in document order.
+
+    When no paragraph matches (e.g. "summarize this file"), the opening paragraphs are returned.
+    """
+    paragraphs = [p.strip() for p in _PARAGRAPH_RE.split(text) if p.strip()]
+    terms = set(tokenize(query))
+    scored = [(len(terms.intersection(tokenize(p))), i) for i, p in enumerate(paragraphs)]
+    matches = sorted((s for s in scored if s[0] > 0), key=lambda s: (-s[0], s[1]))[:k]
+    return [paragraphs[i] for i in sorted(i for _, i in matches)] if matches else paragraphs[:k]
+
+
+def split_lines(text):
+    """LightRAG context as blocks: one per non-empty line, keeping its section markers."""
+    return [line for line in (text or "").splitlines() if line.strip() and not line.strip().startswith("```")]
+
+
+def format_fanout(results, merge_info=None):
+    """One-line summary of per-source timing for the chat caption."""
+    parts = []
+    for r in results:
+        ms = r["elapsed_s"] * 1000
+        if r["status"] == LATE:
+            parts.append(f"{r['name']}: late (> {r['deadline_s']:.1f} s)")
+        elif r["status"] == ERROR:
+            parts.append(f"{r['name']}: failed after {ms:.0f} ms")
+        elif r["status"] == EMPTY:
+            parts.append(f"{r['name']}: nothing in {ms:.0f} ms")
+        else:
+            parts.append(f"{r['name']}: {ms:.0f} ms")
+    line = "Context: " + " · ".join(parts)
+    if merge_info:
+        line += f" — {merge_info['tokens']} / {merge_info['budget']} tokens"
+        if merge_info["duplicates"]:
+            line += f", {merge_info['duplicates']} duplicates dropped"
+        if merge_info["over_budget"]:
+            line += f", {merge_info['over_budget']} blocks over budget"
+    return line
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    """Process-wide worker pool for context fan-out, shared by every session."""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=16, thread_name_prefix="context-fanout")
+        return _executor
@@ -0,0 +1,168 @@
+"""Token-budgeted conversation history for the chat pages."""
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+
+# Context window per model source; the reply's max_tokens is reserved out of it
+CONTEXT_WINDOWS = {
+    "OpenAI Model": int(os.getenv("OPENAI_CONTEXT_LENGTH", "128000")),
+    "Local Offline Model": int(os.getenv("LMSTUDIO_CONTEXT_LENGTH", "4096")),
+    "LightRAG Server": int(os.getenv("OPENAI_CONTEXT_LENGTH", "128000")),
+}
+# Cap on history even for large windows, to keep prefill time bounded
+MAX_HISTORY_TOKENS = int(os.getenv("MAX_HISTORY_TOKENS", "8000"))
+SUMMARY_MAX_TOKENS = int(os.getenv("HISTORY_SUMMARY_MAX_TOKENS", "300"))
+# Once over budget, trim history down to this fraction so the next few turns
+# only append and the prompt prefix (and the backend's KV cache) stays stable
+LOW_WATER = 0.6
+_MESSAGE_OVERHEAD = 4
+# Texts up to this length are cached by value; longer ones (prompts with context) by digest,
+# so the cache never keeps large strings alive
+_CACHE_TEXT_CHARS = 2048
+_DIGEST_CACHE_SIZE = 4096
+_TRUNCATION_MARKER = "\n…[truncated to fit the model's context window]…\n"
+
+_encoder = None
+
+
+def _get_encoder():
+    global _encoder
+    if _encoder is None:
+        try:
+            import tiktoken
+
+            _encoder = tiktoken.get_encoding("cl100k_base")
+        except Exception:
+            _encoder = False
+    return _encoder
+
+
+def _count(text):
+    encoder = _get_encoder()
+    if encoder:
+        return len(encoder.encode(text, disallowed_special=()))
+    return (len(text) + 3) // 4
+
+
+@lru_cache(maxsize=4096)
+def _count_short(text):
+    return _count(text)
+
+
+_digest_counts = OrderedDict()
+_digest_lock = threading.Lock()
+
+
+def count_tokens(text):
+    """Token count with tiktoken when installed, otherwise a ~4 chars/token estimate."""
+    if len(text) <= _CACHE_TEXT_CHARS:
+        return _count_short(text)
+    key = hashlib.blake2b(text.encode("utf-8", "surrogatepass"), digest_size=16).digest()
+    with _digest_lock:
+        tokens = _digest_counts.get(key)
+        if tokens is not None:
+            _digest_counts.move_to_end(key)
+            return tokens
+    tokens = _count(text)
+    with _digest_lock:
+        _digest_counts[key] = tokens
+        if len(_digest_counts) > _DIGEST_CACHE_SIZE:
+            _digest_counts.popitem(last=False)
+    return tokens
+
+
+def count_message_tokens(messages):
+    return sum(count_tokens(m["content"]) + _MESSAGE_OVERHEAD for m in messages)
+
+
+def prompt_budget(model_source, max_tokens):
+    """Tokens available for the prompt once the reply is reserved."""
+    window = CONTEXT_WINDOWS.get(model_source, CONTEXT_WINDOWS["Local Offline Model"])
+    return max(256, window - max_tokens)
+
+
+def _summarize_turn(message, limit=160):
+    text = " ".join(message["content"].split())
+    if len(text) > limit:
+        text = text[:limit].rsplit(" ", 1)[0] + "…"
+    return f"{'User' if message['role'] == 'user' else 'Assistant'}: {text}"
+
+
+def _trim_summary(summary):
+    while summary and count_tokens(summary) > SUMMARY_MAX_TOKENS:
+        # Drop the oldest summarised line first
+        summary = summary.split("\n", 1)[1] if "\n" in summary else summary[len(summary) // 2:]
+    return summary
+
+
+def fit_text(text, max_tokens):
+    """`text` cut in the middle to at most `max_tokens`, keeping its start and its end (the question)."""
+    if count_tokens(text) <= max_tokens:
+        return text
+    keep = max(0, max_tokens - count_tokens(_TRUNCATION_MARKER))
+    # Characters per token varies; start from ~4 and shrink until it fits
+    chars = min(len(text), keep * 4)
+    while True:
+        head = chars // 4
+        cut = text[:head] + _TRUNCATION_MARKER + text[len(text) - (chars - head):]
+        if chars == 0 or count_tokens(cut) <= max_tokens:
+            return cut
+        chars = int(chars * 0.9)
+
+
+def build_messages(system_prompt, history, user_message, budget, state):
+    """Fit `history` into `budget` and return ``(messages, info)`` for the request.
+
+    `history` holds the stored turns (raw questions and answers, no retrieval
+    blocks); `user_message` is the current turn with its context blocks.
+    `state` is a mutable dict persisted by the caller (e.g. in session state)
+    with ``start`` (index of the oldest turn still sent verbatim) and
+    ``summary`` (extractive summary of dropped turns). Turns are dropped in
+    pairs and only when the budget is exceeded, trimming down to a low-water
+    mark, so consecutive requests share the same prefix. A `user_message`
+    that alone exceeds the budget is cut in the middle (``info["truncated"]``).
+    """
+    state.setdefault("start", 0)
+    state.setdefault("summary", "")
+    state["start"] = min(state["start"], len(history))
+    room = budget - count_tokens(system_prompt) - 2 * _MESSAGE_OVERHEAD
+    fitted = fit_text(user_message, max(0, room))
+    truncated = fitted is not user_message
+    user_message = fitted
+    fixed = count_tokens(system_prompt) + count_tokens(user_message) + 2 * _MESSAGE_OVERHEAD
+    available = max(0, min(budget - fixed, MAX_HISTORY_TOKENS))
+
+    def used():
+        return count_tokens(state["summary"]) + count_message_tokens(history[state["start"]:])
+
+    dropped = 0
+    if used() > available:
+        target = int(available * LOW_WATER)
+        while state["start"] < len(history) and used() > target:
+            turn = history[state["start"]]
+            state["summary"] = _trim_summary("\n".join(filter(None, [state["summary"], _summarize_turn(turn)])))
+            state["start"] += 1
+            dropped += 1
+        # Never start the verbatim history on an assistant turn
+        while state["start"] < len(history) and history[state["start"]]["role"] != "user":
+            state["summary"] = _trim_summary(state["summary"] + "\n" + _summarize_turn(history[state["start"]]))
+            state["start"] += 1
+            dropped += 1
+
+    system = system_prompt
+    if state["summary"]:
+        system = f"{system_prompt}\n\n[Earlier Conversation Summary]\n{state['summary']}"
+    messages = [{"role": "system", "content": system}]
+    messages += [{"role": m["role"], "content": m["content"]} for m in history[state["start"]:]]
+    messages.append({"role": "user", "content": user_message})
+    info = {
+        "prompt_tokens": count_message_tokens(messages),
+        "budget": budget,
+        "history_turns": len(history) - state["start"],
+        "summarized_turns": state["start"],
+        "dropped_this_turn": dropped,
+        "truncated": truncated,
+    }
+    return messages, info
@@ -0,0 +1,286 @@
+"""Array-backed, in-process query engine over LightRAG's GraphML knowledge graph."""
+import bisect
+import os
+import pickle
+import re
+import threading
+import xml.etree.ElementTree as ET
+from collections import OrderedDict, deque
+
+import numpy as np
+
+GRAPHML_PATH = os.getenv(
+    "LIGHTRAG_GRAPHML_PATH",
+    os.path.join(os.path.dirname(__file__), "..", "rag_storage", "graph_chunk_entity_relation.graphml"),
+)
+CACHE_DIR = os.getenv("GRAPH_CACHE_DIR", ".cache")
+_CACHE_VERSION = 1
+
+_NS = "{http://graphml.graphdrawing.org/xmlns}"
+_SEP = "<SEP>"
+_MASK_CACHE_SIZE = 256
+_ID_PREFIX_RE = re.compile(r"\b[0-9a-f]{8}(?:-[0-9a-f]{4}){0,3}(?:-[0-9a-f]{12})?", re.IGNORECASE)
+
+
+class _Interner:
+    def __init__(self):
+        self.values = []
+        self.index = {}
+
+    def add(self, value):
+        idx = self.index.get(value)
+        if idx is None:
+            idx = self.index[value] = len(self.values)
+            self.values.append(value)
+        return idx
+
+
+def parse_graphml(path):
+    """Parse a GraphML file into the flat arrays used by `GraphStore`."""
+    keys = {}
+    ids = _Interner()
+    types = _Interner()
+    keywords = _Interner()
+    node_type, node_desc, node_files = [], [], []
+    src, dst, weight, edge_desc = [], [], [], []
+    kw_indptr, kw_indices = [0], []
+
+    for _, elem in ET.iterparse(path, events=("end",)):
+        tag = elem.tag.replace(_NS, "")
+        if tag == "key":
+            keys[elem.get("id")] = elem.get("attr.name")
+        elif tag == "node":
+            attrs = {keys.get(d.get("key")): d.text or "" for d in elem.findall(_NS + "data")}
+            idx = ids.add(elem.get("id"))
+            if idx == len(node_type):
+                node_type.append(types.add(attrs.get("entity_type", "UNKNOWN")))
+                node_desc.append(attrs.get("description", ""))
+                node_files.append(attrs.get("file_path", ""))
+            elem.clear()
+        elif tag == "edge":
+            attrs = {keys.get(d.get("key")): d.text or "" for d in elem.findall(_NS + "data")}
+            src.append(ids.add(elem.get("source")))
+            dst.append(ids.add(elem.get("target")))
+            weight.append(float(attrs.get("weight") or 0.0))
+            edge_desc.append(attrs.get("description", ""))
+            for kw in attrs.get("keywords", "").split(","):
+                kw = kw.strip().lower()
+                if kw:
+                    kw_indices.append(keywords.add(kw))
+            kw_indptr.append(len(kw_indices))
+            elem.clear()
+
+    # Edges may reference nodes that were never declared
+    unknown = types.add("UNKNOWN")
+    while len(node_type) < len(ids.values):
+        node_type.append(unknown)
+        node_desc.append("")
+        node_files.append("")
+
+    n_nodes = len(ids.values)
+    src = np.asarray(src, dtype=np.int32)
+    dst = np.asarray(dst, dtype=np.int32)
+    # Undirected graph: every edge appears in the adjacency of both endpoints
+    heads = np.concatenate([src, dst])
+    tails = np.concatenate([dst, src])
+    edge_ids = np.concatenate([np.arange(len(src), dtype=np.int32)] * 2)
+    order = np.argsort(heads, kind="stable")
+    indptr = np.zeros(n_nodes + 1, dtype=np.int64)
+    np.cumsum(np.bincount(heads, minlength=n_nodes), out=indptr[1:])
+
+    return {
+        "version": _CACHE_VERSION,
+        "ids": ids.values,
+        "types": types.values,
+        "keywords": keywords.values,
+        "node_type": np.asarray(node_type, dtype=np.int32),
+        "node_desc": node_desc,
+        "node_files": node_files,
+        "src": src,
+        "dst": dst,
+        "weight": np.asarray(weight, dtype=np.float32),
+        "edge_desc": edge_desc,
+        "kw_indptr": np.asarray(kw_indptr, dtype=np.int64),
+        "kw_indices": np.asarray(kw_indices, dtype=np.int32),
+        "indptr": indptr,
+        "neighbors": tails[order],
+        "neighbor_edges": edge_ids[order],
+    }
+
+
+class GraphStore:
+    """CSR adjacency over interned entity IDs with entity, k-hop and keyword queries."""
+
+    def __init__(self, data):
+        self.__dict__.update(data)
+        self.id_index = {entity_id: i for i, entity_id in enumerate(self.ids)}
+        self._sorted_ids = sorted((entity_id.lower(), i) for i, entity_id in enumerate(self.ids))
+        self._sorted_keys = [k for k, _ in self._sorted_ids]
+        # Per-instance, so a store replaced on reload is freed with its masks
+        self._mask_cache = OrderedDict()
+        self._mask_lock = threading.Lock()
+
+    @classmethod
+    def load(cls, path=GRAPHML_PATH, cache_dir=CACHE_DIR):
+        """Load from the binary cache, re-parsing the GraphML only when it changed."""
+        stat = os.stat(path)
+        stamp = (stat.st_mtime_ns, stat.st_size)
+        cache_path = os.path.join(cache_dir, os.path.basename(path) + ".pkl") if cache_dir else None
+        if cache_path and os.path.exists(cache_path):
+            try:
+                with open(cache_path, "rb") as f:
+                    cached = pickle.load(f)
+                if cached.get("version") == _CACHE_VERSION and cached.get("stamp") == stamp:
+                    return cls(cached)
+            except Exception:
+                pass
+        data = parse_graphml(path)
+        data["stamp"] = stamp
+        if cache_path:
+            os.makedirs(cache_dir, exist_ok=True)
+            tmp_path = cache_path + ".tmp"
+            with open(tmp_path, "wb") as f:
+                pickle.dump(data, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, cache_path)
+        return cls(data)
+
+    def __len__(self):
+        return len(self.ids)
+
+    @property
+    def n_edges(self):
+        return len(self.src)
+
+    def entity(self, entity_id):
+        """Return the attributes of one entity, or None if it is unknown."""
+        i = self.id_index.get(entity_id)
+        if i is None:
+            return None
+        return {
+            "entity_id": entity_id,
+            "entity_type": self.types[self.node_type[i]],
+            "description": self.node_desc[i].replace(_SEP, " "),
+            "file_path": self.node_files[i].split(_SEP) if self.node_files[i] else [],
+            "degree": int(self.indptr[i + 1] - self.indptr[i]),
+        }
+
+    def find_entities(self, text, limit=5):
+        """Resolve entity IDs (full or prefix, e.g. "1739419d-…") mentioned in `text`."""
+        found = []
+        for match in _ID_PREFIX_RE.findall(text):
+            prefix = match.lower()
+            pos = bisect.bisect_left(self._sorted_keys, prefix)
+            while pos < len(self._sorted_keys) and self._sorted_keys[pos].startswith(prefix):
+                entity_id = self.ids[self._sorted_ids[pos][1]]
+                if entity_id not in found:
+                    found.append(entity_id)
+                pos += 1
+        return found[:limit]
+
+    def _edge_mask(self, keywords):
+        """Boolean mask of edges whose keywords contain any of `keywords` (substring match)."""
+        with self._mask_lock:
+            mask = self._mask_cache.get(keywords)
+            if mask is not None:
+                self._mask_cache.move_to_end(keywords)
+                return mask
+        wanted = [i for i, kw in enumerate(self.keywords) if any(q in kw for q in keywords)]
+        hit = np.isin(self.kw_indices, wanted)
+        # Edge of every keyword slot; edges without keywords simply get no slots
+        slot_edges = np.repeat(np.arange(self.n_edges), np.diff(self.kw_indptr))
+        mask = np.bincount(slot_edges[hit], minlength=self.n_edges) > 0
+        with self._mask_lock:
+            self._mask_cache[keywords] = mask
+            while len(self._mask_cache) > _MASK_CACHE_SIZE:
+                self._mask_cache.popitem(last=False)
+        return mask
+
+    def _normalize_keywords(self, keywords):
+        if not keywords:
+            return None
+        if isinstance(keywords, str):
+            keywords = [keywords]
+        return tuple(sorted(k.strip().lower() for k in keywords if k.strip()))
+
+    def neighborhood(self, entity_id, hops=1, keywords=None, max_nodes=None):
+        """Breadth-first k-hop neighbourhood of `entity_id`.
+
+        Only edges matching `keywords` (if given) are traversed. Returns a
+        dict mapping entity IDs to their hop distance, excluding the start.
+        """
+        start = self.id_index.get(entity_id)
+        if start is None:
+            return {}
+        kw = self._normalize_keywords(keywords)
+        mask = self._edge_mask(kw) if kw else None
+        dist = {start: 0}
+        queue = deque([start])
+        while queue:
+            node = queue.popleft()
+            if dist[node] >= hops:
+                continue
+            lo, hi = self.indptr[node], self.indptr[node + 1]
+            nbrs = self.neighbors[lo:hi]
+            if mask is not None:
+                nbrs = nbrs[mask[self.neighbor_edges[lo:hi]]]
+            for nbr in nbrs.tolist():
+                if nbr not in dist:
+                    dist[nbr] = dist[node] + 1
+                    queue.append(nbr)
+                    if max_nodes and len(dist) > max_nodes:
+                        queue.clear()
+                        break
+        del dist[start]
+        return {self.ids[i]: d for i, d in dist.items()}
+
+    def relations(self, entity_id, keywords=None, limit=None):
+        """Edges incident to `entity_id`, strongest first, optionally filtered by keywords."""
+        i = self.id_index.get(entity_id)
+        if i is None:
+            return []
+        lo, hi = self.indptr[i], self.indptr[i + 1]
+        edges = self.neighbor_edges[lo:hi]
+        kw = self._normalize_keywords(keywords)
+        if kw:
+            edges = edges[self._edge_mask(kw)[edges]]
+        edges = edges[np.argsort(-self.weight[edges], kind="stable")]
+        if limit:
+            edges = edges[:limit]
+        result = []
+        for e in edges.tolist():
+            other = self.dst[e] if self.src[e] == i else self.src[e]
+            k0, k1 = self.kw_indptr[e], self.kw_indptr[e + 1]
+            result.append({
+                "source": entity_id,
+                "target": self.ids[other],
+                "target_type": self.types[self.node_type[other]],
+                "weight": float(self.weight[e]),
+                "keywords": [self.keywords[k] for k in self.kw_indices[k0:k1].tolist()],
+                "description": self.edge_desc[e].replace(_SEP, " "),
+            })
+        return result
+
+    def context_for(self, entity_id, keywords=None, limit=20):
+        """Render an entity and its strongest relations as plain text for a prompt."""
+        entity = self.entity(entity_id)
+        if entity is None:
+            return ""
+        lines = [f"{entity_id} ({entity['entity_type']}): {entity['description']}"]
+        for rel in self.relations(entity_id, keywords=keywords, limit=limit):
+            lines.append(f"- {rel['target']} ({rel['target_type']}; {', '.join(rel['keywords'])}): {rel['description']}")
+        return "\n".join(lines)
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_graph_store(path=GRAPHML_PATH):
+    """Return the process-wide graph for `path`, reloading it when the file changes."""
+    path = os.path.abspath(path)
+    with _stores_lock:
+        store = _stores.get(path)
+        stat = os.stat(path)
+        if store is None or store.stamp != (stat.st_mtime_ns, stat.st_size):
+            store = _stores[path] = GraphStore.load(path)
+        return store
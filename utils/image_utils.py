@@ -0,0 +1,138 @@
+"""Image preprocessing and data-URL encoding for the VLM page."""
+import base64
+import hashlib
+import io
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from PIL import Image
+
+# MedGemma's vision encoder works on 896x896 inputs, anything bigger is
+# downsampled by the server anyway.
+DEFAULT_MAX_SIDE = int(os.getenv("VLM_IMAGE_SIZE", "896"))
+DEFAULT_FORMAT = os.getenv("VLM_IMAGE_FORMAT", "JPEG").upper()
+DEFAULT_QUALITY = int(os.getenv("VLM_IMAGE_QUALITY", "75"))
+# Huffman-table optimisation saves a few percent of bytes for several times the encode time
+OPTIMIZE = os.getenv("VLM_IMAGE_OPTIMIZE", "0").lower() in ("1", "true", "yes")
+ENCODE_CACHE_SIZE = int(os.getenv("VLM_ENCODE_CACHE_SIZE", "64"))
+
+_MIME_TYPES = {"JPEG": "image/jpeg", "PNG": "image/png", "WEBP": "image/webp"}
+
+
+class EncodedImageCache:
+    """Small thread-safe LRU of encoded data URLs keyed by content hash."""
+
+    def __init__(self, max_entries=ENCODE_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            value = self._items.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._items.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._items[key] = value
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_entries:
+                self._items.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def __len__(self):
+        return len(self._items)
+
+
+encode_cache = EncodedImageCache()
+
+
+def content_hash(source):
+    """Return a sha256 hex digest for raw image bytes or a PIL image."""
+    h = hashlib.sha256()
+    if isinstance(source, Image.Image):
+        h.update(f"{source.mode}:{source.size}".encode("utf-8"))
+        h.update(source.tobytes())
+    else:
+        h.update(source)
+    return h.hexdigest()
+
+
+def resize_to_fit(image, max_side=DEFAULT_MAX_SIDE):
+    """Downscale so the longest side is at most `max_side`, keeping aspect ratio."""
+    if image.mode not in ("RGB", "L"):
+        image = image.convert("RGB")
+    if max_side and max(image.size) > max_side:
+        image = image.copy()
+        image.thumbnail((max_side, max_side), Image.LANCZOS)
+    return image
+
+
+def encode_image(source, max_side=DEFAULT_MAX_SIDE, fmt=DEFAULT_FORMAT, quality=DEFAULT_QUALITY, use_cache=True):
+    """Resize and encode an image to a base64 data URL.
+
+    `source` may be raw file bytes (preferred: cache hits then skip decoding
+    entirely) or an already opened PIL image. A JPEG file that needs no
+    resizing is sent as is rather than re-encoded. Returns ``(data_url,
+    stats)`` where stats holds the payload size, encode time and whether
+    the cache hit.
+    """
+    fmt = fmt.upper()
+    if fmt not in _MIME_TYPES:
+        raise ValueError(f"Unsupported image format: {fmt}")
+    start = time.perf_counter()
+    key = None
+    if use_cache:
+        key = f"{content_hash(source)}:{max_side}:{fmt}:{quality}"
+        cached = encode_cache.get(key)
+        if cached is not None:
+            return cached, {
+                "bytes": len(cached),
+                "encode_ms": (time.perf_counter() - start) * 1000,
+                "cache_hit": True,
+            }
+
+    image = source if isinstance(source, Image.Image) else Image.open(io.BytesIO(source))
+    passthrough = (
+        not isinstance(source, Image.Image)
+        and image.format == fmt == "JPEG"
+        and image.mode in ("RGB", "L")
+        and not (max_side and max(image.size) > max_side)
+    )
+    if passthrough:
+        data = source
+    else:
+        image = resize_to_fit(image, max_side)
+        buffered = io.BytesIO()
+        save_kwargs = {}
+        if fmt in ("JPEG", "WEBP"):
+            save_kwargs["quality"] = quality
+        if fmt == "JPEG" and OPTIMIZE:
+            save_kwargs["optimize"] = True
+        image.save(buffered, format=fmt, **save_kwargs)
+        data = buffered.getvalue()
+    b64 = base64.b64encode(data).decode("utf-8")
+    data_url = f"data:{_MIME_TYPES[fmt]};base64,{b64}"
+    if use_cache:
+        encode_cache.put(key, data_url)
+    return data_url, {
+        "bytes": len(data_url),
+        "encode_ms": (time.perf_counter() - start) * 1000,
+        "cache_hit": False,
+        "passthrough": passthrough,
+        "size": image.size,
+    }
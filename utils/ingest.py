@@ -0,0 +1,254 @@
+"""Bulk, deduplicated document ingestion into LightRAG with background status tracking."""
+import hashlib
+import io
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from utils.clients import lightrag_url, post_json, request
+
+DOC_STATUS_PATH = os.getenv(
+    "LIGHTRAG_DOC_STATUS_PATH",
+    os.path.join(os.path.dirname(__file__), "..", "rag_storage", "kv_store_doc_status.json"),
+)
+SUPPORTED_EXTENSIONS = (".txt", ".md", ".csv", ".json", ".pdf", ".docx")
+# Large files are split into parts of at most this many characters
+MAX_PART_CHARS = int(os.getenv("INGEST_MAX_PART_CHARS", "500000"))
+DEFAULT_CONCURRENCY = int(os.getenv("INGEST_CONCURRENCY", "4"))
+POLL_INTERVAL_S = float(os.getenv("INGEST_POLL_INTERVAL_S", "2"))
+POLL_TIMEOUT_S = float(os.getenv("INGEST_POLL_TIMEOUT_S", "3600"))
+_READ_BLOCK = 1 << 20
+# Doc status states that mean LightRAG already has the document; failed ones may be ingested again
+_INDEXED_STATES = ("processed", "processing")
+
+
+def lightrag_doc_id(text):
+    """The ID LightRAG assigns to a document: ``doc-`` + md5 of the stripped text."""
+    return "doc-" + hashlib.md5(text.strip().encode("utf-8")).hexdigest()
+
+
+def known_doc_ids(status_path=DOC_STATUS_PATH):
+    """IDs of documents LightRAG has processed or is processing."""
+    try:
+        with open(status_path, "r", encoding="utf-8") as f:
+            statuses = json.load(f)
+    except (FileNotFoundError, ValueError):
+        return set()
+    return {
+        doc_id for doc_id, status in statuses.items()
+        if str(status.get("status", "") if isinstance(status, dict) else status).lower() in _INDEXED_STATES
+    }
+
+
+def _split_parts(pieces, max_chars=MAX_PART_CHARS):
+    """Group text pieces into parts of at most `max_chars`, preferring line breaks."""
+    buffer = ""
+    for piece in pieces:
+        buffer += piece
+        while len(buffer) > max_chars:
+            cut = buffer.rfind("\n", 0, max_chars)
+            cut = cut + 1 if cut > 0 else max_chars
+            yield buffer[:cut]
+            buffer = buffer[cut:]
+    if buffer.strip():
+        yield buffer
+
+
+def _open_source(source):
+    return open(source, "rb") if isinstance(source, str) else io.BytesIO(source)
+
+
+def iter_text_parts(name, source, max_chars=MAX_PART_CHARS):
+    """Extract text from a file path or raw bytes and yield it in bounded parts.
+
+    Plain-text formats are decoded incrementally, so large files never sit in
+    memory as a single string. PDFs need ``pypdf`` and DOCX files need
+    ``python-docx``.
+    """
+    ext = os.path.splitext(name)[1].lower()
+    if ext == ".pdf":
+        try:
+            from pypdf import PdfReader
+        except ImportError as e:
+            raise RuntimeError("PDF ingestion requires the 'pypdf' package") from e
+        with _open_source(source) as f:
+            reader = PdfReader(f)
+            yield from _split_parts(((page.extract_text() or "") + "\n" for page in reader.pages), max_chars)
+    elif ext == ".docx":
+        try:
+            import docx
+        except ImportError as e:
+            raise RuntimeError("DOCX ingestion requires the 'python-docx' package") from e
+        with _open_source(source) as f:
+            document = docx.Document(f)
+            yield from _split_parts((p.text + "\n" for p in document.paragraphs), max_chars)
+    else:
+        with _open_source(source) as f:
+            text = io.TextIOWrapper(f, encoding="utf-8", errors="replace", newline="")
+            yield from _split_parts(iter(lambda: text.read(_READ_BLOCK), ""), max_chars)
+
+
+def collect_directory_files(path):
+    """Return paths of every supported document under `path` (recursively)."""
+    found = []
+    for root, _, files in os.walk(path):
+        for name in sorted(files):
+            if name.lower().endswith(SUPPORTED_EXTENSIONS):
+                found.append(os.path.join(root, name))
+    return sorted(found)
+
+
+def iter_documents(sources, known):
+    """Yield document records for ``(name, path_or_bytes)`` sources, extracting one part at a time.
+
+    Documents whose LightRAG ID is in `known` (or earlier in this batch) are
+    marked ``skipped``; `known` is updated as parts are produced.
+    """
+    for name, source in sources:
+        try:
+            parts = iter_text_parts(name, source)
+            text = next(parts, None)
+            index = 0
+            while text is not None:
+                # Look one part ahead to know whether the file was split at all
+                following = next(parts, None)
+                index += 1
+                doc_id = lightrag_doc_id(text)
+                duplicate = doc_id in known
+                known.add(doc_id)
+                yield {
+                    "name": name if index == 1 and following is None else f"{name} (part {index})",
+                    "file_source": name,
+                    "text": None if duplicate else text,
+                    "chars": len(text),
+                    "doc_id": doc_id,
+                    "state": "skipped" if duplicate else "pending",
+                }
+                text = following
+        except Exception as e:
+            yield {"name": name, "state": "failed", "error": str(e)}
+
+
+class IngestJob:
+    """Extracts, submits and tracks documents in a background thread.
+
+    `sources` are ``(name, path_or_bytes)`` pairs. Text is extracted on the
+    job's thread and each part is submitted as soon as it is produced, with
+    at most a few parts in memory at once. Streamlit reruns read progress
+    through `snapshot()`; the job object itself is meant to live in session
+    state. A document the server accepts without a ``track_id`` cannot be
+    polled and is marked ``accepted`` rather than left ``submitted``.
+    """
+
+    def __init__(self, sources, concurrency=DEFAULT_CONCURRENCY, poll_interval=POLL_INTERVAL_S,
+                 poll_timeout=POLL_TIMEOUT_S, status_path=DOC_STATUS_PATH):
+        self.sources = sources
+        self.status_path = status_path
+        self.documents = []
+        self.extracting = True
+        self.concurrency = max(1, int(concurrency))
+        self.poll_interval = poll_interval
+        self.poll_timeout = poll_timeout
+        self.started_at = None
+        self.finished_at = None
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def start(self):
+        self.started_at = time.time()
+        self._thread = threading.Thread(target=self._run, name="lightrag-ingest", daemon=True)
+        self._thread.start()
+        return self
+
+    @property
+    def done(self):
+        return self.finished_at is not None
+
+    def _update(self, doc, **changes):
+        with self._lock:
+            doc.update(changes)
+
+    def _submit(self, doc):
+        try:
+            r = post_json("lightrag", lightrag_url("/documents/text"), {"text": doc["text"], "file_source": doc["file_source"]})
+            r.raise_for_status()
+            body = r.json()
+            if body.get("status") == "duplicated":
+                self._update(doc, state="skipped", text=None)
+            elif body.get("track_id"):
+                self._update(doc, state="submitted", track_id=body["track_id"], text=None, submitted_at=time.time())
+            else:
+                self._update(doc, state="accepted", text=None, submitted_at=time.time())
+        except Exception as e:
+            self._update(doc, state="failed", error=str(e), text=None)
+
+    def _poll(self):
+        deadline = time.time() + self.poll_timeout
+        while time.time() < deadline:
+            with self._lock:
+                pending = [d for d in self.documents if d["state"] in ("submitted", "processing") and d.get("track_id")]
+            if not pending:
+                return
+            for track_id in {d["track_id"] for d in pending}:
+                try:
+                    r = request("lightrag", "GET", lightrag_url(f"/documents/track_status/{track_id}"))
+                    r.raise_for_status()
+                    statuses = r.json().get("documents", [])
+                except Exception:
+                    continue
+                by_id = {s.get("id"): s for s in statuses}
+                for doc in pending:
+                    if doc.get("track_id") != track_id:
+                        continue
+                    status = by_id.get(doc["doc_id"]) or (statuses[0] if len(statuses) == 1 else None)
+                    if not status:
+                        continue
+                    metadata = status.get("metadata") or {}
+                    state = str(status.get("status", "")).lower()
+                    self._update(
+                        doc,
+                        state=state if state in ("processed", "failed") else "processing",
+                        processing_start_time=metadata.get("processing_start_time"),
+                        processing_end_time=metadata.get("processing_end_time"),
+                        error=status.get("error_msg") or doc.get("error"),
+                    )
+            time.sleep(self.poll_interval)
+
+    def _run(self):
+        try:
+            # Bounds the extracted parts waiting for (or in) an upload
+            slots = threading.BoundedSemaphore(2 * self.concurrency)
+            with ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+                for doc in iter_documents(self.sources, known_doc_ids(self.status_path)):
+                    with self._lock:
+                        self.documents.append(doc)
+                    if doc["state"] == "pending":
+                        slots.acquire()
+                        pool.submit(self._submit, doc).add_done_callback(lambda _: slots.release())
+                self.sources = None
+                self.extracting = False
+            self._poll()
+        finally:
+            self.extracting = False
+            self.finished_at = time.time()
+
+    def snapshot(self):
+        """Counts per state, per-document rows and throughput so far."""
+        with self._lock:
+            rows = [{k: v for k, v in d.items() if k != "text"} for d in self.documents]
+        counts = {}
+        for row in rows:
+            counts[row["state"]] = counts.get(row["state"], 0) + 1
+        end = self.finished_at or time.time()
+        elapsed = end - self.started_at if self.started_at else 0.0
+        processed = counts.get("processed", 0)
+        return {
+            "counts": counts,
+            "documents": rows,
+            "elapsed_s": elapsed,
+            "docs_per_minute": processed * 60.0 / elapsed if elapsed > 0 else 0.0,
+            "extracting": self.extracting,
+            "done": self.done,
+        }
@@ -0,0 +1,107 @@
+"""Server-sent-events streaming for OpenAI-compatible chat completion endpoints."""
+import json
+import time
+
+from utils.clients import finish_timing, post_json
+
+
+def iter_sse_data(response):
+    """Yield the `data:` payloads of a server-sent-events response."""
+    for line in response.iter_lines(decode_unicode=True):
+        if not line or line.startswith(":"):
+            continue
+        if line.startswith("data:"):
+            data = line[5:].strip()
+            if data == "[DONE]":
+                return
+            yield data
+
+
+def stream_chat_completion(url, payload, stats=None, timeout=None, backend="lmstudio"):
+    """POST `payload` with ``stream=True`` and yield content deltas as they arrive.
+
+    If `stats` is a dict it is filled with ``ttft_s``, ``total_s``,
+    ``completion_tokens``, ``tokens_per_s`` and the connection timings once
+    the stream ends. The request goes through `backend`'s pooled session. Token
+    counts come from the server's usage block when present, otherwise each
+    non-empty delta is counted as one token.
+    """
+    payload = dict(payload, stream=True)
+    payload.setdefault("stream_options", {"include_usage": True})
+    stats = stats if stats is not None else {}
+    start = time.perf_counter()
+    first = None
+    deltas = 0
+    usage_tokens = None
+    with post_json(backend, url, payload, timeout=timeout, stream=True) as r:
+        r.raise_for_status()
+        for data in iter_sse_data(r):
+            try:
+                event = json.loads(data)
+            except ValueError:
+                continue
+            if event.get("usage"):
+                usage_tokens = event["usage"].get("completion_tokens", usage_tokens)
+            for choice in event.get("choices") or []:
+                content = (choice.get("delta") or {}).get("content")
+                if content:
+                    if first is None:
+                        first = time.perf_counter()
+                        stats["ttft_s"] = first - start
+                    deltas += 1
+                    yield content
+        timings = finish_timing(r)
+    end = time.perf_counter()
+    tokens = usage_tokens if usage_tokens is not None else deltas
+    gen_time = end - (first or end)
+    stats.update({
+        "ttft_s": stats.get("ttft_s", end - start),
+        "total_s": end - start,
+        "completion_tokens": tokens,
+        "tokens_per_s": tokens / gen_time if gen_time > 0 else 0.0,
+        "connect_s": timings["connect_s"],
+        "ttfb_s": timings["ttfb_s"],
+    })
+
+
+def stream_lightrag_query(url, payload, stats=None, timeout=None):
+    """POST to LightRAG's ``/query/stream`` and yield answer text as it arrives.
+
+    The server replies with newline-delimited JSON objects carrying
+    ``response`` chunks, and optionally ``references`` or ``error``.
+    References end up in ``stats["references"]``; an error line raises
+    RuntimeError. Timing keys match `stream_chat_completion`.
+    """
+    stats = stats if stats is not None else {}
+    start = time.perf_counter()
+    first = None
+    chunks = 0
+    with post_json("lightrag", url, dict(payload, stream=True), timeout=timeout, stream=True) as r:
+        r.raise_for_status()
+        for line in r.iter_lines(decode_unicode=True):
+            if not line or not line.strip():
+                continue
+            try:
+                event = json.loads(line)
+            except ValueError:
+                continue
+            if event.get("error"):
+                raise RuntimeError(event["error"])
+            if event.get("references"):
+                stats["references"] = event["references"]
+            content = event.get("response")
+            if content:
+                if first is None:
+                    first = time.perf_counter()
+                    stats["ttft_s"] = first - start
+                chunks += 1
+                yield content
+        timings = finish_timing(r)
+    end = time.perf_counter()
+    stats.update({
+        "ttft_s": stats.get("ttft_s", end - start),
+        "total_s": end - start,
+        "chunks": chunks,
+        "connect_s": timings["connect_s"],
+        "ttfb_s": timings["ttfb_s"],
+    })
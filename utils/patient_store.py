@@ -0,0 +1,211 @@
+"""Columnar, indexed store over the Synthea CSV exports in inputs/."""
+import bisect
+import csv
+import os
+import re
+import threading
+
+import numpy as np
+
+INPUTS_DIR = os.getenv("PATIENT_DATA_DIR", os.path.join(os.path.dirname(__file__), "..", "inputs"))
+
+DATE_COLUMNS = {"START", "STOP", "BIRTHDATE", "DEATHDATE"}
+FLOAT_COLUMNS = {"LAT", "LON", "HEALTHCARE_EXPENSES", "HEALTHCARE_COVERAGE", "INCOME"}
+# Synthea table -> columns that get a hash index
+INDEXED_COLUMNS = {
+    "patients": ("Id",),
+    "conditions": ("PATIENT", "ENCOUNTER"),
+    "careplans": ("PATIENT", "ENCOUNTER", "Id"),
+    "allergies": ("PATIENT", "ENCOUNTER"),
+}
+_ID_PREFIX_RE = re.compile(r"\b[0-9a-f]{8}(?:-[0-9a-f]{4}){0,3}(?:-[0-9a-f]{12})?", re.IGNORECASE)
+
+
+class Column:
+    """Dictionary-encoded string column: int32 codes into a shared vocabulary."""
+
+    def __init__(self, values):
+        vocab = {}
+        codes = np.empty(len(values), dtype=np.int32)
+        for i, value in enumerate(values):
+            code = vocab.get(value)
+            if code is None:
+                code = vocab[value] = len(vocab)
+            codes[i] = code
+        self.codes = codes
+        self.vocab = list(vocab)
+
+    def __getitem__(self, row):
+        return self.vocab[self.codes[row]]
+
+    def __len__(self):
+        return len(self.codes)
+
+
+class Table:
+    """Typed columns for one CSV plus hash indexes mapping key -> row indices."""
+
+    def __init__(self, name, header, rows, indexed=()):
+        self.name = name
+        self.header = header
+        self.n_rows = len(rows)
+        columns = list(zip(*rows)) if rows else [() for _ in header]
+        self.columns = {}
+        for col, values in zip(header, columns):
+            if col in DATE_COLUMNS:
+                self.columns[col] = np.array([v or "NaT" for v in values], dtype="datetime64[D]")
+            elif col in FLOAT_COLUMNS:
+                self.columns[col] = np.array([float(v) if v else np.nan for v in values], dtype=np.float64)
+            else:
+                self.columns[col] = Column(values)
+        self.indexes = {col: self._build_index(col) for col in indexed if col in self.columns}
+
+    def _build_index(self, col):
+        # Group rows by code once: order[starts[c]:starts[c + 1]] are the rows with code c
+        column = self.columns[col]
+        order = np.argsort(column.codes, kind="stable").astype(np.int32)
+        starts = np.zeros(len(column.vocab) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(column.codes, minlength=len(column.vocab)), out=starts[1:])
+        lookup = {value: code for code, value in enumerate(column.vocab)}
+        return lookup, order, starts
+
+    def rows_for(self, col, key):
+        """Row indices whose `col` equals `key`, in file order."""
+        lookup, order, starts = self.indexes[col]
+        code = lookup.get(key)
+        if code is None:
+            return order[:0]
+        return order[starts[code]:starts[code + 1]]
+
+    def value(self, col, row):
+        column = self.columns.get(col)
+        if column is None:
+            return ""
+        value = column[row]
+        if isinstance(value, np.datetime64):
+            return "" if np.isnat(value) else str(value)
+        if isinstance(value, np.floating):
+            return "" if np.isnan(value) else float(value)
+        return value
+
+    def record(self, row, cols=None):
+        return {col: self.value(col, row) for col in (cols or self.header)}
+
+    @classmethod
+    def from_csv(cls, path, name=None, indexed=()):
+        with open(path, newline="", encoding="utf-8") as f:
+            reader = csv.reader(f)
+            header = next(reader, [])
+            rows = [row + [""] * (len(header) - len(row)) for row in reader if row]
+        return cls(name or os.path.splitext(os.path.basename(path))[0], header, rows, indexed)
+
+
+class PatientStore:
+    """Loads the Synthea tables once (reloading on mtime change) and assembles per-patient records."""
+
+    def __init__(self, inputs_dir=INPUTS_DIR):
+        self.inputs_dir = inputs_dir
+        self._tables = {}
+        self._stamps = {}
+        self._lock = threading.Lock()
+
+    def table(self, name):
+        path = os.path.join(self.inputs_dir, f"{name}.csv")
+        with self._lock:
+            try:
+                stamp = os.stat(path).st_mtime_ns
+            except FileNotFoundError:
+                self._tables.pop(name, None)
+                return None
+            if self._stamps.get(name) != stamp:
+                self._tables[name] = Table.from_csv(path, name, INDEXED_COLUMNS.get(name, ()))
+                self._stamps[name] = stamp
+                if name == "patients":
+                    ids = self._tables[name].columns["Id"].vocab
+                    self._sorted_ids = sorted((i.lower(), i) for i in ids)
+                    self._sorted_keys = [k for k, _ in self._sorted_ids]
+            return self._tables[name]
+
+    def find_patients(self, text, limit=3):
+        """Resolve patient IDs (full or prefix) mentioned in `text`."""
+        if self.table("patients") is None:
+            return []
+        keys = self._sorted_keys
+        found = []
+        for match in _ID_PREFIX_RE.findall(text):
+            prefix = match.lower()
+            pos = bisect.bisect_left(keys, prefix)
+            while pos < len(keys) and keys[pos].startswith(prefix):
+                if self._sorted_ids[pos][1] not in found:
+                    found.append(self._sorted_ids[pos][1])
+                pos += 1
+        return found[:limit]
+
+    def patient_record(self, patient_id, include_resolved=False):
+        """Demographics, conditions, allergies and care plans for one patient.
+
+        Only active entries (no STOP date) are included unless
+        `include_resolved` is set. Cost is proportional to the record size.
+        """
+        patients = self.table("patients")
+        if patients is None:
+            return None
+        rows = patients.rows_for("Id", patient_id)
+        if not len(rows):
+            return None
+        demo = patients.record(int(rows[0]), ["Id", "BIRTHDATE", "DEATHDATE", "FIRST", "LAST", "GENDER", "RACE", "ETHNICITY", "MARITAL", "CITY", "STATE"])
+        record = {"demographics": demo}
+        for name, cols in (
+            ("conditions", ["START", "STOP", "CODE", "DESCRIPTION"]),
+            ("allergies", ["START", "STOP", "CODE", "DESCRIPTION", "CATEGORY", "DESCRIPTION1", "SEVERITY1"]),
+            ("careplans", ["START", "STOP", "CODE", "DESCRIPTION", "REASONDESCRIPTION"]),
+        ):
+            table = self.table(name)
+            if table is None:
+                record[name] = []
+                continue
+            rows = table.rows_for("PATIENT", patient_id)
+            if not include_resolved and "STOP" in table.columns:
+                rows = rows[np.isnat(table.columns["STOP"][rows])]
+            record[name] = [table.record(int(r), [c for c in cols if c in table.columns]) for r in rows]
+        return record
+
+    def format_record(self, patient_id, max_items=20):
+        """Render a compact plain-text patient summary for prompt context."""
+        record = self.patient_record(patient_id)
+        if record is None:
+            return ""
+        d = record["demographics"]
+        lines = [
+            f"Patient {d['Id']}: {d['FIRST']} {d['LAST']}, {d['GENDER']}, born {d['BIRTHDATE']}"
+            + (f", died {d['DEATHDATE']}" if d["DEATHDATE"] else "")
+            + f", {d['CITY']}, {d['STATE']}"
+        ]
+        for name, label in (("conditions", "Active conditions"), ("allergies", "Allergies"), ("careplans", "Active care plans")):
+            items = record[name]
+            if not items:
+                continue
+            lines.append(f"{label}:")
+            seen = set()
+            for item in items:
+                if item["DESCRIPTION"] in seen:
+                    continue
+                seen.add(item["DESCRIPTION"])
+                extra = f" - {item['SEVERITY1']} {item['DESCRIPTION1']}".rstrip() if item.get("DESCRIPTION1") else ""
+                lines.append(f"- {item['DESCRIPTION']} (since {item['START']}){extra}")
+                if len(seen) >= max_items:
+                    break
+        return "\n".join(lines)
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_patient_store(inputs_dir=INPUTS_DIR):
+    """Return the process-wide store for `inputs_dir` so it survives Streamlit reruns."""
+    inputs_dir = os.path.abspath(inputs_dir)
+    with _stores_lock:
+        if inputs_dir not in _stores:
+            _stores[inputs_dir] = PatientStore(inputs_dir)
+        return _stores[inputs_dir]
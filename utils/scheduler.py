@@ -0,0 +1,223 @@
+"""Priority scheduler and load balancer for the pool of LM Studio backends.
+
+Every local chat/VLM call takes a slot from here. Requests are routed to
+the healthy backend with the fewest outstanding requests, interactive chat
+is always dequeued before batch image jobs, and each priority class has a
+bounded wait queue so overload is rejected up front instead of piling up
+into read timeouts.
+"""
+import heapq
+import itertools
+import threading
+import time
+from contextlib import contextmanager
+
+import requests
+from urllib3.exceptions import MaxRetryError, ReadTimeoutError
+
+from utils.clients import request
+from utils.config import backend_config
+
+INTERACTIVE = "interactive"
+BATCH = "batch"
+_RANK = {INTERACTIVE: 0, BATCH: 1}
+
+
+class SchedulerOverloaded(RuntimeError):
+    """Raised when a request is not admitted or waits longer than its queue timeout."""
+
+
+def is_connect_failure(error):
+    """True when `error` means the backend could not be reached, not that it was slow to answer.
+
+    Read timeouts can surface as ``requests.ConnectionError`` wrapping urllib3's
+    ``ReadTimeoutError`` (while streaming, or once the pooled session's retries
+    run out); those do not count.
+    """
+    if isinstance(error, requests.ConnectTimeout):
+        return True
+    if isinstance(error, requests.ConnectionError):
+        reason = error.args[0] if error.args else None
+        if isinstance(reason, MaxRetryError):
+            reason = reason.reason
+        return not isinstance(reason, ReadTimeoutError)
+    return False
+
+
+class Backend:
+    """One LM Studio endpoint and its routing state."""
+
+    def __init__(self, url):
+        self.url = url
+        self.outstanding = 0
+        self.healthy = True
+        self.served = 0
+        self.failures = 0
+        self.latency_s = None  # moving average of request time
+        self.last_error = None
+
+    def health_url(self):
+        return self.url.replace("/chat/completions", "/models")
+
+    def record(self, elapsed_s):
+        self.served += 1
+        self.latency_s = elapsed_s if self.latency_s is None else 0.8 * self.latency_s + 0.2 * elapsed_s
+
+
+class Scheduler:
+    """Least-outstanding-requests routing with priority queueing and admission control."""
+
+    def __init__(self, urls, max_inflight=2, queue_size=32, queue_timeout=20.0,
+                 batch_queue_timeout=600.0, health_interval=10.0):
+        self.backends = [Backend(url) for url in urls]
+        self.max_inflight = max(1, int(max_inflight))
+        self.queue_size = max(0, int(queue_size))
+        self.timeouts = {INTERACTIVE: queue_timeout, BATCH: batch_queue_timeout}
+        self.health_interval = health_interval
+        self.rejected = 0
+        self._cond = threading.Condition()
+        self._waiters = []
+        self._queued = {INTERACTIVE: 0, BATCH: 0}
+        self._seq = itertools.count()
+        self._health_thread = None
+
+    def _pick(self):
+        candidates = [b for b in self.backends if b.healthy and b.outstanding < self.max_inflight]
+        if not candidates:
+            return None
+        return min(candidates, key=lambda b: (b.outstanding, b.latency_s or 0.0))
+
+    def _acquire(self, priority, timeout):
+        timeout = self.timeouts[priority] if timeout is None else timeout
+        with self._cond:
+            if self._queued[priority] >= self.queue_size:
+                self.rejected += 1
+                raise SchedulerOverloaded(
+                    f"All local model backends are busy ({self._queued[priority]} {priority} requests queued); try again shortly."
+                )
+            if not any(b.healthy for b in self.backends):
+                self.rejected += 1
+                raise SchedulerOverloaded("No healthy LM Studio backend is reachable.")
+            entry = (_RANK[priority], next(self._seq))
+            heapq.heappush(self._waiters, entry)
+            self._queued[priority] += 1
+            deadline = time.monotonic() + timeout
+            try:
+                while True:
+                    if self._waiters[0] == entry:
+                        backend = self._pick()
+                        if backend is not None:
+                            heapq.heappop(self._waiters)
+                            backend.outstanding += 1
+                            return backend
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self.rejected += 1
+                        raise SchedulerOverloaded(
+                            f"Timed out after {timeout:.0f} s waiting for a free local model backend."
+                        )
+                    self._cond.wait(remaining)
+            finally:
+                self._queued[priority] -= 1
+                if entry in self._waiters:
+                    self._waiters.remove(entry)
+                    heapq.heapify(self._waiters)
+                # Wake the next waiter: the head may have changed or a slot is free
+                self._cond.notify_all()
+
+    def _release(self, backend, elapsed_s=None, error=None, unhealthy=False):
+        with self._cond:
+            backend.outstanding -= 1
+            if error is not None:
+                backend.failures += 1
+                backend.last_error = str(error)
+                backend.healthy = backend.healthy and not unhealthy
+            elif elapsed_s is not None:
+                backend.record(elapsed_s)
+            self._cond.notify_all()
+
+    @contextmanager
+    def slot(self, priority=INTERACTIVE, timeout=None, stats=None):
+        """Hold a request slot and yield the chat-completions URL to send it to.
+
+        `stats`, if given, receives ``queue_s`` and ``backend_url``. Failures to
+        connect mark the backend unhealthy until the next health check; a slow
+        generation that hits its read timeout does not.
+        """
+        start = time.perf_counter()
+        backend = self._acquire(priority, timeout)
+        if stats is not None:
+            stats.update(queue_s=time.perf_counter() - start, backend_url=backend.url)
+        start = time.perf_counter()
+        try:
+            yield backend.url
+        except requests.RequestException as e:
+            self._release(backend, error=e, unhealthy=is_connect_failure(e))
+            raise
+        except BaseException:
+            self._release(backend)
+            raise
+        else:
+            self._release(backend, time.perf_counter() - start)
+
+    def check_health(self):
+        """Probe every backend's ``/models`` endpoint and update its health flag."""
+        for backend in self.backends:
+            try:
+                healthy = request("lmstudio", "GET", backend.health_url(), timeout=(2, 5)).status_code < 500
+                error = None
+            except requests.RequestException as e:
+                healthy, error = False, e
+            with self._cond:
+                backend.healthy = healthy
+                if error is not None:
+                    backend.last_error = str(error)
+                self._cond.notify_all()
+
+    def start_health_checks(self):
+        if self._health_thread is None and self.health_interval > 0:
+            def _loop():
+                while True:
+                    time.sleep(self.health_interval)
+                    self.check_health()
+
+            self._health_thread = threading.Thread(target=_loop, name="lmstudio-health", daemon=True)
+            self._health_thread.start()
+        return self
+
+    def stats(self):
+        with self._cond:
+            return {
+                "queued": dict(self._queued),
+                "rejected": self.rejected,
+                "backends": [
+                    {
+                        "url": b.url,
+                        "healthy": b.healthy,
+                        "outstanding": b.outstanding,
+                        "served": b.served,
+                        "failures": b.failures,
+                        "latency_s": b.latency_s,
+                    }
+                    for b in self.backends
+                ],
+            }
+
+
+_default_scheduler = None
+_default_lock = threading.Lock()
+
+
+def get_scheduler():
+    """Return the process-wide scheduler for LMSTUDIO_URLS, starting its health checks."""
+    global _default_scheduler
+    with _default_lock:
+        if _default_scheduler is None:
+            cfg = backend_config()
+            _default_scheduler = Scheduler(cfg["lmstudio"]["urls"], **cfg["scheduler"]).start_health_checks()
+        return _default_scheduler
+
+
+def current_scheduler():
+    """The scheduler if some page has already used it in this process, else None."""
+    return _default_scheduler
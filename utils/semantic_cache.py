@@ -0,0 +1,263 @@
+"""Embedding-based semantic answer cache for the general dashboard."""
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+
+import numpy as np
+
+from utils.clients import post_json
+from utils.config import backend_config
+
+CACHE_DIR = os.getenv("SEMANTIC_CACHE_DIR", os.path.join(".cache", "semantic_cache"))
+DEFAULT_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.92"))
+MAX_ENTRIES = int(os.getenv("SEMANTIC_CACHE_MAX_ENTRIES", "5000"))
+# After an embedding failure, skip the cache for this long instead of retrying every turn
+UNAVAILABLE_COOLDOWN_S = 60.0
+# Puts are written to disk in the background, at most this often
+SAVE_INTERVAL_S = float(os.getenv("SEMANTIC_CACHE_SAVE_INTERVAL_S", "5"))
+# Questions that lean on an earlier turn: a leading connective ("and her allergies?"),
+# an explicit reference back, or a short question built on a pronoun ("is it safe?").
+# Longer pronoun questions ("Is it safe to take ibuprofen with warfarin?") stand alone.
+_FOLLOW_UP_RE = re.compile(
+    r"^\s*(and|but|also|so|then|what about|how about|what else)\b"
+    r"|\b(you (just )?(said|mentioned)|(mentioned|said) (above|earlier|before)|the (above|previous|last) (answer|one|question|result))\b",
+    re.IGNORECASE,
+)
+_PRONOUN_RE = re.compile(r"\b(he|she|him|his|her|hers|they|them|their|it|its|this|that|these|those)\b", re.IGNORECASE)
+_SHORT_FOLLOW_UP_WORDS = 5
+
+
+def embed_texts(texts):
+    """Embed `texts` with the local embedding endpoint; rows are L2-normalised float32."""
+    cfg = backend_config()["embedding"]
+    r = post_json("lmstudio", cfg["url"], {"model": cfg["model"], "input": list(texts)})
+    r.raise_for_status()
+    data = sorted(r.json()["data"], key=lambda d: d.get("index", 0))
+    vectors = np.asarray([d["embedding"] for d in data], dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def scope_key(backend, file_context=None, entities=()):
+    """Entries only match within the same backend, uploaded-file context and mentioned IDs.
+
+    `entities` are the patient/entity IDs resolved from the question, so two
+    questions that differ only in the patient they name never share an answer.
+    """
+    file_hash = hashlib.sha256(file_context.encode("utf-8")).hexdigest()[:16] if file_context else "-"
+    entity_part = ",".join(sorted(set(entities))) or "-"
+    return f"{backend}:{file_hash}:{entity_part}"
+
+
+def is_follow_up(question):
+    """Whether `question` reads as a follow-up whose meaning depends on earlier turns."""
+    if _FOLLOW_UP_RE.search(question):
+        return True
+    return len(question.split()) <= _SHORT_FOLLOW_UP_WORDS and bool(_PRONOUN_RE.search(question))
+
+
+class SemanticCache:
+    """Question-embedding matrix plus answers, searched with one matrix-vector product.
+
+    The matrix is preallocated and grows by doubling up to `max_entries`, so a
+    new answer is a row write; eviction is least-recently-used once full.
+    It is persisted as ``embeddings.npy`` next to an ``entries.json`` sidecar
+    by a background writer, at most every `save_interval` seconds.
+    """
+
+    def __init__(self, cache_dir=CACHE_DIR, max_entries=MAX_ENTRIES, embed_fn=embed_texts, save_interval=SAVE_INTERVAL_S):
+        self.cache_dir = cache_dir
+        self.max_entries = max_entries
+        self.embed_fn = embed_fn
+        self.save_interval = save_interval
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.saved_s = 0.0
+        self.matrix = None
+        self.entries = []
+        # Per-row scope code and last access, parallel to `entries`, for vectorised masks
+        self._scopes = np.zeros(0, dtype=np.int32)
+        self._last_access = np.zeros(0, dtype=np.float64)
+        self._scope_codes = {}
+        self._dirty = threading.Event()
+        self._writer = None
+        self._unavailable_until = 0.0
+        self._load()
+
+    @property
+    def _matrix_path(self):
+        return os.path.join(self.cache_dir, "embeddings.npy")
+
+    @property
+    def _entries_path(self):
+        return os.path.join(self.cache_dir, "entries.json")
+
+    def _scope_code(self, scope):
+        return self._scope_codes.setdefault(scope, len(self._scope_codes))
+
+    def _reserve(self, rows, dim):
+        """Make room for `rows` rows, doubling the preallocated arrays as needed."""
+        capacity = 0 if self.matrix is None else len(self.matrix)
+        if rows <= capacity:
+            return
+        capacity = min(max(rows, 2 * capacity, 64), max(rows, self.max_entries))
+        matrix = np.zeros((capacity, dim), dtype=np.float32)
+        scopes = np.zeros(capacity, dtype=np.int32)
+        last_access = np.zeros(capacity, dtype=np.float64)
+        n = len(self.entries)
+        if self.matrix is not None:
+            matrix[:n] = self.matrix[:n]
+            scopes[:n] = self._scopes[:n]
+            last_access[:n] = self._last_access[:n]
+        self.matrix, self._scopes, self._last_access = matrix, scopes, last_access
+
+    def _load(self):
+        try:
+            matrix = np.load(self._matrix_path)
+            with open(self._entries_path, "r", encoding="utf-8") as f:
+                entries = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return
+        if len(entries) != len(matrix) or not len(entries):
+            return
+        self._reserve(len(entries), matrix.shape[1])
+        self.matrix[:len(entries)] = matrix
+        for i, entry in enumerate(entries):
+            self._scopes[i] = self._scope_code(entry["scope"])
+            self._last_access[i] = entry.get("last_access", 0.0)
+        self.entries = entries
+
+    def _save(self):
+        with self._lock:
+            n = len(self.entries)
+            matrix = self.matrix[:n].copy() if n else None
+            entries = json.dumps(self.entries)
+        os.makedirs(self.cache_dir, exist_ok=True)
+        if matrix is None:
+            return
+        # np.save appends ".npy" to names without it, so keep the suffix on the temp file
+        tmp_matrix = self._matrix_path + ".tmp.npy"
+        np.save(tmp_matrix, matrix)
+        os.replace(tmp_matrix, self._matrix_path)
+        tmp_entries = self._entries_path + ".tmp"
+        with open(tmp_entries, "w", encoding="utf-8") as f:
+            f.write(entries)
+        os.replace(tmp_entries, self._entries_path)
+
+    def _schedule_save(self):
+        # Called with the lock held; the writer coalesces bursts of puts into one write
+        self._dirty.set()
+        if self._writer is None:
+            def _loop():
+                while True:
+                    self._dirty.wait()
+                    time.sleep(self.save_interval)
+                    self._dirty.clear()
+                    try:
+                        self._save()
+                    except OSError:
+                        pass
+
+            self._writer = threading.Thread(target=_loop, name="semantic-cache-writer", daemon=True)
+            self._writer.start()
+
+    def flush(self):
+        """Write pending changes now (e.g. before exit); normally the background writer does this."""
+        self._dirty.clear()
+        self._save()
+
+    def _embed(self, text):
+        if time.time() < self._unavailable_until:
+            raise RuntimeError("embedding endpoint unavailable")
+        try:
+            return self.embed_fn([text])[0]
+        except Exception:
+            self._unavailable_until = time.time() + UNAVAILABLE_COOLDOWN_S
+            raise
+
+    def lookup(self, question, scope, threshold=DEFAULT_THRESHOLD):
+        """Return ``(entry or None, similarity, embedding)`` for `question` within `scope`.
+
+        The embedding is returned so a following `put` does not embed again.
+        """
+        start = time.perf_counter()
+        embedding = self._embed(question)
+        with self._lock:
+            best, best_sim = None, 0.0
+            n = len(self.entries)
+            code = self._scope_codes.get(scope)
+            if n and code is not None:
+                candidates = np.flatnonzero(self._scopes[:n] == code)
+                if len(candidates):
+                    sims = self.matrix[candidates] @ embedding
+                    i = int(np.argmax(sims))
+                    best_sim = float(sims[i])
+                    if best_sim >= threshold:
+                        best = candidates[i]
+            if best is None:
+                self.misses += 1
+                return None, best_sim, embedding
+            self.hits += 1
+            entry = self.entries[best]
+            entry["last_access"] = self._last_access[best] = time.time()
+            entry["hits"] = entry.get("hits", 0) + 1
+            self.saved_s += max(0.0, entry.get("latency_s", 0.0) - (time.perf_counter() - start))
+            return dict(entry), best_sim, embedding
+
+    def put(self, question, answer, scope, latency_s=0.0, embedding=None):
+        if embedding is None:
+            embedding = self._embed(question)
+        now = time.time()
+        entry = {"question": question, "answer": answer, "scope": scope, "latency_s": latency_s, "created": now, "last_access": now, "hits": 0}
+        row = np.asarray(embedding, dtype=np.float32)
+        with self._lock:
+            n = len(self.entries)
+            if n >= self.max_entries:
+                i = int(np.argmin(self._last_access[:n]))
+                self.entries[i] = entry
+            else:
+                self._reserve(n + 1, row.shape[0])
+                i = n
+                self.entries.append(entry)
+            self.matrix[i] = row
+            self._scopes[i] = self._scope_code(scope)
+            self._last_access[i] = now
+            self._schedule_save()
+
+    def clear(self):
+        with self._lock:
+            self.matrix, self.entries = None, []
+            self._scopes = np.zeros(0, dtype=np.int32)
+            self._last_access = np.zeros(0, dtype=np.float64)
+            self._scope_codes = {}
+            self._dirty.clear()
+            for path in (self._matrix_path, self._entries_path):
+                if os.path.exists(path):
+                    os.remove(path)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "entries": len(self.entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "saved_s": self.saved_s,
+        }
+
+
+_default_cache = None
+_default_lock = threading.Lock()
+
+
+def get_semantic_cache():
+    """Return the process-wide semantic cache, loading it from disk on first use."""
+    global _default_cache
+    with _default_lock:
+        if _default_cache is None:
+            _default_cache = SemanticCache()
+        return _default_cache
@@ -0,0 +1,192 @@
+"""Per-request telemetry: stage timings, token counts and payload sizes as JSONL events."""
+import json
+import logging
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import Counter, defaultdict, deque
+from contextlib import contextmanager
+from logging.handlers import RotatingFileHandler
+
+TELEMETRY_LOG_PATH = os.getenv("TELEMETRY_LOG_PATH", os.path.join("logs", "telemetry.jsonl"))
+TELEMETRY_MAX_BYTES = int(os.getenv("TELEMETRY_MAX_BYTES", str(5 * 1024 * 1024)))
+TELEMETRY_BACKUPS = int(os.getenv("TELEMETRY_BACKUPS", "3"))
+ROLLING_WINDOW = int(os.getenv("TELEMETRY_ROLLING_WINDOW", "200"))
+
+_logger = None
+_logger_lock = threading.Lock()
+_recent = defaultdict(lambda: deque(maxlen=ROLLING_WINDOW))
+_recent_lock = threading.Lock()
+
+
+def _get_logger():
+    global _logger
+    with _logger_lock:
+        if _logger is None:
+            logger = logging.getLogger("medassist.telemetry")
+            logger.setLevel(logging.INFO)
+            logger.propagate = False
+            if TELEMETRY_LOG_PATH:
+                if os.path.dirname(TELEMETRY_LOG_PATH):
+                    os.makedirs(os.path.dirname(TELEMETRY_LOG_PATH), exist_ok=True)
+                handler = RotatingFileHandler(
+                    TELEMETRY_LOG_PATH, maxBytes=TELEMETRY_MAX_BYTES, backupCount=TELEMETRY_BACKUPS, encoding="utf-8"
+                )
+                handler.setFormatter(logging.Formatter("%(message)s"))
+                logger.addHandler(handler)
+            _logger = logger
+        return _logger
+
+
+def record_event(event):
+    """Append one event to the JSONL log and to the in-memory rolling window."""
+    event.setdefault("ts", time.time())
+    try:
+        _get_logger().info(json.dumps(event, ensure_ascii=False, default=str))
+    except OSError:
+        pass
+    with _recent_lock:
+        _recent[event.get("backend", "unknown")].append(event)
+
+
+class Turn:
+    """Collects the stages of one request; `finish()` records it as an event."""
+
+    def __init__(self, page, backend, model=None, **fields):
+        self.start = time.perf_counter()
+        self.event = {"id": uuid.uuid4().hex[:12], "page": page, "backend": backend, "model": model, "stages_ms": {}}
+        self.event.update(fields)
+        self._finished = False
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_stage(name, time.perf_counter() - start)
+
+    def add_stage(self, name, seconds):
+        if seconds is not None:
+            self.event["stages_ms"][name] = round(self.event["stages_ms"].get(name, 0.0) + seconds * 1000, 3)
+
+    def set(self, **fields):
+        self.event.update(fields)
+
+    def finish(self, error=None):
+        if self._finished:
+            return self.event
+        self._finished = True
+        self.event["total_ms"] = round((time.perf_counter() - self.start) * 1000, 3)
+        if error is not None:
+            self.event["error"] = str(error)
+        record_event(self.event)
+        return self.event
+
+
+def timed_stream(chunks, turn):
+    """Pass a token stream through, recording ``ttft`` and ``generation`` stages on `turn`."""
+    start = time.perf_counter()
+    first = None
+    count = 0
+    for chunk in chunks:
+        if first is None:
+            first = time.perf_counter()
+            turn.add_stage("ttft", first - start)
+        count += 1
+        yield chunk
+    turn.add_stage("generation", time.perf_counter() - (first or start))
+    turn.set(stream_chunks=count)
+
+
+def _percentile(values, pct):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(pct / 100.0 * len(ordered)))]
+
+
+def rolling_stats():
+    """p50/p95 of total latency and TTFT per backend over the rolling window."""
+    with _recent_lock:
+        snapshot = {backend: list(events) for backend, events in _recent.items()}
+    stats = {}
+    for backend, events in snapshot.items():
+        totals = [e["total_ms"] for e in events if "total_ms" in e and "error" not in e]
+        ttfts = [e["stages_ms"]["ttft"] for e in events if "ttft" in e.get("stages_ms", {})]
+        hits = sum(1 for e in events if e.get("cache_hit"))
+        stats[backend] = {
+            "requests": len(events),
+            "errors": sum(1 for e in events if "error" in e),
+            "p50_ms": _percentile(totals, 50),
+            "p95_ms": _percentile(totals, 95),
+            "ttft_p50_ms": _percentile(ttfts, 50),
+            "ttft_p95_ms": _percentile(ttfts, 95),
+            "cache_hits": hits,
+        }
+    return stats
+
+
+class SamplingProfiler:
+    """Low-overhead sampling profiler for one thread (e.g. the Streamlit script run).
+
+    A daemon thread samples the target thread's stack every `interval`
+    seconds until `stop()` or the target thread exits; `top()` reports
+    functions by inclusive and self sample counts.
+    """
+
+    def __init__(self, thread_id=None, interval=0.005, max_depth=40):
+        self.thread_id = thread_id or threading.get_ident()
+        self.interval = interval
+        self.max_depth = max_depth
+        self.samples = 0
+        self.inclusive = Counter()
+        self.self_counts = Counter()
+        self._stop = threading.Event()
+        self._thread = None
+        self.started = None
+        self.elapsed = 0.0
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                return  # the profiled thread has exited
+            self.samples += 1
+            seen = set()
+            depth = 0
+            top = True
+            while frame is not None and depth < self.max_depth:
+                code = frame.f_code
+                key = f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+                if top:
+                    self.self_counts[key] += 1
+                    top = False
+                if key not in seen:
+                    self.inclusive[key] += 1
+                    seen.add(key)
+                frame = frame.f_back
+                depth += 1
+
+    def start(self):
+        self.started = time.perf_counter()
+        self._thread = threading.Thread(target=self._sample, name="sampling-profiler", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.elapsed = time.perf_counter() - self.started if self.started else 0.0
+        return self
+
+    def top(self, n=15):
+        """Rows of (function, inclusive %, self %) sorted by inclusive samples."""
+        total = self.samples or 1
+        return [
+            (key, 100.0 * count / total, 100.0 * self.self_counts.get(key, 0) / total)
+            for key, count in self.inclusive.most_common(n)
+        ]
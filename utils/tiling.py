@@ -0,0 +1,304 @@
+"""Tiled access to very large images (whole-slide pathology, high-res radiographs).
+
+Images are read region by region instead of being decoded into one PIL
+image per analysis:
+
+* whole-slide formats (``.svs``, ``.ndpi``, pyramidal TIFF, ...) go through
+  ``openslide`` when it is installed, which reads only the tiles it needs;
+* uncompressed TIFFs are memory-mapped with ``tifffile`` when installed;
+* everything else is decoded once into an on-disk ``.npy`` file that later
+  reads memory-map.
+
+Peak memory while tiles are analysed is therefore a few tiles, not the
+whole image. Only the one-off conversion of a file that neither openslide
+nor tifffile can read lazily (JPEG, PNG, compressed TIFF) holds the decoded
+image in memory, so such files are refused above `MAX_DECODE_PIXELS`; the
+conversion is cached on disk per file.
+"""
+import hashlib
+import mmap
+import os
+import string
+import struct
+from contextlib import contextmanager
+
+import numpy as np
+from PIL import Image, ImageDraw, UnidentifiedImageError
+
+TILE_CACHE_DIR = os.getenv("VLM_TILE_CACHE_DIR", os.path.join(".cache", "tiles"))
+TILE_CACHE_MAX_FILES = int(os.getenv("VLM_TILE_CACHE_MAX_FILES", "8"))
+DEFAULT_TILE_SIZE = int(os.getenv("VLM_TILE_SIZE", "1024"))
+DEFAULT_MIN_TISSUE = float(os.getenv("VLM_TILE_MIN_TISSUE", "0.2"))
+DEFAULT_MAX_TILES = int(os.getenv("VLM_TILE_MAX_TILES", "32"))
+OVERVIEW_MAX_SIDE = 2048
+# Result label for the optional whole-image pass alongside the tiles
+OVERVIEW_LABEL = "Overview"
+WSI_EXTENSIONS = (".svs", ".ndpi", ".mrxs", ".scn", ".vms", ".vmu", ".bif", ".tif", ".tiff")
+# Rows decoded per step when converting to the on-disk array
+_BAND_ROWS = 512
+# Bytes of the map touched between page drops while building the overview
+_MAPPED_BYTES = 32 << 20
+
+# Largest image decoded whole into memory for conversion (about 3 bytes per pixel at peak).
+# It replaces PIL's decompression-bomb guard for these files only; the process-wide
+# Image.MAX_IMAGE_PIXELS is never changed, so other Image.open calls keep their guard.
+MAX_DECODE_PIXELS = int(os.getenv("VLM_TILE_MAX_DECODE_PIXELS", str(300 * 10**6)))
+
+
+class ImageTooLarge(ValueError):
+    """The image would have to be decoded whole and is over `MAX_DECODE_PIXELS`."""
+
+
+def _identify(f, path):
+    # What Image.open does to pick a format plugin, minus its size check, which reads the shared limit
+    Image.init()
+    prefix = f.read(16)
+    for fmt in Image.ID:
+        factory, accept = Image.OPEN[fmt]
+        if accept and accept(prefix) is not True:
+            continue
+        try:
+            f.seek(0)
+            return factory(f, path)
+        except (SyntaxError, IndexError, TypeError, struct.error):
+            continue
+    raise UnidentifiedImageError(f"cannot identify image file {path!r}")
+
+
+@contextmanager
+def _open_large(path):
+    """Open `path` lazily, refusing it above `MAX_DECODE_PIXELS` instead of PIL's default guard."""
+    with open(path, "rb") as f, _identify(f, path) as image:
+        width, height = image.size
+        if width * height > MAX_DECODE_PIXELS:
+            raise ImageTooLarge(
+                f"{os.path.basename(path)} is {width}x{height} px ({width * height / 1e6:.0f} MP); "
+                f"{image.format or 'this format'} cannot be read tile by tile, and decoding it whole is limited to "
+                f"{MAX_DECODE_PIXELS / 1e6:.0f} MP (VLM_TILE_MAX_DECODE_PIXELS). Convert it to an "
+                f"uncompressed or pyramidal TIFF, or a whole-slide format openslide can read."
+            )
+        yield image
+
+
+def file_key(path):
+    """Cache key for a file on disk from its path, size and mtime (no full read)."""
+    st = os.stat(path)
+    return hashlib.sha256(f"{os.path.abspath(path)}:{st.st_size}:{st.st_mtime_ns}".encode("utf-8")).hexdigest()
+
+
+class ArrayRegions:
+    """Regions of an ``(H, W, 3)`` uint8 array, typically a memory map."""
+
+    def __init__(self, array):
+        self.array = array
+        self.size = (array.shape[1], array.shape[0])
+
+    def _drop_pages(self):
+        # The map is read-only, so after each copy the pages can leave this process's
+        # RSS; they stay in the OS page cache for the next read
+        mm = getattr(self.array, "_mmap", None)
+        if mm is not None and hasattr(mmap, "MADV_DONTNEED"):
+            mm.madvise(mmap.MADV_DONTNEED)
+
+    def read(self, box):
+        x0, y0, x1, y1 = box
+        region = np.ascontiguousarray(self.array[y0:y1, x0:x1, :3])
+        self._drop_pages()
+        return region
+
+    def overview(self, max_side=OVERVIEW_MAX_SIDE):
+        # Every `step`-th pixel, copied a band of rows at a time so only one band is mapped
+        step = max(1, -(-max(self.size) // max_side))
+        row_bytes = self.array.strides[0]
+        band = max(1, _MAPPED_BYTES // (row_bytes * step)) * step
+        parts = []
+        for y in range(0, self.size[1], band):
+            parts.append(np.ascontiguousarray(self.array[y:y + band:step, ::step, :3]))
+            self._drop_pages()
+        return np.concatenate(parts), step
+
+    def close(self):
+        self.array = None
+
+
+class SlideRegions:
+    """Regions of a whole-slide image through openslide (level 0 reads, pyramid thumbnails)."""
+
+    def __init__(self, slide):
+        self.slide = slide
+        self.size = slide.dimensions
+
+    def read(self, box):
+        x0, y0, x1, y1 = box
+        return np.asarray(self.slide.read_region((x0, y0), 0, (x1 - x0, y1 - y0)).convert("RGB"))
+
+    def overview(self, max_side=OVERVIEW_MAX_SIDE):
+        step = max(1, -(-max(self.size) // max_side))
+        thumb = self.slide.get_thumbnail((self.size[0] // step, self.size[1] // step)).convert("RGB")
+        return np.asarray(thumb), self.size[0] / thumb.size[0]
+
+    def close(self):
+        self.slide.close()
+
+
+def _prune_cache(cache_dir, keep=TILE_CACHE_MAX_FILES):
+    files = sorted(
+        (os.path.join(cache_dir, n) for n in os.listdir(cache_dir) if n.endswith(".npy")),
+        key=os.path.getmtime,
+    )
+    for path in files[:-keep] if keep > 0 else files:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def _band_rgb(band):
+    if band.mode.startswith("I"):
+        # 16/32-bit greyscale (radiographs): keep the top 8 bits of the stored range
+        grey = np.asarray(band, dtype=np.uint32)
+        shift = max(0, int(grey.max()).bit_length() - 8) if grey.size else 0
+        return np.repeat((grey >> shift).astype(np.uint8)[:, :, None], 3, axis=2)
+    return np.asarray(band.convert("RGB"))
+
+
+def _decode_to_npy(path, npy_path):
+    """Decode `path` into an ``(H, W, 3)`` uint8 ``.npy`` file, converting one band at a time.
+
+    Raises `ImageTooLarge` before decoding anything if the image is over `MAX_DECODE_PIXELS`.
+    """
+    tmp_path = npy_path + ".tmp"
+    with _open_large(path) as image, open(tmp_path, "wb") as f:
+        width, height = image.size
+        np.lib.format.write_array_header_1_0(f, {"descr": "|u1", "fortran_order": False, "shape": (height, width, 3)})
+        # crop() applies PIL's guard to the band, so very wide images get shorter bands
+        rows = max(1, min(_BAND_ROWS, (Image.MAX_IMAGE_PIXELS or width * _BAND_ROWS) // width))
+        for y in range(0, height, rows):
+            f.write(_band_rgb(image.crop((0, y, width, min(height, y + rows)))).tobytes())
+    os.replace(tmp_path, npy_path)
+
+
+def open_regions(path, key=None, cache_dir=TILE_CACHE_DIR):
+    """Open the image at `path` for region reads; returns an object with ``size``, ``read``, ``overview``.
+
+    Raises `ImageTooLarge` for an image that can only be decoded whole and is over `MAX_DECODE_PIXELS`.
+    """
+    ext = os.path.splitext(path)[1].lower()
+    if ext in WSI_EXTENSIONS:
+        try:
+            import openslide
+
+            return SlideRegions(openslide.OpenSlide(path))
+        except Exception:
+            pass  # not installed, or not a slide openslide recognises
+    if ext in (".tif", ".tiff"):
+        try:
+            import tifffile
+
+            array = tifffile.memmap(path)
+            if array.ndim == 3 and array.dtype == np.uint8 and array.shape[2] >= 3:
+                return ArrayRegions(array)
+        except Exception:
+            pass  # not installed, compressed, or an unsupported layout
+    os.makedirs(cache_dir, exist_ok=True)
+    npy_path = os.path.join(cache_dir, f"{key or file_key(path)}.npy")
+    if not os.path.exists(npy_path):
+        _decode_to_npy(path, npy_path)
+        _prune_cache(cache_dir)
+    else:
+        os.utime(npy_path)
+    return ArrayRegions(np.load(npy_path, mmap_mode="r"))
+
+
+def tissue_mask(rgb):
+    """Boolean foreground mask: stained tissue or mid-grey anatomy, not blank background.
+
+    A pixel counts when it is noticeably coloured (H&E stains) or its grey
+    level sits between near-black and near-white (radiographs), which rules
+    out both glass/white slide background and black film background.
+    """
+    rgb = rgb.astype(np.int16)
+    spread = rgb.max(axis=2) - rgb.min(axis=2)
+    grey = rgb.mean(axis=2)
+    return (spread > 18) | ((grey > 25) & (grey < 215))
+
+
+def row_label(index):
+    letters = ""
+    index += 1
+    while index:
+        index, rem = divmod(index - 1, 26)
+        letters = string.ascii_uppercase[rem] + letters
+    return letters
+
+
+def plan_tiles(regions, tile_size=DEFAULT_TILE_SIZE, min_tissue=DEFAULT_MIN_TISSUE, max_tiles=DEFAULT_MAX_TILES):
+    """Grid the image into tiles and keep the most informative ones.
+
+    Returns ``(tiles, overview, info)``: tiles are dicts with a grid ``label``
+    (row letter + column number, e.g. ``B3``), a level-0 ``box`` and the
+    ``tissue`` fraction, ordered by position. Tissue fractions come from the
+    overview, so the full-resolution image is never scanned.
+    """
+    width, height = regions.size
+    overview, scale = regions.overview()
+    mask = tissue_mask(overview)
+    cols, rows = -(-width // tile_size), -(-height // tile_size)
+    # Mean of the mask over each tile's footprint in overview pixels
+    ys = np.minimum((np.arange(rows + 1) * tile_size / scale).round().astype(int), mask.shape[0])
+    xs = np.minimum((np.arange(cols + 1) * tile_size / scale).round().astype(int), mask.shape[1])
+    sums = np.pad(mask.cumsum(0).cumsum(1), ((1, 0), (1, 0)))
+    area = np.maximum(np.outer(np.diff(ys), np.diff(xs)), 1)
+    tissue = (sums[ys[1:]][:, xs[1:]] - sums[ys[:-1]][:, xs[1:]] - sums[ys[1:]][:, xs[:-1]] + sums[ys[:-1]][:, xs[:-1]]) / area
+
+    candidates = np.argwhere(tissue >= min_tissue)
+    order = np.argsort(-tissue[candidates[:, 0], candidates[:, 1]], kind="stable")[:max_tiles]
+    tiles = []
+    for r, c in sorted(map(tuple, candidates[order])):
+        box = (c * tile_size, r * tile_size, min(width, (c + 1) * tile_size), min(height, (r + 1) * tile_size))
+        tiles.append({"label": f"{row_label(r)}{c + 1}", "box": box, "tissue": float(tissue[r, c])})
+    info = {
+        "size": (width, height),
+        "grid": (rows, cols),
+        "tiles_total": rows * cols,
+        "tiles_with_tissue": len(candidates),
+        "tiles_selected": len(tiles),
+    }
+    return tiles, overview, info
+
+
+def draw_tile_grid(overview, tiles, scale):
+    """Overview image with the selected tiles outlined and labelled."""
+    image = Image.fromarray(overview).convert("RGB")
+    draw = ImageDraw.Draw(image)
+    for tile in tiles:
+        x0, y0, x1, y1 = (int(v / scale) for v in tile["box"])
+        draw.rectangle((x0, y0, x1 - 1, y1 - 1), outline=(0, 200, 0), width=2)
+        draw.text((x0 + 4, y0 + 4), tile["label"], fill=(0, 120, 0))
+    return image
+
+
+def describe_tile(tile):
+    x0, y0, x1, y1 = tile["box"]
+    return f"{tile['label']} (x {x0}-{x1}, y {y0}-{y1}, {tile['tissue']:.0%} tissue)"
+
+
+def merge_tile_findings(tiles, results, info):
+    """One report with a section per region in reading order; `results` maps tile label to a `run_batch` result."""
+    width, height = info["size"]
+    lines = [
+        f"**Tiled analysis** of a {width}x{height} image: {info['tiles_selected']} of "
+        f"{info['tiles_total']} tiles analysed ({info['tiles_with_tissue']} contained tissue).",
+        "",
+    ]
+    overview = results.get(OVERVIEW_LABEL)
+    if overview is not None:
+        lines.append("#### Whole image (downscaled)")
+        lines.append(overview["report"] if overview["report"] else f"_Analysis failed: {overview['error']}_")
+        lines.append("")
+    for tile in tiles:
+        result = results.get(tile["label"]) or {"report": None, "error": "not analysed"}
+        lines.append(f"#### Region {describe_tile(tile)}")
+        lines.append(result["report"] if result["report"] else f"_Analysis failed: {result['error']}_")
+        lines.append("")
+    return "\n".join(lines)
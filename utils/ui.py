@@ -0,0 +1,133 @@
+"""Streamlit widgets shared by the pages."""
+import os
+import time
+
+import streamlit as st
+
+from utils.scheduler import current_scheduler
+from utils.telemetry import SamplingProfiler, rolling_stats
+
+PROFILE_KEY = "_profile_script_run"
+# Changes below the top folder are picked up within this many seconds
+FOLDER_LISTING_TTL_S = 30
+# Minimum seconds between redraws of a streaming answer
+UI_REFRESH_S = 0.05
+
+# Fake button using HTML <a> tag styled as Streamlit button
+_FILE_BUTTON_HTML = """
+<a href="file://{path}" target="_blank">
+    <button style="width: 100%; padding: 6px; border-radius: 6px; border: none; background-color: #f63366; color: white; cursor: pointer;">
+        📄 {name}
+    </button>
+</a>
+"""
+
+
+def render_stream(chunks, area):
+    """Show a token stream in `area`, redrawing at most every UI_REFRESH_S seconds; returns the full text."""
+    parts = []
+    last_render = 0.0
+    for chunk in chunks:
+        parts.append(chunk)
+        now = time.perf_counter()
+        if now - last_render >= UI_REFRESH_S:
+            area.markdown("".join(parts))
+            last_render = now
+    text = "".join(parts)
+    area.markdown(text)
+    return text
+
+
+@st.cache_data(ttl=FOLDER_LISTING_TTL_S, show_spinner=False)
+def folder_tree(path, mtime_ns):
+    """Subfolders of `path` and the prebuilt button HTML for its CSV files.
+
+    Keyed on the folder's mtime, so adding or removing a file shows up on the
+    next rerun instead of re-walking the tree every time.
+    """
+    folders, buttons = [], []
+    for item in sorted(os.listdir(path)):
+        item_path = os.path.join(path, item)
+        if os.path.isdir(item_path):
+            folders.append((item, folder_tree(item_path, os.stat(item_path).st_mtime_ns)))
+        elif item.lower().endswith(".csv"):
+            buttons.append(_FILE_BUTTON_HTML.format(path=os.path.abspath(item_path), name=item))
+    return folders, "".join(buttons)
+
+
+def _render_tree(folders, buttons):
+    for name, (sub_folders, sub_buttons) in folders:
+        with st.expander("📂 " + name, expanded=False):
+            _render_tree(sub_folders, sub_buttons)
+    if buttons:
+        st.markdown(buttons, unsafe_allow_html=True)
+
+
+def render_folder(path):
+    """Render the CSVs under `path` as link buttons in the sidebar, one block per folder."""
+    with st.sidebar:
+        _render_tree(*folder_tree(path, os.stat(path).st_mtime_ns))
+
+
+def start_profiler():
+    """Start sampling this script run if the sidebar toggle was switched on."""
+    if st.session_state.get(PROFILE_KEY):
+        return SamplingProfiler().start()
+    return None
+
+
+def _fmt_ms(value):
+    return "–" if value is None else f"{value:,.0f}"
+
+
+def render_metrics_panel(profiler=None):
+    """Sidebar panel with rolling p50/p95 per backend and the optional profile of this run.
+
+    The profiler is stopped before anything is drawn, so it stops even when
+    drawing fails (e.g. the run is being interrupted by a rerun).
+    """
+    if profiler is not None:
+        profiler.stop()
+    with st.sidebar.expander("📈 Metrics", expanded=False):
+        stats = rolling_stats()
+        if stats:
+            st.table([
+                {
+                    "backend": backend,
+                    "requests": s["requests"],
+                    "errors": s["errors"],
+                    "p50 ms": _fmt_ms(s["p50_ms"]),
+                    "p95 ms": _fmt_ms(s["p95_ms"]),
+                    "TTFT p50 ms": _fmt_ms(s["ttft_p50_ms"]),
+                    "TTFT p95 ms": _fmt_ms(s["ttft_p95_ms"]),
+                    "cache hits": s["cache_hits"],
+                }
+                for backend, s in sorted(stats.items())
+            ])
+        else:
+            st.caption("No requests recorded yet.")
+        scheduler = current_scheduler()
+        if scheduler is not None:
+            sched = scheduler.stats()
+            st.caption(
+                f"LM Studio scheduler: {sched['queued']['interactive']} interactive / "
+                f"{sched['queued']['batch']} batch queued, {sched['rejected']} rejected"
+            )
+            st.table([
+                {
+                    "backend": b["url"],
+                    "healthy": "✅" if b["healthy"] else "❌",
+                    "in flight": b["outstanding"],
+                    "served": b["served"],
+                    "failures": b["failures"],
+                    "avg ms": _fmt_ms(None if b["latency_s"] is None else b["latency_s"] * 1000),
+                }
+                for b in sched["backends"]
+            ])
+        st.checkbox("Profile script runs (sampling)", key=PROFILE_KEY)
+        if profiler is not None:
+            st.caption(f"Script run: {profiler.elapsed * 1000:.0f} ms, {profiler.samples} samples")
+            st.table([
+                {"function": name, "inclusive %": f"{incl:.1f}", "self %": f"{own:.1f}"}
+                for name, incl, own in profiler.top()
+            ])
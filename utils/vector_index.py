@@ -0,0 +1,469 @@
+"""Embedded dense-vector index over LightRAG's entities, relations and chunks.
+
+Lets the retrieval page answer without ``lightrag-server``: entity and
+relation descriptions come from the GraphML graph, chunks from LightRAG's
+text-chunk store (or the full documents when that store is absent), and
+everything is embedded with the local embedding endpoint.
+
+Each kind lives in its own collection: a raw row-major float32 matrix
+(``vectors.f32``) that is memory-mapped for search, next to ``items.json``
+with the row metadata. Collections above `IVF_MIN_ITEMS` rows also keep an
+IVF partition with int8 codes, so a query scans a few lists instead of the
+whole matrix. Documents that become processed in ``kv_store_doc_status.json``
+are embedded and appended incrementally: the retrieval page calls
+`LocalIndex.sync_if_changed` on every status refresh, which starts a
+background sync whenever the status file's mtime changes, while queries
+keep searching what is already indexed.
+"""
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from utils.context_manager import count_tokens
+from utils.graph_store import get_graph_store
+from utils.ingest import DOC_STATUS_PATH
+from utils.semantic_cache import embed_texts
+
+STORAGE_DIR = os.path.dirname(DOC_STATUS_PATH)
+INDEX_DIR = os.getenv("VECTOR_INDEX_DIR", os.path.join(".cache", "vector_index"))
+# Collections switch to IVF + int8 search once they hold this many vectors
+IVF_MIN_ITEMS = int(os.getenv("VECTOR_INDEX_IVF_MIN_ITEMS", "20000"))
+IVF_NPROBE = int(os.getenv("VECTOR_INDEX_NPROBE", "8"))
+EMBED_BATCH = int(os.getenv("VECTOR_INDEX_EMBED_BATCH", "64"))
+# Fallback chunk size when LightRAG's own text-chunk store is missing
+CHUNK_CHARS = 1200
+# Longest text sent to the embedding model per item
+_EMBED_CHARS = 2000
+_QUERY_CACHE_SIZE = 256
+KINDS = ("entities", "relations", "chunks")
+
+
+def _read_json(path):
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def _write_json(path, data):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+def _kmeans(vectors, k, iterations=10, seed=0):
+    """Spherical k-means on L2-normalised rows; returns normalised centroids."""
+    rng = np.random.default_rng(seed)
+    centroids = vectors[rng.choice(len(vectors), size=k, replace=False)].copy()
+    for _ in range(iterations):
+        assign = np.argmax(vectors @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assign, vectors)
+        empty = ~sums.any(axis=1)
+        sums[empty] = vectors[rng.choice(len(vectors), size=int(empty.sum()), replace=False)]
+        centroids = sums / np.maximum(np.linalg.norm(sums, axis=1, keepdims=True), 1e-12)
+    return centroids.astype(np.float32)
+
+
+class VectorCollection:
+    """Append-only cosine-similarity index over one kind of item.
+
+    `add` builds the new state beside the old one and swaps it in, so
+    searches running meanwhile keep using a consistent `view`.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self._vectors_path = os.path.join(path, "vectors.f32")
+        self._items_path = os.path.join(path, "items.json")
+        self._codes_path = os.path.join(path, "codes.i8")
+        self._ivf_path = os.path.join(path, "ivf.npz")
+        self._lock = threading.Lock()
+        meta = _read_json(self._items_path)
+        self.dim = meta.get("dim")
+        self.items = meta.get("items", [])
+        self.ids = {item["id"] for item in self.items}
+        self.vectors = self._map(len(self.items))
+        self.ivf = None
+        self.codes = None
+        if os.path.exists(self._ivf_path) and self.vectors is not None:
+            ivf = dict(np.load(self._ivf_path))
+            if len(ivf["assign"]) == len(self.items):
+                self.ivf, self.codes = ivf, self._map_codes(len(self.items))
+
+    def __len__(self):
+        return len(self.items)
+
+    def _map(self, n):
+        # Rows past `n` belong to an add that never finished; they are ignored and overwritten
+        if n and self.dim:
+            return np.memmap(self._vectors_path, dtype=np.float32, mode="r", shape=(n, self.dim))
+        return None
+
+    def _map_codes(self, n):
+        return np.memmap(self._codes_path, dtype=np.int8, mode="r", shape=(n, self.dim))
+
+    def view(self):
+        """``(items, vectors, ivf, codes)`` as of the last completed `add`."""
+        with self._lock:
+            return self.items, self.vectors, self.ivf, self.codes
+
+    def add(self, items, vectors):
+        """Append `items` with their L2-normalised `vectors` and persist both."""
+        if not items:
+            return
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        self.dim = self.dim or vectors.shape[1]
+        start = len(self.items)
+        all_items = self.items + list(items)
+        with open(self._vectors_path, "r+b" if os.path.exists(self._vectors_path) else "wb") as f:
+            f.seek(start * self.dim * 4)
+            f.write(vectors.tobytes())
+            f.truncate()
+        _write_json(self._items_path, {"dim": self.dim, "items": all_items})
+        mapped = self._map(len(all_items))
+        ivf = codes = None
+        if self.ivf is not None and len(all_items) <= 2 * int(self.ivf["trained_n"]):
+            ivf = self._extend_ivf(self.ivf, start, vectors)
+        elif len(all_items) >= IVF_MIN_ITEMS:
+            ivf = self._train_ivf(mapped)
+        if ivf is not None:
+            self._save_ivf(ivf)
+            codes = self._map_codes(len(all_items))
+        with self._lock:
+            self.items, self.vectors, self.ivf, self.codes = all_items, mapped, ivf, codes
+        self.ids.update(item["id"] for item in items)
+
+    def build_ivf(self, nlist=None):
+        """(Re)train the IVF partition and int8 codes over every row."""
+        items, vectors, _, _ = self.view()
+        ivf = self._train_ivf(vectors, nlist)
+        self._save_ivf(ivf)
+        codes = self._map_codes(len(items))
+        with self._lock:
+            self.ivf, self.codes = ivf, codes
+
+    def _train_ivf(self, vectors, nlist=None):
+        n = len(vectors)
+        nlist = nlist or max(1, int(np.sqrt(n)))
+        rng = np.random.default_rng(0)
+        sample = np.asarray(vectors[np.sort(rng.choice(n, size=min(n, 50 * nlist), replace=False))])
+        centroids = _kmeans(sample, nlist)
+        ivf = {"centroids": centroids, "assign": np.zeros(0, np.int32), "scales": np.zeros(0, np.float32), "trained_n": np.int64(n)}
+        # Codes go to a new file so searches still mapping the old one are unaffected
+        tmp_path = self._codes_path + ".tmp"
+        with open(tmp_path, "wb"):
+            pass
+        for lo in range(0, n, 65536):
+            ivf = self._extend_ivf(ivf, lo, np.asarray(vectors[lo:lo + 65536]), tmp_path)
+        os.replace(tmp_path, self._codes_path)
+        return ivf
+
+    def _extend_ivf(self, ivf, start, vectors, codes_path=None):
+        """Copy of `ivf` with `vectors` assigned and coded from row `start` on."""
+        assign = np.argmax(vectors @ ivf["centroids"].T, axis=1).astype(np.int32)
+        scales = np.maximum(np.abs(vectors).max(axis=1), 1e-12).astype(np.float32) / 127
+        codes = np.round(vectors / scales[:, None]).astype(np.int8)
+        with open(codes_path or self._codes_path, "r+b") as f:
+            f.seek(start * self.dim)
+            f.write(codes.tobytes())
+            f.truncate()
+        return dict(
+            ivf,
+            assign=np.concatenate([ivf["assign"][:start], assign]),
+            scales=np.concatenate([ivf["scales"][:start], scales]),
+        )
+
+    def _save_ivf(self, ivf):
+        assign = ivf["assign"]
+        order = np.argsort(assign, kind="stable").astype(np.int32)
+        offsets = np.zeros(len(ivf["centroids"]) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(assign, minlength=len(ivf["centroids"])), out=offsets[1:])
+        ivf.update(order=order, offsets=offsets)
+        tmp_path = self._ivf_path + ".tmp.npz"
+        np.savez(tmp_path, **ivf)
+        os.replace(tmp_path, self._ivf_path)
+
+    def search(self, query_vector, k, nprobe=IVF_NPROBE):
+        """Top-`k` ``(item, score)`` pairs by cosine similarity."""
+        items, vectors, ivf, codes = self.view()
+        if not items or k <= 0:
+            return []
+        if ivf is None:
+            rows = np.arange(len(items))
+            scores = vectors @ query_vector
+        else:
+            probe = np.argsort(-(ivf["centroids"] @ query_vector))[:nprobe]
+            offsets, order = ivf["offsets"], ivf["order"]
+            rows = np.sort(np.concatenate([order[offsets[c]:offsets[c + 1]] for c in probe]))
+            if not len(rows):
+                return []
+            # Shortlist on the int8 codes, then rescore the shortlist exactly
+            approx = (codes[rows].astype(np.float32) @ query_vector) * ivf["scales"][rows]
+            keep = min(len(rows), 4 * k)
+            rows = np.sort(rows[np.argpartition(-approx, keep - 1)[:keep]])
+            scores = vectors[rows] @ query_vector
+        k = min(k, len(rows))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return [(items[int(rows[i])], float(scores[i])) for i in top]
+
+
+def _doc_chunks(doc_id, text, max_chars=CHUNK_CHARS):
+    """Split a full document into line-aligned chunks when no chunk store is available."""
+    chunks, buffer = [], ""
+    for line in text.splitlines(keepends=True):
+        if buffer and len(buffer) + len(line) > max_chars:
+            chunks.append(buffer)
+            buffer = ""
+        buffer += line
+    if buffer.strip():
+        chunks.append(buffer)
+    return [{"id": f"{doc_id}:{i}", "doc_id": doc_id, "text": chunk} for i, chunk in enumerate(chunks)]
+
+
+class LocalIndex:
+    """Entity, relation and chunk collections kept in step with LightRAG's doc status store."""
+
+    def __init__(self, storage_dir=STORAGE_DIR, index_dir=INDEX_DIR, embed_fn=embed_texts):
+        self.storage_dir = storage_dir
+        self.index_dir = index_dir
+        self.embed_fn = embed_fn
+        self.collections = {kind: VectorCollection(os.path.join(index_dir, kind)) for kind in KINDS}
+        self._state_path = os.path.join(index_dir, "state.json")
+        self.indexed_docs = set(_read_json(self._state_path).get("indexed_docs", []))
+        self._status_stamp = None
+        # mtime of the doc status store when the last sync began, successful or not
+        self._attempted_stamp = None
+        self._query_cache = OrderedDict()
+        # Guards the query cache and the sync progress; `_sync_lock` keeps syncs one at a time
+        self._lock = threading.Lock()
+        self._sync_lock = threading.Lock()
+        self._sync_thread = None
+        self._progress = {"state": "idle", "documents": 0, "items_total": 0, "items_done": 0, "added": 0,
+                          "error": None, "started_at": None, "finished_at": None}
+
+    def _store(self, name):
+        return _read_json(os.path.join(self.storage_dir, name))
+
+    def pending_docs(self):
+        """Processed documents that are not in the index yet."""
+        status = self._store("kv_store_doc_status.json")
+        return [doc_id for doc_id, doc in status.items() if doc.get("status") == "processed" and doc_id not in self.indexed_docs]
+
+    def _doc_items(self, doc_ids):
+        graph = None
+        try:
+            graph = get_graph_store()
+        except Exception:
+            pass
+        entities = self._store("kv_store_full_entities.json")
+        relations = self._store("kv_store_full_relations.json")
+        status = self._store("kv_store_doc_status.json")
+        text_chunks = self._store("kv_store_text_chunks.json")
+        full_docs = None
+        items = {kind: {} for kind in KINDS}
+        for doc_id in doc_ids:
+            for name in entities.get(doc_id, {}).get("entity_names", []):
+                entity = graph.entity(name) if graph else None
+                text = f"{name} ({entity['entity_type']}): {entity['description']}" if entity else name
+                items["entities"].setdefault(name, {"id": name, "doc_id": doc_id, "text": text})
+            for source, target in relations.get(doc_id, {}).get("relation_pairs", []):
+                rel = next((r for r in graph.relations(source) if r["target"] == target), None) if graph else None
+                text = f"{source} -> {target}"
+                if rel:
+                    text += f" ({', '.join(rel['keywords'])}): {rel['description']}"
+                rel_id = "|".join(sorted((source, target)))
+                items["relations"].setdefault(rel_id, {"id": rel_id, "doc_id": doc_id, "text": text})
+            chunk_ids = status.get(doc_id, {}).get("chunks_list", [])
+            if text_chunks and all(c in text_chunks for c in chunk_ids):
+                for chunk_id in chunk_ids:
+                    items["chunks"][chunk_id] = {"id": chunk_id, "doc_id": doc_id, "text": text_chunks[chunk_id].get("content", "")}
+            else:
+                full_docs = full_docs if full_docs is not None else self._store("kv_store_full_docs.json")
+                for chunk in _doc_chunks(doc_id, full_docs.get(doc_id, {}).get("content", "")):
+                    items["chunks"][chunk["id"]] = chunk
+        return items
+
+    def _embed(self, texts, prefix, on_batch=None):
+        # nomic-embed-text expects task prefixes for asymmetric retrieval
+        vectors = []
+        for lo in range(0, len(texts), EMBED_BATCH):
+            vectors.append(self.embed_fn([prefix + t[:_EMBED_CHARS] for t in texts[lo:lo + EMBED_BATCH]]))
+            if on_batch:
+                on_batch(len(vectors[-1]))
+        return np.concatenate(vectors) if vectors else np.zeros((0, 0), np.float32)
+
+    def _report(self, **progress):
+        with self._lock:
+            self._progress.update(progress)
+
+    def _advance(self, n):
+        with self._lock:
+            self._progress["items_done"] += n
+
+    def sync(self):
+        """Embed and append items of newly processed documents; returns the number of new items.
+
+        Blocks for as long as embedding takes; the pages use `start_sync`.
+        Progress is visible through `sync_status` either way.
+        """
+        with self._sync_lock:
+            stamp = self._doc_status_stamp()
+            self._attempted_stamp = stamp
+            self._report(state="building", documents=0, items_total=0, items_done=0, added=0,
+                         error=None, started_at=time.time(), finished_at=None)
+            if stamp is not None and stamp == self._status_stamp:
+                self._report(state="finished", finished_at=time.time())
+                return 0
+            doc_ids = self.pending_docs()
+            self._report(documents=len(doc_ids))
+            try:
+                added = self._index_docs(doc_ids)
+            except Exception as e:
+                self._report(state="failed", error=str(e), finished_at=time.time())
+                raise
+            self._status_stamp = stamp
+            self._report(state="finished", finished_at=time.time())
+            return added
+
+    def _index_docs(self, doc_ids):
+        added = 0
+        if not doc_ids:
+            return added
+        pending = []
+        for kind, new_items in self._doc_items(doc_ids).items():
+            collection = self.collections[kind]
+            pending.append((collection, [item for item in new_items.values() if item["id"] not in collection.ids]))
+        self._report(items_total=sum(len(fresh) for _, fresh in pending))
+        for collection, fresh in pending:
+            if fresh:
+                collection.add(fresh, self._embed([item["text"] for item in fresh], "search_document: ", self._advance))
+                added += len(fresh)
+                self._report(added=added)
+        self.indexed_docs.update(doc_ids)
+        os.makedirs(self.index_dir, exist_ok=True)
+        _write_json(self._state_path, {"indexed_docs": sorted(self.indexed_docs)})
+        return added
+
+    def _doc_status_stamp(self):
+        try:
+            return os.stat(os.path.join(self.storage_dir, "kv_store_doc_status.json")).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def sync_if_changed(self):
+        """Start a background sync if the doc status store changed since the last sync began.
+
+        Costs one ``stat``, so it can run on every page refresh. A sync that
+        failed is retried on the next change or from the page's build button.
+        """
+        stamp = self._doc_status_stamp()
+        if stamp is None or stamp == self._attempted_stamp:
+            return False
+        return self.start_sync()
+
+    def _run_sync(self):
+        try:
+            self.sync()
+        except Exception:
+            pass  # recorded in the progress for `sync_status`
+
+    def start_sync(self):
+        """Sync in a background thread unless one is already running; returns whether one was started."""
+        with self._lock:
+            if self._sync_thread is not None and self._sync_thread.is_alive():
+                return False
+            # Reported before the thread runs so a status read right after this call sees the build
+            self._progress.update(state="building", documents=0, items_total=0, items_done=0, added=0,
+                                  error=None, started_at=time.time(), finished_at=None)
+            self._sync_thread = threading.Thread(target=self._run_sync, name="vector-index-sync", daemon=True)
+            self._sync_thread.start()
+            return True
+
+    def sync_status(self):
+        """Progress of the current or last sync (``state`` is idle, building, finished or failed) and the index size."""
+        with self._lock:
+            progress = dict(self._progress)
+        end = progress["finished_at"] or time.time()
+        progress["elapsed_s"] = end - progress["started_at"] if progress["started_at"] else 0.0
+        progress["building"] = progress["state"] == "building"
+        progress["stats"] = self.stats()
+        return progress
+
+    def _query_vector(self, text):
+        with self._lock:
+            vector = self._query_cache.get(text)
+            if vector is not None:
+                self._query_cache.move_to_end(text)
+                return vector
+        vector = self._embed([text], "search_query: ")[0]
+        with self._lock:
+            self._query_cache[text] = vector
+            if len(self._query_cache) > _QUERY_CACHE_SIZE:
+                self._query_cache.popitem(last=False)
+        return vector
+
+    def query(self, text, kg_top_k=40, chunk_top_k=10):
+        """Top entities and relations (`kg_top_k` each) and chunks (`chunk_top_k`) for `text`.
+
+        Searches what is indexed so far, also while a sync is running.
+        ``timings`` splits the query embedding from the vector search.
+        """
+        start = time.perf_counter()
+        vector = self._query_vector(text)
+        embedded = time.perf_counter()
+        result = {
+            "entities": self.collections["entities"].search(vector, int(kg_top_k)),
+            "relations": self.collections["relations"].search(vector, int(kg_top_k)),
+            "chunks": self.collections["chunks"].search(vector, int(chunk_top_k)),
+        }
+        result["timings"] = {"embed_s": embedded - start, "search_s": time.perf_counter() - embedded}
+        return result
+
+    def stats(self):
+        return dict({kind: len(c) for kind, c in self.collections.items()}, documents=len(self.indexed_docs))
+
+    def is_empty(self):
+        return not any(len(c) for c in self.collections.values())
+
+
+def _take(lines, budget):
+    taken, used = [], 0
+    for line in lines:
+        tokens = count_tokens(line)
+        if used + tokens > budget:
+            break
+        taken.append(line)
+        used += tokens
+    return taken, used
+
+
+def format_context(result, max_entity_tokens=10000, max_relation_tokens=10000, max_total_tokens=32000):
+    """Render a `LocalIndex.query` result as prompt context within LightRAG's token budgets."""
+    entities, used_e = _take((f"- {item['text']}" for item, _ in result["entities"]), max_entity_tokens)
+    relations, used_r = _take((f"- {item['text']}" for item, _ in result["relations"]), max_relation_tokens)
+    chunks, _ = _take((item["text"].strip() for item, _ in result["chunks"]), max(0, max_total_tokens - used_e - used_r))
+    return "\n".join(
+        ["-----Entities-----", *entities, "", "-----Relationships-----", *relations, "", "-----Document Chunks-----", *chunks]
+    )
+
+
+_default_index = None
+_default_lock = threading.Lock()
+
+
+def get_local_index():
+    """Return the process-wide local index (loading the memory-mapped collections on first use)."""
+    global _default_index
+    with _default_lock:
+        if _default_index is None:
+            _default_index = LocalIndex()
+        return _default_index